@@ -7,3 +7,6 @@ __version__ = '0.1.0'
 class M209Error(Exception):
     """Base Exception class for all M209 errors"""
     pass
+
+
+from .functional import cipher, CipherResult
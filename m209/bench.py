@@ -0,0 +1,257 @@
+# Copyright (C) 2013 by Brian Neal.
+# This file is part of m209, the M-209 simulation.
+# m209 is released under the MIT License (see LICENSE.txt).
+
+"""This module contains a benchmark suite for the hot paths of the m209
+package, and routines to save the results as a baseline and compare later
+results against it.
+
+Each benchmark is a function that performs one operation. It is called
+repeatedly for at least min_time seconds, and each call is timed separately so
+that median (p50) and 99th percentile (p99) latencies can be reported along
+with operations and letters per second.
+
+"""
+import collections
+import fnmatch
+import json
+import os
+import platform
+import random
+import tempfile
+import time
+
+from . import __version__
+from .converter import M209
+from .keylist.config import KeyListStore, read_key_list, write
+from .keylist.generate import (generate_key_list, generate_key_lists,
+                               generate_lugs, generate_pin_list)
+from .keylist.key_list import IndicatorIter
+from .procedure import StdProcedure
+
+
+# Message lengths, in letters, used by the encrypt and decrypt benchmarks:
+LENGTHS = (10, 100, 1000, 10000)
+
+# Minimum number of seconds each benchmark is run for:
+MIN_TIME = 0.5
+
+# Minimum number of operations timed for each benchmark:
+MIN_OPS = 10
+
+# A benchmark is considered to have regressed if it is this fraction slower
+# than the baseline (see compare()):
+THRESHOLD = 0.10
+
+# Seed for the key lists and messages used by the benchmarks:
+SEED = 'm209 bench'
+
+# A benchmark to run. func is called with no arguments to perform one
+# operation, which processes the given number of letters (0 if the operation
+# is not measured in letters).
+Benchmark = collections.namedtuple('Benchmark', 'name func letters')
+
+# The results of running a benchmark. Latencies are in seconds.
+Result = collections.namedtuple('Result',
+                                'name ops ops_per_sec letters_per_sec p50 p99')
+
+# The result of comparing a Result to the baseline. change is the fractional
+# change in speed, measured by median latency (p50), which is less affected by
+# interruptions than the mean; positive values are faster. regressed is True if
+# the benchmark is slower than the threshold allows.
+Comparison = collections.namedtuple('Comparison',
+                                    'name p50 base_p50 change regressed')
+
+
+def build_suite(key_file, lengths=LENGTHS, engine='python'):
+    """Returns a list of Benchmarks. The encrypt and decrypt benchmarks use the
+    key list for indicator AA, generated from SEED. key_file names the key list
+    file read by the read_key_list benchmarks; it is not read here, so it only
+    has to be written, by write_key_file(), before those benchmarks are run (see
+    uses_key_file()).
+
+    """
+    key_list = next(generate_key_lists(['AA'], seed=SEED))
+    rng = random.Random(SEED)
+    suite = []
+
+    m_209 = M209(key_list.lugs, key_list.pin_list, engine=engine)
+    for n in lengths:
+        plaintext = ''.join(rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+                            for _ in range(n))
+        ciphertext = m_209.encrypt(plaintext)
+        suite.append(Benchmark('M209.encrypt/{}'.format(n),
+                               lambda pt=plaintext: m_209.encrypt(pt), n))
+        suite.append(Benchmark('M209.decrypt/{}'.format(n),
+                               lambda ct=ciphertext: m_209.decrypt(ct), n))
+
+    proc = StdProcedure(key_list=key_list)
+    proc.m_209.set_engine(engine)
+    for n in lengths:
+        plaintext = 'A' * n
+        suite.append(Benchmark('StdProcedure.encrypt/{}'.format(n),
+                               lambda pt=plaintext: proc.encrypt(pt), n))
+
+    indicators = list(IndicatorIter())
+    suite.extend([
+        Benchmark('generate_lugs', generate_lugs, 0),
+        Benchmark('generate_pin_list', generate_pin_list, 0),
+        Benchmark('generate_key_list', lambda: generate_key_list('AA'), 0),
+        Benchmark('read_key_list/676',
+                  lambda: read_key_list(key_file, random.choice(indicators)),
+                  0),
+        Benchmark('read_key_list/676/parse',
+                  lambda: KeyListStore(key_file).get('ZZ'), 0),
+    ])
+    return suite
+
+
+def write_key_file(fname):
+    """Writes a key list file with all 676 key lists, generated from SEED, to
+    the file named fname.
+
+    """
+    write(fname, generate_key_lists(IndicatorIter(), seed=SEED))
+
+
+def uses_key_file(suite):
+    """Returns True if any of the Benchmarks in suite read the key list file
+    given to build_suite().
+
+    """
+    return any(b.name.startswith('read_key_list') for b in suite)
+
+
+def select(suite, patterns):
+    """Returns the Benchmarks in suite whose names match any of the given
+    shell-style wildcard patterns. If patterns is empty, suite is returned.
+
+    """
+    if not patterns:
+        return suite
+    return [b for b in suite
+            if any(fnmatch.fnmatchcase(b.name, p) for p in patterns)]
+
+
+def measure(benchmark, min_time=MIN_TIME, min_ops=MIN_OPS):
+    """Runs the benchmark and returns a Result."""
+    func = benchmark.func
+    timer = time.perf_counter
+    func()      # warm up
+
+    times = []
+    end = timer() + min_time
+    while True:
+        t0 = timer()
+        func()
+        t1 = timer()
+        times.append(t1 - t0)
+        if t1 >= end and len(times) >= min_ops:
+            break
+
+    total = sum(times)
+    ops_per_sec = len(times) / total if total else float('inf')
+    times.sort()
+    return Result(name=benchmark.name,
+                  ops=len(times),
+                  ops_per_sec=ops_per_sec,
+                  letters_per_sec=ops_per_sec * benchmark.letters,
+                  p50=percentile(times, 50),
+                  p99=percentile(times, 99))
+
+
+def percentile(values, p):
+    """Returns the p-th percentile of the sorted list values, using the nearest
+    rank method.
+
+    """
+    rank = max(1, -(-len(values) * p // 100))
+    return values[int(rank) - 1]
+
+
+def run(patterns=None, lengths=LENGTHS, engine='python', min_time=MIN_TIME):
+    """Runs the benchmarks whose names match patterns (see select()), or all of
+    them if patterns is None, and returns a list of Results.
+
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        key_file = os.path.join(tmpdir, 'bench.cfg')
+        suite = select(build_suite(key_file, lengths, engine), patterns)
+        if uses_key_file(suite):
+            write_key_file(key_file)
+
+        return [measure(benchmark, min_time) for benchmark in suite]
+
+
+def to_json(results, engine='python'):
+    """Returns a JSON-serializable dictionary for a list of Results. This is
+    the format of baseline files.
+
+    """
+    return {
+        'm209': __version__,
+        'python': platform.python_version(),
+        'engine': engine,
+        'results': [r._asdict() for r in results],
+    }
+
+
+def save_baseline(fname, results, engine='python'):
+    """Writes the list of Results to the file named fname as a baseline for
+    later runs.
+
+    """
+    with open(fname, 'w') as fp:
+        json.dump(to_json(results, engine), fp, indent=2)
+        fp.write('\n')
+
+
+def load_baseline(fname):
+    """Reads a baseline file written by save_baseline() and returns a
+    dictionary of Results keyed by benchmark name.
+
+    """
+    with open(fname, 'r') as fp:
+        data = json.load(fp)
+    return {r['name']: Result(**r) for r in data['results']}
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """Compares a list of Results to a baseline dictionary, as returned by
+    load_baseline(), and returns a list of Comparisons. Benchmarks that are
+    missing from the baseline are skipped.
+
+    """
+    comparisons = []
+    for result in results:
+        base = baseline.get(result.name)
+        if base is None or not result.p50:
+            continue
+        change = base.p50 / result.p50 - 1.0
+        comparisons.append(Comparison(name=result.name,
+                                      p50=result.p50,
+                                      base_p50=base.p50,
+                                      change=change,
+                                      regressed=change < -threshold))
+    return comparisons
+
+
+HEADER = '{:<28} {:>12} {:>12} {:>11} {:>11}'.format(
+        'benchmark', 'ops/s', 'letters/s', 'p50 (us)', 'p99 (us)')
+
+
+def format_result(result, comparison=None):
+    """Returns one line of the text report for the Result. If comparison is
+    not None, the change from the baseline is appended.
+
+    """
+    letters = ('{:12,.0f}'.format(result.letters_per_sec)
+               if result.letters_per_sec else '{:>12}'.format('-'))
+    line = '{:<28} {:12,.1f} {} {:11.1f} {:11.1f}'.format(
+            result.name, result.ops_per_sec, letters,
+            result.p50 * 1e6, result.p99 * 1e6)
+    if comparison is not None:
+        line += ' {:+8.1%}'.format(comparison.change)
+        if comparison.regressed:
+            line += ' REGRESSED'
+    return line
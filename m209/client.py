@@ -0,0 +1,416 @@
+# Copyright (C) 2013 by Brian Neal.
+# This file is part of m209, the M-209 simulation.
+# m209 is released under the MIT License (see LICENSE.txt).
+
+"""This module contains clients for the m209 server (see m209.server).
+
+The call(), encrypt() and decrypt() functions send one request over a new
+connection and wait for the response. The call() function is defined in
+m209.protocol, which can be imported without the cost of importing asyncio.
+
+The AsyncClient class keeps a pool of connections open and sends many requests
+over each without waiting for the responses. Encrypt and decrypt calls made
+close together are coalesced into batch requests. The Client class offers the
+same features to code that does not use asyncio, by running an AsyncClient in
+a background thread.
+
+A server address is either the path of a Unix domain socket or a
+(host, port) tuple for TCP.
+
+"""
+import asyncio
+import itertools
+import threading
+
+from .keylist.key_list import KeyList
+from .protocol import MAX_LINE, ServiceError, call, encode, decode, result
+
+
+# The default number of connections kept open by an AsyncClient:
+DEFAULT_POOL_SIZE = 4
+
+# The default number of encrypt or decrypt calls coalesced into one batch, and
+# the default number of seconds to wait for a batch to fill:
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_BATCH_DELAY = 0.002
+
+
+def encrypt(address, key_file, text, key_list_ind=None, ext_ind=None,
+            sys_ind=None):
+    """Asks the server to encrypt text with the key list key_list_ind from the
+    file key_file, a path relative to the server's key directory. Returns the
+    encrypted message as per StdProcedure.encrypt().
+
+    """
+    return call(address, _encrypt_request(key_file, text, key_list_ind,
+                                          ext_ind, sys_ind))
+
+
+def decrypt(address, key_file, text):
+    """Asks the server to decrypt the message text using the key lists in the
+    file key_file. Returns the plaintext.
+
+    """
+    return call(address, {'op': 'decrypt', 'key_file': key_file, 'text': text})
+
+
+class AsyncClient:
+    """An asyncio client for the m209 server at address.
+
+    Up to pool_size connections are opened as they are needed and kept open
+    until close() is called. Each request is sent on the connection with the
+    fewest requests waiting for a response.
+
+    Calls to encrypt() with the same key_file and key_list_ind, and calls to
+    decrypt() with the same key_file, are collected for up to batch_delay
+    seconds, or until batch_size calls have been collected, and then sent in
+    one batch request. The results are exactly the same as if each call was
+    sent on its own. If batch_size is 1, calls are never batched.
+
+    """
+    def __init__(self, address, pool_size=DEFAULT_POOL_SIZE,
+                 batch_size=DEFAULT_BATCH_SIZE, batch_delay=DEFAULT_BATCH_DELAY):
+        self.address = address
+        self.pool_size = pool_size
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self._connections = []
+        self._connect_lock = None
+        # (op, key_file, key_list_ind) -> _Batch
+        self._batches = {}
+        self._tasks = set()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        """Sends any batches still being collected, waits for them to finish,
+        and closes all connections.
+
+        """
+        for group in list(self._batches):
+            self._flush(group)
+        if self._tasks:
+            await asyncio.wait(list(self._tasks))
+
+        connections, self._connections = self._connections, []
+        for conn in connections:
+            await conn.close()
+
+    async def request(self, request):
+        """Sends the request dictionary to the server and returns the result. A
+        ServiceError is raised if the server reports an error.
+
+        """
+        conn = await self._get_connection()
+        return result(await conn.send(request))
+
+    async def encrypt(self, key_file, text, key_list_ind=None, ext_ind=None,
+                      sys_ind=None):
+        """Encrypts text with the key list key_list_ind from the file key_file.
+        Returns the encrypted message as per StdProcedure.encrypt().
+
+        """
+        if self.batch_size <= 1:
+            return await self.request(_encrypt_request(
+                    key_file, text, key_list_ind, ext_ind, sys_ind))
+        return await self._add(('encrypt_batch', key_file, key_list_ind),
+                               (text, ext_ind, sys_ind))
+
+    async def decrypt(self, key_file, text):
+        """Decrypts the message text using the key lists in the file key_file.
+        Returns the plaintext.
+
+        """
+        if self.batch_size <= 1:
+            return await self.request({'op': 'decrypt', 'key_file': key_file,
+                                       'text': text})
+        return await self._add(('decrypt_batch', key_file, None), (text, ))
+
+    async def encrypt_many(self, key_file, texts, key_list_ind=None,
+                           ext_inds=None, sys_inds=None):
+        """Encrypts each string in texts as per encrypt() and returns a list of
+        the encrypted messages. ext_inds and sys_inds, if given, are lists
+        with an indicator, or None, for each text.
+
+        """
+        texts = list(texts)
+        ext_inds = ext_inds or [None] * len(texts)
+        sys_inds = sys_inds or [None] * len(texts)
+        return await asyncio.gather(*(
+                self.encrypt(key_file, text, key_list_ind, ext_ind, sys_ind)
+                for text, ext_ind, sys_ind in zip(texts, ext_inds, sys_inds)))
+
+    async def decrypt_many(self, key_file, texts):
+        """Decrypts each message in texts as per decrypt() and returns a list of
+        the plaintexts.
+
+        """
+        return await asyncio.gather(*(self.decrypt(key_file, text)
+                                      for text in texts))
+
+    async def keygen(self, indicators=None, number=None, seed=None):
+        """Generates a key list for each indicator in indicators, or number key
+        lists with random indicators. Returns a list of KeyList objects.
+
+        """
+        request = {'op': 'keygen', 'seed': seed}
+        if indicators is not None:
+            request['indicators'] = list(indicators)
+        else:
+            request['number'] = number
+        return [KeyList(**d) for d in await self.request(request)]
+
+    async def _get_connection(self):
+        """Returns the connection with the fewest requests waiting for a
+        response, opening a new one if they are all busy and the pool is not
+        full.
+
+        """
+        self._connections = [c for c in self._connections if not c.closed]
+        conn = min(self._connections, key=len, default=None)
+        if conn is not None and (not len(conn) or
+                                 len(self._connections) >= self.pool_size):
+            return conn
+
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if len(self._connections) < self.pool_size:
+                try:
+                    if isinstance(self.address, str):
+                        streams = await asyncio.open_unix_connection(
+                                self.address, limit=MAX_LINE)
+                    else:
+                        streams = await asyncio.open_connection(
+                                *self.address, limit=MAX_LINE)
+                except OSError as ex:
+                    raise ServiceError("cannot connect to server: {}".format(ex))
+                self._connections.append(_Connection(*streams))
+        return min(self._connections, key=len)
+
+    async def _add(self, group, item):
+        """Adds item to the batch for group and returns its result once the
+        batch has been sent.
+
+        """
+        batch = self._batches.get(group)
+        if batch is None:
+            batch = self._batches[group] = _Batch()
+            loop = asyncio.get_running_loop()
+            batch.timer = loop.call_later(self.batch_delay, self._flush, group)
+
+        future = asyncio.get_running_loop().create_future()
+        batch.items.append(item)
+        batch.futures.append(future)
+        if len(batch.items) >= self.batch_size:
+            self._flush(group)
+        return await future
+
+    def _flush(self, group):
+        """Stops collecting the batch for group and starts sending it."""
+        batch = self._batches.pop(group, None)
+        if batch is None:
+            return
+        batch.timer.cancel()
+        task = asyncio.ensure_future(self._send_batch(group, batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send_batch(self, group, batch):
+        """Sends a batch and sets the result of each call in it."""
+        op, key_file, key_list_ind = group
+        if len(batch.items) == 1:
+            # A batch of one is sent as an ordinary request:
+            text = batch.items[0][0]
+            if op == 'encrypt_batch':
+                request = _encrypt_request(key_file, text, key_list_ind,
+                                           *batch.items[0][1:])
+            else:
+                request = {'op': 'decrypt', 'key_file': key_file, 'text': text}
+        else:
+            request = {'op': op, 'key_file': key_file,
+                       'texts': [item[0] for item in batch.items]}
+            if op == 'encrypt_batch':
+                request['key_list_ind'] = key_list_ind
+                request['ext_inds'] = [item[1] for item in batch.items]
+                request['sys_inds'] = [item[2] for item in batch.items]
+
+        try:
+            conn = await self._get_connection()
+            response = await conn.send(request)
+            if 'error' in response or len(batch.items) == 1:
+                responses = [response] * len(batch.items)
+            else:
+                responses = response.get('result')
+                if (not isinstance(responses, list) or
+                        len(responses) != len(batch.items)):
+                    raise ServiceError("invalid batch response from server")
+        except ServiceError as ex:
+            for future in batch.futures:
+                if not future.done():
+                    future.set_exception(ServiceError(str(ex)))
+            return
+
+        for future, response in zip(batch.futures, responses):
+            if not future.done():
+                try:
+                    future.set_result(result(response))
+                except ServiceError as ex:
+                    future.set_exception(ex)
+
+
+class Client:
+    """A blocking client for the m209 server at address. It runs an
+    AsyncClient, created with the same parameters, on an event loop in a
+    background thread. Calls may be made from any number of threads; calls
+    made close together are coalesced into batches.
+
+    """
+    def __init__(self, address, pool_size=DEFAULT_POOL_SIZE,
+                 batch_size=DEFAULT_BATCH_SIZE, batch_delay=DEFAULT_BATCH_DELAY):
+        self._client = AsyncClient(address, pool_size=pool_size,
+                                   batch_size=batch_size,
+                                   batch_delay=batch_delay)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever,
+                                        daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Closes all connections and stops the background thread."""
+        if self._loop.is_closed():
+            return
+        self._run(self._client.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def request(self, request):
+        """See AsyncClient.request()."""
+        return self._run(self._client.request(request))
+
+    def encrypt(self, key_file, text, key_list_ind=None, ext_ind=None,
+                sys_ind=None):
+        """See AsyncClient.encrypt()."""
+        return self._run(self._client.encrypt(key_file, text, key_list_ind,
+                                              ext_ind, sys_ind))
+
+    def decrypt(self, key_file, text):
+        """See AsyncClient.decrypt()."""
+        return self._run(self._client.decrypt(key_file, text))
+
+    def encrypt_many(self, key_file, texts, key_list_ind=None, ext_inds=None,
+                     sys_inds=None):
+        """See AsyncClient.encrypt_many()."""
+        return self._run(self._client.encrypt_many(key_file, texts,
+                                                   key_list_ind, ext_inds,
+                                                   sys_inds))
+
+    def decrypt_many(self, key_file, texts):
+        """See AsyncClient.decrypt_many()."""
+        return self._run(self._client.decrypt_many(key_file, texts))
+
+    def keygen(self, indicators=None, number=None, seed=None):
+        """See AsyncClient.keygen()."""
+        return self._run(self._client.keygen(indicators, number, seed))
+
+    def _run(self, coro):
+        """Runs the coroutine on the background event loop and returns its
+        result.
+
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+
+class _Batch:
+    """The encrypt or decrypt calls collected for one batch request."""
+
+    def __init__(self):
+        self.items = []
+        self.futures = []
+        self.timer = None
+
+
+class _Connection:
+    """A connection to the server that may have many requests waiting for a
+    response. Responses are matched to requests by id. The length of a
+    connection is the number of requests waiting.
+
+    """
+    def __init__(self, reader, writer):
+        self.writer = writer
+        self.closed = False
+        self._ids = itertools.count()
+        self._waiting = {}
+        self._reader_task = asyncio.ensure_future(self._read(reader))
+
+    def __len__(self):
+        return len(self._waiting)
+
+    async def send(self, request):
+        """Sends the request dictionary and returns the response dictionary."""
+        if self.closed:
+            raise ServiceError("connection closed")
+
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[request_id] = future
+        try:
+            try:
+                self.writer.write(encode(dict(request, id=request_id)))
+                await self.writer.drain()
+            except OSError as ex:
+                raise ServiceError("connection lost: {}".format(ex))
+            return await future
+        finally:
+            self._waiting.pop(request_id, None)
+
+    async def close(self):
+        """Closes the connection."""
+        self.closed = True
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except OSError:
+            pass
+        await self._reader_task
+
+    async def _read(self, reader):
+        """Reads responses and hands each to the request waiting for it. When
+        the connection is lost, all waiting requests fail.
+
+        """
+        error = "connection closed by server"
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = decode(line)
+                future = self._waiting.get(response.get('id'))
+                if future is not None and not future.done():
+                    future.set_result(response)
+        except (OSError, ValueError, ServiceError) as ex:
+            error = "connection lost: {}".format(ex)
+        finally:
+            self.closed = True
+            for future in self._waiting.values():
+                if not future.done():
+                    future.set_exception(ServiceError(error))
+
+
+def _encrypt_request(key_file, text, key_list_ind, ext_ind, sys_ind):
+    """Returns the request dictionary for an encrypt operation."""
+    return {'op': 'encrypt', 'key_file': key_file, 'text': text,
+            'key_list_ind': key_list_ind, 'ext_ind': ext_ind,
+            'sys_ind': sys_ind}
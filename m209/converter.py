@@ -9,31 +9,78 @@ assemble a complete M-209 converter.
 from collections import namedtuple
 import string
 
-from . import M209Error
+from . import M209Error, instrument
 from .data import KEY_WHEEL_DATA
 from .key_wheel import KeyWheel, KeyWheelError
 from .drum import Drum
+from .functional import cipher_masks
 from .utils import group_text
 
 M209_ALPHABET_LIST = string.ascii_uppercase
 M209_ALPHABET_SET = set(string.ascii_uppercase)
 CIPHER_TABLE = list(reversed(string.ascii_uppercase))
 
+# Cipher engines supported by the M209 class. The 'python' engine simulates the
+# machine one letter at a time. The 'numpy' engine computes all the drum counts
+# for a message at once and requires NumPy; see the m209.vector module.
+ENGINES = ['python', 'numpy']
+
+
+# ASCII codes used by the bytes encrypt & decrypt methods:
+LETTER_A = ord('A')
+LETTER_Z = ord('Z')
+SPACE = ord(' ')
+
 
 M209Settings = namedtuple('M209Settings', ['lugs', 'pin_list'])
 
+
+def grouped_length(n):
+    """Returns the length of n letters once grouped into 5-letter groups
+    separated by spaces.
+
+    """
+    return n + (n - 1) // 5 if n else 0
+
+
 class M209:
     """The M209 class is the top-level class in the M-209 simulation. It
     aggregates key wheels and a drum and orchestrates their movements to provide
     encrypt and decrypt functions for the operator.
 
     """
-    def __init__(self, lugs=None, pin_list=None):
-        """Build a M209 instance with the given lug & pin settings."""
+    def __init__(self, lugs=None, pin_list=None, engine='python'):
+        """Build a M209 instance with the given lug & pin settings.
+
+        The engine parameter selects the cipher engine used by encrypt() and
+        decrypt(); see set_engine().
+
+        """
         self.key_wheels = [KeyWheel(*args) for args in KEY_WHEEL_DATA]
         self.set_drum_lugs(lugs)
         self.set_all_pins(pin_list)
         self.letter_counter = 0
+        self.set_engine(engine)
+
+    def set_engine(self, engine):
+        """Selects the cipher engine used by encrypt() and decrypt(). The engine
+        parameter must be one of the names in ENGINES.
+
+        The 'python' engine is the default and simulates the machine one letter
+        at a time. The 'numpy' engine computes the drum counts for an entire
+        message at once, which is much faster for long messages. Both engines
+        produce identical results and leave the key wheels and letter counter in
+        identical states. An M209Error is raised if the 'numpy' engine is
+        requested but NumPy is not installed.
+
+        """
+        if engine not in ENGINES:
+            raise M209Error("set_engine(): invalid engine {}".format(engine))
+        if engine == 'numpy':
+            from . import vector
+            if not vector.AVAILABLE:
+                raise M209Error("set_engine(): the numpy engine requires NumPy")
+        self.engine = engine
 
     def set_pins(self, n, effective_pins):
         """Sets the pin settings on the key wheel specified by n, where n is
@@ -112,6 +159,20 @@ class M209:
             drum = Drum(lug_list)
         self.drum = drum
 
+    def set_compiled_key(self, compiled_key):
+        """Sets the drum lugs and all key wheel pins according to the given
+        CompiledKey (see m209.keylist.compiled). This is much cheaper than
+        calling set_drum_lugs() and set_all_pins() since the key settings have
+        already been parsed and validated.
+
+        """
+        if len(compiled_key.pin_masks) != len(self.key_wheels):
+            raise M209Error("set_compiled_key(): invalid pin_masks length")
+
+        self.drum = Drum.from_compiled_key(compiled_key)
+        for kw, pin_mask in zip(self.key_wheels, compiled_key.pin_masks):
+            kw.set_pin_mask(pin_mask)
+
     def set_key_wheel(self, n, c):
         """Set key wheel n to the letter c, where n is 0-5, inclusive.
 
@@ -144,12 +205,67 @@ class M209:
         letters = [kw.set_random() for kw in self.key_wheels]
         return ''.join(letters)
 
+    def advance(self, k):
+        """Advances the machine k letters, exactly as if k letters had been
+        enciphered, without performing any cipher operations. All 6 key wheels
+        are rotated k steps and the letter counter is incremented by k.
+
+        k must be a non-negative integer.
+
+        """
+        if k < 0:
+            raise M209Error("advance(): invalid letter count {}".format(k))
+
+        reg = instrument.registry
+        if reg is not None:
+            reg.count('m209.wheel_steps', k)
+        self._rotate(k)
+
+    def _rotate(self, k):
+        """Rotates all 6 key wheels k steps and adds k to the letter counter."""
+        for kw in self.key_wheels:
+            kw.rotate(k)
+        self.letter_counter += k
+
+    def seek(self, k):
+        """Moves the machine to the state it will be in when the letter counter
+        reads k. The key wheels are rotated forward or backward as necessary
+        and the letter counter is set to k.
+
+        This is useful for starting a decrypt part way through a message: set
+        the key wheels and the letter counter as for the start of the message,
+        then seek to the offset of the first letter to decrypt.
+
+        k must be a non-negative integer.
+
+        """
+        if k < 0:
+            raise M209Error("seek(): invalid letter count {}".format(k))
+
+        steps = k - self.letter_counter
+        reg = instrument.registry
+        if reg is not None:
+            reg.count('m209.wheel_steps', abs(steps))
+        self._rotate(steps)
+
     def get_settings(self):
         """Returns the current settings as a M209Settings named tuple."""
 
         return M209Settings(lugs=self.drum.key_list,
                         pin_list=[kw.effective_pins for kw in self.key_wheels])
 
+    def guide_arm_mask(self):
+        """Returns the positions of all 6 guide arms, as determined by the
+        current effective pins on the key wheels, packed into one integer.
+        Bit n is set if key wheel n has an effective pin against its guide arm.
+        The result is suitable for indexing the drum's count table.
+
+        """
+        mask = 0
+        for n, kw in enumerate(self.key_wheels):
+            mask |= ((kw.guide_pins >> kw.pos) & 1) << n
+        return mask
+
     def encrypt(self, plaintext, group=True, spaces=True):
         """Performs an encrypt operation on the given plaintext and returns
         the ciphertext as a string.
@@ -162,22 +278,24 @@ class M209:
         plaintext will raise an M209Error exception.
 
         """
-        ciphertext = []
-        for p in plaintext:
-            if p == ' ' and spaces:
-                p = 'Z'
-            ciphertext.append(self._cipher(p))
+        reg = instrument.registry
+        if reg is None:
+            return self._encrypt(plaintext, group, spaces)
 
-        if group:
-            s = group_text(ciphertext)
-        else:
-            s = ''.join(ciphertext)
-        return s
+        start, counter = instrument.clock(), self.letter_counter
+        try:
+            return self._encrypt(plaintext, group, spaces)
+        finally:
+            self._record(reg, 'm209.encrypt', start, counter)
 
-    def decrypt(self, ciphertext, spaces=True, z_sub=True):
+    def decrypt(self, ciphertext, spaces=True, z_sub=True, offset=0):
         """Performs a decrypt operation on the given ciphertext and returns the
         plaintext as a string.
 
+        If offset is non-zero, the machine is first advanced offset letters
+        (see advance()) before decrypting. This allows the tail of a message to
+        be decrypted without deciphering the letters that come before it.
+
         If spaces is True, spaces will be allowed in the input ciphertext and
         ignored. Otherwise space characters will raise an M209Error exception.
         This is useful if the input ciphertext is in 5-letter groups, separated
@@ -188,6 +306,128 @@ class M209:
         False, no such substitution will occur.
 
         """
+        if offset:
+            self.advance(offset)
+
+        reg = instrument.registry
+        if reg is None:
+            return self._decrypt(ciphertext, spaces, z_sub)
+
+        start, counter = instrument.clock(), self.letter_counter
+        try:
+            return self._decrypt(ciphertext, spaces, z_sub)
+        finally:
+            self._record(reg, 'm209.decrypt', start, counter)
+
+    def encrypt_bytes(self, plaintext, group=True, spaces=True):
+        """Performs an encrypt operation on plaintext given as a bytes-like
+        object (bytes, bytearray or memoryview) of ASCII letters, and returns
+        the ciphertext as bytes.
+
+        The group and spaces parameters have the same meaning as for encrypt().
+
+        """
+        n = len(memoryview(plaintext).cast('B'))
+        out = bytearray(grouped_length(n) if group else n)
+        self.encrypt_into(plaintext, out, group=group, spaces=spaces)
+        return bytes(out)
+
+    def decrypt_bytes(self, ciphertext, spaces=True, z_sub=True):
+        """Performs a decrypt operation on ciphertext given as a bytes-like
+        object (bytes, bytearray or memoryview) of ASCII letters, and returns
+        the plaintext as bytes.
+
+        The spaces and z_sub parameters have the same meaning as for decrypt().
+
+        """
+        out = bytearray(len(memoryview(ciphertext).cast('B')))
+        n = self.decrypt_into(ciphertext, out, spaces=spaces, z_sub=z_sub)
+        del out[n:]
+        return bytes(out)
+
+    def encrypt_into(self, plaintext, out, group=True, spaces=True):
+        """Performs an encrypt operation on plaintext given as a bytes-like
+        object of ASCII letters, writing the ciphertext into the caller supplied
+        writable buffer out. Returns the number of bytes written to out.
+
+        If group is True, the ciphertext is written into out in 5-letter groups
+        separated by spaces. In this case out must hold at least
+        grouped_length(len(plaintext)) bytes, otherwise it must hold at least
+        len(plaintext) bytes. An M209Error is raised if out is too small.
+
+        When group is False, out may be the same buffer as plaintext, in which
+        case the plaintext is encrypted in place.
+
+        The group and spaces parameters default to the same values as for
+        encrypt() and encrypt_bytes().
+
+        """
+        reg = instrument.registry
+        if reg is None:
+            return self._cipher_into(plaintext, out, spaces=spaces,
+                                     skip_spaces=False, z_sub=False,
+                                     group=group)
+
+        start, counter = instrument.clock(), self.letter_counter
+        try:
+            return self._cipher_into(plaintext, out, spaces=spaces,
+                                     skip_spaces=False, z_sub=False,
+                                     group=group)
+        finally:
+            self._record(reg, 'm209.encrypt', start, counter)
+
+    def decrypt_into(self, ciphertext, out, spaces=True, z_sub=True):
+        """Performs a decrypt operation on ciphertext given as a bytes-like
+        object of ASCII letters, writing the plaintext into the caller supplied
+        writable buffer out, which must hold at least len(ciphertext) bytes.
+        Returns the number of bytes written to out.
+
+        The out parameter may be the same buffer as ciphertext, in which case
+        the ciphertext is decrypted in place.
+
+        The spaces and z_sub parameters have the same meaning as for decrypt().
+
+        """
+        reg = instrument.registry
+        if reg is None:
+            return self._cipher_into(ciphertext, out, spaces=spaces,
+                                     skip_spaces=True, z_sub=z_sub,
+                                     group=False)
+
+        start, counter = instrument.clock(), self.letter_counter
+        try:
+            return self._cipher_into(ciphertext, out, spaces=spaces,
+                                     skip_spaces=True, z_sub=z_sub,
+                                     group=False)
+        finally:
+            self._record(reg, 'm209.decrypt', start, counter)
+
+    def _encrypt(self, plaintext, group, spaces):
+        """Performs the encrypt() operation without instrumentation."""
+        plaintext = ''.join(plaintext)
+        if spaces:
+            plaintext = plaintext.replace(' ', 'Z')
+
+        if self.engine == 'numpy':
+            ciphertext = self._vector_cipher(plaintext)
+        else:
+            ciphertext = self._cipher_text(plaintext)
+
+        if group:
+            return group_text(ciphertext)
+        return ''.join(ciphertext)
+
+    def _decrypt(self, ciphertext, spaces, z_sub):
+        """Performs the decrypt() operation without instrumentation."""
+        if self.engine == 'numpy':
+            ciphertext = ''.join(ciphertext)
+            if spaces:
+                ciphertext = ciphertext.replace(' ', '')
+            s = self._vector_cipher(ciphertext)
+            if z_sub:
+                s = s.replace('Z', ' ')
+            return s
+
         plaintext = []
         for c in ciphertext:
             if c == ' ' and spaces:
@@ -195,10 +435,85 @@ class M209:
             plaintext.append(self._cipher(c))
 
         if z_sub:
-            s = ''.join(s if s != 'Z' else ' ' for s in plaintext)
-        else:
-            s = ''.join(plaintext)
-        return s
+            return ''.join(s if s != 'Z' else ' ' for s in plaintext)
+        return ''.join(plaintext)
+
+    def _cipher_into(self, data, out, spaces, skip_spaces, z_sub, group):
+        """Common routine for the encrypt_into() and decrypt_into() methods.
+
+        Space characters are skipped if both spaces and skip_spaces are True,
+        and treated as 'Z' if spaces is True and skip_spaces is False. If z_sub
+        is True, 'Z' characters in the output are replaced with spaces. If
+        group is True, the output is written in 5-letter groups.
+
+        """
+        data = memoryview(data).cast('B')
+        out = memoryview(out).cast('B')
+        if out.readonly:
+            raise M209Error("output buffer is read-only")
+
+        n = len(data)
+        if len(out) < (grouped_length(n) if group else n):
+            raise M209Error("output buffer too small")
+
+        if self.engine == 'numpy':
+            return self._vector_cipher_into(data, out, spaces, skip_spaces,
+                                            z_sub, group)
+
+        count_table = self.drum.count_table
+        key_wheels = self.key_wheels
+        j = 0
+        for b in data:
+            if b == SPACE and spaces:
+                if skip_spaces:
+                    continue
+                b = LETTER_Z
+            if not (LETTER_A <= b <= LETTER_Z):
+                raise M209Error("Illegal char: {}".format(chr(b)))
+
+            count = count_table[self.guide_arm_mask()]
+            for kw in key_wheels:
+                kw.rotate()
+            self.letter_counter += 1
+
+            c = LETTER_Z - (b - LETTER_A - count) % 26
+            if z_sub and c == LETTER_Z:
+                c = SPACE
+            if group and j % 6 == 5:
+                out[j] = SPACE
+                j += 1
+            out[j] = c
+            j += 1
+
+        return j
+
+    def _vector_cipher_into(self, data, out, spaces, skip_spaces, z_sub, group):
+        """The numpy engine version of _cipher_into()."""
+        from . import vector
+        numpy = vector.numpy
+
+        letters = numpy.frombuffer(data, dtype=numpy.uint8)
+        if spaces:
+            is_space = letters == SPACE
+            if skip_spaces:
+                letters = letters[~is_space]
+            else:
+                letters = numpy.where(is_space, LETTER_Z, letters)
+
+        result = vector.cipher_array(self, letters)
+        if z_sub:
+            result[result == LETTER_Z] = SPACE
+
+        n = len(result)
+        dest = numpy.frombuffer(out, dtype=numpy.uint8)
+        if group:
+            index = numpy.arange(n)
+            dest[index + index // 5] = result
+            dest[5:grouped_length(n):6] = SPACE
+            return grouped_length(n)
+
+        dest[:n] = result
+        return n
 
     def _cipher(self, c):
         """Simulate a cipher operation on the device:
@@ -215,8 +530,7 @@ class M209:
         if c not in M209_ALPHABET_SET:
             raise M209Error("Illegal char: {}".format(c))
 
-        pins = [kw.is_effective() for kw in self.key_wheels]
-        count = self.drum.rotate(pins)
+        count = self.drum.count_table[self.guide_arm_mask()]
 
         for kw in self.key_wheels:
             kw.rotate()
@@ -225,3 +539,34 @@ class M209:
 
         return CIPHER_TABLE[(ord(c) - ord('A') - count) % 26]
 
+    def _cipher_text(self, text):
+        """Perform a cipher operation on all the letters in the string text at
+        once using the python engine. The key wheels and letter counter are
+        left as if each letter had been passed to _cipher().
+
+        """
+        key_wheels = self.key_wheels
+        positions = ''.join(kw.display() for kw in key_wheels)
+        pin_masks = [kw.pin_mask for kw in key_wheels]
+        result = cipher_masks(self.drum.count_table, pin_masks, positions, text)
+        self._rotate(len(text))
+        return result.text
+
+    def _vector_cipher(self, text):
+        """Perform a cipher operation on all the letters in the string text at
+        once using the numpy engine.
+
+        """
+        from . import vector
+        return vector.cipher(self, text)
+
+    def _record(self, reg, timer, start, counter):
+        """Records a cipher operation that began at time start, when the letter
+        counter read counter, in the instrumentation Registry reg. Each letter
+        ciphered takes one drum evaluation and one step of the key wheels.
+
+        """
+        letters = self.letter_counter - counter
+        reg.count('m209.drum_evaluations', letters)
+        reg.count('m209.wheel_steps', letters)
+        reg.observe(timer, instrument.clock() - start, letters)
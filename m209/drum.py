@@ -43,8 +43,15 @@ class Drum:
     The order of the bars list is not relevant as we only need to simulate
     complete revolutions of the drum cage.
 
+    Because the drum count only depends on the 6 guide arm positions, there
+    are only 64 possible answers for any given lug setting. These are computed
+    once when the lugs are installed and stored in the count_table list. The
+    table is indexed by a 6-bit pin mask, where bit n is set if key wheel n has
+    an effective pin in position against its guide arm.
+
     """
     NUM_BARS = 27
+    NUM_MASKS = 2 ** 6
 
     def __init__(self, lug_list=None):
         """Creates a Drum instance with the given lug list.
@@ -63,6 +70,7 @@ class Drum:
             self._validate_bars()
 
         self.key_list = self.to_key_list()
+        self.count_table = self._build_count_table()
 
     @classmethod
     def from_key_list(cls, lug_list):
@@ -101,6 +109,19 @@ class Drum:
 
         return cls(lug_list=bars)
 
+    @classmethod
+    def from_compiled_key(cls, compiled_key):
+        """Creates a Drum instance from a CompiledKey. The compiled key has
+        already been validated, so the lug settings are not parsed or validated
+        again and the count table is not rebuilt.
+
+        """
+        drum = cls.__new__(cls)
+        drum.bars = list(compiled_key.bars)
+        drum.key_list = compiled_key.lugs
+        drum.count_table = compiled_key.count_table
+        return drum
+
     def __str__(self):
         return self.key_list
 
@@ -147,14 +168,43 @@ class Drum:
         the 6 key wheels.
 
         """
-        count = 0
+        return self.count_table[pins_to_mask(pins)]
+
+    def rotate_mask(self, mask):
+        """Rotate the drum cage a complete revolution and return the number of
+        times a bar was shifted to the left. The mask parameter must be an
+        integer between 0-63, inclusive, where bit n is set if key wheel n
+        currently has an effective pin against its guide arm.
+
+        """
+        return self.count_table[mask]
+
+    def _build_count_table(self):
+        """Internal function to compute the drum count for all 64 possible guide
+        arm positions. Returns the counts as a list indexed by pin mask.
+
+        """
+        # Count the bars with each combination of lugs:
+        within = [0] * self.NUM_MASKS
         for lug_pair in self.bars:
+            bar_mask = 0
             for index in lug_pair:
-                if pins[index]:
-                    count += 1
-                    break
-
-        return count
+                bar_mask |= 1 << index
+            within[bar_mask] += 1
+
+        # Sum over subsets so within[m] is the number of bars whose lugs all
+        # lie within mask m:
+        for bit in range(6):
+            b = 1 << bit
+            for mask in range(self.NUM_MASKS):
+                if mask & b:
+                    within[mask] += within[mask ^ b]
+
+        # A bar shifts if any of its lugs lies within the mask, that is, unless
+        # all of its lugs lie within the complement of the mask:
+        total = within[-1]
+        full = self.NUM_MASKS - 1
+        return [total - within[full ^ mask] for mask in range(self.NUM_MASKS)]
 
     def _validate_bars(self):
         """Internal function to validate the bars list. Raises DrumError if the
@@ -189,3 +239,16 @@ class Drum:
 
             if error:
                 raise DrumError("Invalid lug pair {}".format(lug_pair))
+
+
+def pins_to_mask(pins):
+    """Converts a 6-element sequence of Bools, representing the effective states
+    of the 6 key wheels, into an integer pin mask suitable for indexing
+    Drum.count_table. Bit n of the mask is set if pins[n] is True.
+
+    """
+    mask = 0
+    for n, pin in enumerate(pins):
+        if pin:
+            mask |= 1 << n
+    return mask
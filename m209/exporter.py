@@ -0,0 +1,239 @@
+# Copyright (C) 2013 by Brian Neal.
+# This file is part of m209, the M-209 simulation.
+# m209 is released under the MIT License (see LICENSE.txt).
+
+"""This module publishes the values collected by m209.instrument in the
+Prometheus text exposition format, optionally over HTTP. Only the standard
+library is used.
+
+Every counter in the Registry is exported as m209_<name>_total, with the dots
+in the name replaced by underscores and any leading "m209." dropped, e.g.
+m209_drum_evaluations_total and m209_keylist_cache_hits_total. The
+errors.<type> counters are exported as m209_errors_total with a type label;
+every type in ERROR_TYPES is always present.
+
+Every timer is exported as a histogram named m209_<name>_seconds. Timers that
+record the number of letters ciphered, such as m209_procedure_encrypt_seconds,
+have a size label giving the smallest of SIZE_BUCKETS that is at least the
+number of letters, or "+Inf".
+
+The attempts counted by each generate_lugs() and generate_pin_list() call are
+also exported as the histograms m209_keygen_lug_attempts_per_call and
+m209_keygen_pin_attempts_per_call.
+
+Histograms are built by a Registry listener, so they only include updates made
+after the Exporter was created.
+
+"""
+import bisect
+import http.server
+import logging
+import threading
+
+from . import instrument
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Histogram bucket upper bounds for timers, in seconds:
+LATENCY_BUCKETS = (0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+                   0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+# Upper bounds, in letters, of the size label of cipher operation timers:
+SIZE_BUCKETS = (16, 256, 4096, 65536)
+
+# Histogram bucket upper bounds for keygen attempts per call:
+ATTEMPT_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048)
+
+# Counters that are also exported as histograms of the value added per call:
+ATTEMPT_COUNTERS = ('keygen.lug_attempts', 'keygen.pin_attempts')
+
+# Error types always present in m209_errors_total (see
+# instrument.count_error()):
+ERROR_TYPES = instrument.ERROR_CLASSES + (instrument.OTHER_ERROR, )
+
+logger = logging.getLogger(__name__)
+
+
+def metric_name(name):
+    """Returns the Prometheus metric name for the instrumentation name."""
+    if name.startswith('m209.'):
+        name = name[5:]
+    return 'm209_' + name.replace('.', '_')
+
+
+def format_value(value):
+    """Formats a number as per the text exposition format."""
+    if isinstance(value, int):
+        return str(value)
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+def format_labels(labels):
+    """Formats a sequence of (name, value) tuples as a label set."""
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, v) for k, v in labels) + '}'
+
+
+class Histogram:
+    """A Prometheus histogram with the given bucket upper bounds."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        """Adds one observation of value."""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels=()):
+        """Returns the sample lines for the histogram metric name, with the
+        given label set (see format_labels()).
+
+        """
+        lines = []
+        total = 0
+        bounds = self.buckets + (float('inf'), )
+        for bound, n in zip(bounds, self.counts):
+            total += n
+            le = tuple(labels) + (('le', format_value(bound)), )
+            lines.append('{}_bucket{} {}'.format(name, format_labels(le),
+                                                 total))
+        lines.append('{}_sum{} {}'.format(name, format_labels(labels),
+                                          format_value(self.sum)))
+        lines.append('{}_count{} {}'.format(name, format_labels(labels),
+                                            self.count))
+        return lines
+
+
+class Exporter:
+    """Renders the values in an instrumentation Registry in the Prometheus text
+    exposition format.
+
+    If registry is None, the active Registry is used, and instrumentation is
+    enabled if necessary. The Exporter adds a listener to the Registry to build
+    its histograms; call close() to remove it.
+
+    """
+    def __init__(self, registry=None):
+        if registry is None:
+            registry = instrument.registry or instrument.enable()
+        self.registry = registry
+        # Histograms keyed by metric name, then by label set:
+        self._histograms = {}
+        self._lock = threading.Lock()
+        registry.add_listener(self._update)
+
+    def close(self):
+        """Stops collecting histograms from the Registry."""
+        self.registry.remove_listener(self._update)
+
+    def _update(self, kind, name, value, letters):
+        """Registry listener that updates the histograms."""
+        if kind == 'timer':
+            metric = metric_name(name) + '_seconds'
+            if letters is None:
+                labels = ()
+            else:
+                n = bisect.bisect_left(SIZE_BUCKETS, letters)
+                size = SIZE_BUCKETS[n] if n < len(SIZE_BUCKETS) else '+Inf'
+                labels = (('size', size), )
+            buckets = LATENCY_BUCKETS
+        elif name in ATTEMPT_COUNTERS:
+            metric = metric_name(name) + '_per_call'
+            labels = ()
+            buckets = ATTEMPT_BUCKETS
+        else:
+            return
+
+        with self._lock:
+            histograms = self._histograms.setdefault(metric, {})
+            histogram = histograms.get(labels)
+            if histogram is None:
+                histogram = histograms[labels] = Histogram(buckets)
+            histogram.observe(value)
+
+    def render(self):
+        """Returns the current values as a string in the text exposition
+        format.
+
+        """
+        counters = self.registry.snapshot().counters
+        lines = []
+
+        errors = dict.fromkeys(ERROR_TYPES, 0)
+        for name, value in sorted(counters.items()):
+            if name.startswith('errors.'):
+                errors[name[7:]] = value
+                continue
+            metric = metric_name(name) + '_total'
+            lines.append('# TYPE {} counter'.format(metric))
+            lines.append('{} {}'.format(metric, value))
+
+        lines.append('# TYPE m209_errors_total counter')
+        for name, value in sorted(errors.items()):
+            lines.append('m209_errors_total{} {}'.format(
+                format_labels([('type', name)]), value))
+
+        with self._lock:
+            for metric, histograms in sorted(self._histograms.items()):
+                lines.append('# TYPE {} histogram'.format(metric))
+                for labels, histogram in sorted(histograms.items(),
+                                                key=_label_order):
+                    lines.extend(histogram.lines(metric, labels))
+
+        return '\n'.join(lines) + '\n'
+
+
+def _label_order(item):
+    """Sort key for histograms keyed by label set, ordering size labels
+    numerically.
+
+    """
+    labels = item[0]
+    return [(k, v if isinstance(v, int) else float('inf')) for k, v in labels]
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """HTTP request handler that serves the metrics of the server's exporter
+    at /metrics.
+
+    """
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+
+        body = self.server.exporter.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+def start_http_server(port, host='127.0.0.1', exporter=None):
+    """Starts an HTTP server that serves the metrics of exporter at /metrics
+    on host and port, in a daemon thread. If exporter is None, a new Exporter
+    for the active Registry is used. Returns the server, whose exporter
+    attribute is the Exporter; call its shutdown() and server_close() methods
+    to stop it.
+
+    """
+    server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    server.exporter = exporter if exporter is not None else Exporter()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
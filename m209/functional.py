@@ -0,0 +1,113 @@
+# Copyright (C) 2013 by Brian Neal.
+# This file is part of m209, the M-209 simulation.
+# m209 is released under the MIT License (see LICENSE.txt).
+
+"""This module contains a stateless, functional interface to the M-209 cipher.
+
+M209 objects carry mutable key wheel positions and a letter counter, so a single
+instance cannot be shared between threads without locking. The cipher()
+function in this module keeps all of its state in local variables. Given a
+CompiledKey (see m209.keylist.compiled) and the starting key wheel positions it
+returns the result along with the ending key wheel positions. It is safe to
+call from any number of threads at once.
+
+"""
+from collections import namedtuple
+
+from . import M209Error
+from .data import KEY_WHEEL_DATA
+
+
+CipherResult = namedtuple('CipherResult', ['text', 'positions'])
+
+# Static key wheel data: the letters, the number of pins, a letter to position
+# map, and the guide letter offset for each wheel:
+WHEEL_LETTERS = [letters for letters, _ in KEY_WHEEL_DATA]
+WHEEL_SIZES = [len(letters) for letters in WHEEL_LETTERS]
+WHEEL_OFFSETS = [{c: n for n, c in enumerate(letters)}
+                 for letters in WHEEL_LETTERS]
+GUIDE_OFFSETS = [letters.index(guide) for letters, guide in KEY_WHEEL_DATA]
+
+# The internal substitution table, indexed by (letter - count) % 26:
+CIPHER_TABLE = [chr(ord('Z') - n) for n in range(26)]
+
+
+def cipher(compiled_key, start_positions, text, offset=0):
+    """Perform an M-209 cipher operation on text using the supplied compiled
+    key. Since the M-209 is reciprocal, this is used for both encrypting and
+    decrypting.
+
+    compiled_key - a CompiledKey holding the lug and pin settings
+
+    start_positions - a 6 letter string of key wheel settings, left to right,
+    as they would be passed to M209.set_key_wheels()
+
+    text - the string to cipher; it must consist only of the letters 'A'-'Z'.
+    Unlike the M209 class, spaces are not treated specially and will raise an
+    M209Error.
+
+    offset - the number of letters the machine has already processed since the
+    key wheels were set to start_positions. The first letter of text is
+    ciphered as the letter at this offset in the message.
+
+    Returns a CipherResult named tuple of (text, positions), where text is the
+    result string and positions is a 6 letter string of the key wheel settings
+    after the last letter has been ciphered.
+
+    """
+    return cipher_masks(compiled_key.count_table, compiled_key.pin_masks,
+                        start_positions, text, offset)
+
+
+def cipher_masks(count_table, pin_masks, start_positions, text, offset=0):
+    """Perform an M-209 cipher operation as per cipher(), given the drum count
+    table and the six key wheel pin masks instead of a CompiledKey. This avoids
+    the cost of compiling a key when only a few letters are to be ciphered.
+
+    """
+    if len(start_positions) != 6:
+        raise M209Error("Invalid key wheels setting length")
+    if offset < 0:
+        raise M209Error("Invalid offset {}".format(offset))
+
+    # Compute the rotational position of each wheel, and a table of guide arm
+    # bits for each wheel indexed by position:
+    positions = []
+    guide_bits = []
+    for n, c in enumerate(start_positions):
+        try:
+            pos = WHEEL_OFFSETS[n][c]
+        except KeyError:
+            raise M209Error('wheel #{}: Invalid position {}'.format(n, c))
+        size = WHEEL_SIZES[n]
+        positions.append((pos + offset) % size)
+
+        pin_mask = pin_masks[n]
+        guide_offset = GUIDE_OFFSETS[n]
+        guide_bits.append([((pin_mask >> ((p + guide_offset) % size)) & 1) << n
+                           for p in range(size)])
+
+    p0, p1, p2, p3, p4, p5 = positions
+    g0, g1, g2, g3, g4, g5 = guide_bits
+    n0, n1, n2, n3, n4, n5 = WHEEL_SIZES
+
+    result = []
+    for c in text:
+        x = ord(c) - ord('A')
+        if not (0 <= x < 26):
+            raise M209Error("Illegal char: {}".format(c))
+
+        count = count_table[g0[p0] | g1[p1] | g2[p2] | g3[p3] | g4[p4] | g5[p5]]
+        result.append(CIPHER_TABLE[(x - count) % 26])
+
+        p0 = (p0 + 1) % n0
+        p1 = (p1 + 1) % n1
+        p2 = (p2 + 1) % n2
+        p3 = (p3 + 1) % n3
+        p4 = (p4 + 1) % n4
+        p5 = (p5 + 1) % n5
+
+    end_positions = ''.join(letters[p] for letters, p in
+                            zip(WHEEL_LETTERS, (p0, p1, p2, p3, p4, p5)))
+
+    return CipherResult(text=''.join(result), positions=end_positions)
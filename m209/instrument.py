@@ -0,0 +1,210 @@
+# Copyright (C) 2013 by Brian Neal.
+# This file is part of m209, the M-209 simulation.
+# m209 is released under the MIT License (see LICENSE.txt).
+
+"""This module contains opt-in instrumentation for the hot paths of the m209
+package.
+
+Instrumentation is disabled by default. Calling enable() installs a Registry
+that collects counters and timers from the M209 class, the StdProcedure class,
+key list generation and lookup, and the server until disable() is called.
+Instrumented code checks the module global registry once per call, never once
+per letter, and does nothing more when it is None, so disabled instrumentation
+costs next to nothing.
+
+Counters:
+
+m209.drum_evaluations - drum counts computed by M209 cipher operations,
+    including those for message indicators
+m209.wheel_steps - steps of the key wheels (all 6 wheels step together),
+    including advance() and seek()
+procedure.letters_encrypted - message letters encrypted by StdProcedure
+procedure.letters_decrypted - message letters decrypted by StdProcedure
+procedure.key_list_installs - key lists installed with set_key_list()
+procedure.indicator_generations - sets of message indicators generated
+keygen.lug_attempts - attempts made by generate_lugs(), counted once per call
+keygen.pin_attempts - attempts made by generate_pin_list(), counted once per
+    call
+keylist.cache_hits, keylist.cache_misses - key list file lookups answered from
+    the parsed file, and lookups that had to parse the file (see
+    m209.keylist.config.KeyListStore)
+server.key_cache_hits, server.key_cache_misses - compiled key lookups by the
+    server
+errors.<class name> - errors returned to clients by the server, by the
+    nearest of ERROR_CLASSES the exception derives from, or errors.other (see
+    count_error())
+
+Timers, in seconds:
+
+m209.encrypt, m209.decrypt - M209 encrypt and decrypt calls, including the
+    bytes and buffer versions
+procedure.encrypt, procedure.decrypt - StdProcedure encrypt() and decrypt()
+    calls, i.e. whole messages; the streaming versions are not timed
+procedure.set_key_list - key list installs
+procedure.indicators - message indicator generation
+
+The cipher operation timers also record the number of letters ciphered; see
+Registry.
+
+Instrumentation is per process; work done in worker processes, such as by
+StdProcedure.encrypt_many() or the server's worker pool, is not collected.
+
+"""
+from collections import namedtuple
+import threading
+import time
+
+
+# The clock used for timers:
+clock = time.perf_counter
+
+# The m209 exception classes errors are counted by (see count_error()). They
+# are named here, rather than imported, as their modules import this one:
+ERROR_CLASSES = ('ProcedureError', 'DrumError', 'KeyWheelError',
+                 'KeyListGenError')
+
+# The counted type of errors that aren't derived from one of ERROR_CLASSES:
+OTHER_ERROR = 'other'
+
+# Statistics for a timer; all times are in seconds.
+TimerStats = namedtuple('TimerStats', 'count total min max')
+
+# The values in a Registry at one moment: counters is a dict of counter
+# values, and timers a dict of TimerStats, keyed by name.
+Snapshot = namedtuple('Snapshot', 'counters timers')
+
+
+class Registry:
+    """Collects counter and timer values.
+
+    Listeners added with add_listener() are called with every update as it
+    happens, which lets other code aggregate the values differently, e.g. into
+    histograms. A listener is called as listener(kind, name, value, letters),
+    where kind is 'counter' and value is the increment, or kind is 'timer' and
+    value is the elapsed time in seconds. For timers of cipher operations,
+    letters is the number of letters ciphered; otherwise it is None. Listeners
+    are called in the thread that made the update and must not call back into
+    the Registry.
+
+    A Registry may be updated from many threads at once.
+
+    """
+    def __init__(self):
+        self.listeners = []
+        self._counters = {}
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    def add_listener(self, listener):
+        """Adds listener to the callables called on every update."""
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        """Removes a listener added with add_listener()."""
+        self.listeners.remove(listener)
+
+    def count(self, name, n=1):
+        """Adds n to the counter name."""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+        for listener in self.listeners:
+            listener('counter', name, n, None)
+
+    def observe(self, name, seconds, letters=None):
+        """Records one timing of seconds for the timer name. If the operation
+        timed ciphered letters, letters should be the number of them.
+
+        """
+        with self._lock:
+            stats = self._timers.get(name)
+            if stats is None:
+                stats = TimerStats(1, seconds, seconds, seconds)
+            else:
+                stats = TimerStats(stats.count + 1, stats.total + seconds,
+                                   min(stats.min, seconds),
+                                   max(stats.max, seconds))
+            self._timers[name] = stats
+        for listener in self.listeners:
+            listener('timer', name, seconds, letters)
+
+    def snapshot(self):
+        """Returns a Snapshot of the current values."""
+        with self._lock:
+            return Snapshot(counters=dict(self._counters),
+                            timers=dict(self._timers))
+
+    def reset(self):
+        """Sets all counters and timers back to zero."""
+        with self._lock:
+            self._counters.clear()
+            self._timers.clear()
+
+
+# The active Registry, or None if instrumentation is disabled:
+registry = None
+
+
+def enable(new_registry=None):
+    """Enables instrumentation, collecting values into new_registry, or into a
+    new Registry if it is None. Returns the active Registry.
+
+    """
+    global registry
+    registry = new_registry if new_registry is not None else Registry()
+    return registry
+
+
+def disable():
+    """Disables instrumentation. Returns the Registry that was active, or None.
+    """
+    global registry
+    old, registry = registry, None
+    return old
+
+
+def snapshot():
+    """Returns a Snapshot of the active Registry, or None if instrumentation
+    is disabled.
+
+    """
+    reg = registry
+    return reg.snapshot() if reg is not None else None
+
+
+def count(name, n=1):
+    """Adds n to the counter name if instrumentation is enabled."""
+    reg = registry
+    if reg is not None:
+        reg.count(name, n)
+
+
+def observe(name, seconds, letters=None):
+    """Records one timing for the timer name if instrumentation is enabled."""
+    reg = registry
+    if reg is not None:
+        reg.observe(name, seconds, letters)
+
+
+def error_type(ex):
+    """Returns the type errors.<type> the exception ex is counted under: the
+    first of ERROR_CLASSES in the method resolution order of its class, so that
+    e.g. a MessageFormatError is counted as a ProcedureError, or OTHER_ERROR.
+
+    """
+    for cls in type(ex).__mro__:
+        if (cls.__name__ in ERROR_CLASSES and
+                cls.__module__.split('.')[0] == 'm209'):
+            return cls.__name__
+    return OTHER_ERROR
+
+
+def count_error(ex):
+    """Counts the exception ex in the counter errors.<type>, where type is given
+    by error_type(), if instrumentation is enabled. The library calls this
+    where errors leave it for a client, such as in the server; applications may
+    call it for the errors they catch.
+
+    """
+    reg = registry
+    if reg is not None:
+        reg.count('errors.' + error_type(ex))
@@ -17,7 +17,18 @@ class KeyWheelError(M209Error):
 
 
 class KeyWheel:
-    """Simulates a key wheel in a M209 converter"""
+    """Simulates a key wheel in a M209 converter
+
+    Pin effectivity is stored as an integer bitmask, where bit n is set if the
+    pin for letter n is in the effective position. A second bitmask,
+    guide_pins, holds the same pins rotated by the guide letter offset. Bit n
+    of guide_pins is set if the pin against the guide arm is effective when
+    the key wheel is in rotational position n. This lets guide_bit() answer
+    with a single shift and mask.
+
+    """
+    __slots__ = ['letters', 'num_pins', 'letter_offsets', 'guide_offset',
+                 'pos', 'pin_mask', 'guide_pins', 'effective_pins']
 
     def __init__(self, letters, guide_letter, effective_pins=None):
         """Initialize a KeyWheel instance:
@@ -31,7 +42,7 @@ class KeyWheel:
         effective_pins - see the description of set_pins(), below.
 
         """
-        self.letters = list(letters)
+        self.letters = ''.join(letters)
         self.num_pins = len(self.letters)
 
         self.letter_offsets = {letter : n for n, letter in enumerate(self.letters)}
@@ -39,32 +50,41 @@ class KeyWheel:
         if self.num_pins < 1:
             raise KeyWheelError("Too few key wheel letters")
 
-        # pin effectivity list:
-        if effective_pins:
-            self.set_pins(effective_pins)
-        else:
-            self.reset_pins()
-
         try:
             self.guide_offset = self.letter_offsets[guide_letter]
         except KeyError:
             raise KeyWheelError("Invalid guide_letter")
 
+        # pin effectivity bitmasks:
+        if effective_pins:
+            self.set_pins(effective_pins)
+        else:
+            self.reset_pins()
+
         # rotational position; 0 means first letter shown to operator
         self.pos = 0
 
     def __str__(self):
         parts = []
         for n, c in enumerate(self.letters):
-            if self.pins[n]:
+            if self.pin_mask & (1 << n):
                 parts.append(c + '-')
             else:
                 parts.append('-' + c)
         return ' '.join(parts)
 
+    @property
+    def pins(self):
+        """Returns the pin effectivity as a list of Bools, one for each letter
+        on the key wheel.
+
+        """
+        return [bool(self.pin_mask & (1 << n)) for n in range(self.num_pins)]
+
     def reset_pins(self):
         """Reset all pins to the ineffective state."""
-        self.pins = [False] * self.num_pins
+        self.pin_mask = 0
+        self.guide_pins = 0
         self.effective_pins = ''
 
     def set_pins(self, effective_pins):
@@ -80,15 +100,36 @@ class KeyWheel:
         if not effective_pins:
             return
 
+        pin_mask = 0
         for letter in effective_pins:
             try:
                 n = self.letter_offsets[letter]
             except KeyError:
                 raise KeyWheelError("Invalid pin: {}".format(letter))
-            self.pins[n] = True
+            pin_mask |= 1 << n
 
+        self.set_pin_mask(pin_mask)
         self.effective_pins = effective_pins
 
+    def set_pin_mask(self, pin_mask):
+        """Sets which pins are effective from an integer bitmask, where bit n is
+        set if the pin for the nth letter on the key wheel is effective.
+
+        """
+        if not (0 <= pin_mask < (1 << self.num_pins)):
+            raise KeyWheelError("Invalid pin mask: {}".format(pin_mask))
+
+        self.pin_mask = pin_mask
+        self.effective_pins = ''.join(c for n, c in enumerate(self.letters)
+                                      if pin_mask & (1 << n))
+
+        # rotate the pin mask right by the guide offset so that bit n is the
+        # pin against the guide arm in rotational position n
+        k = self.guide_offset
+        all_pins = (1 << self.num_pins) - 1
+        self.guide_pins = ((pin_mask >> k) |
+                           (pin_mask << (self.num_pins - k))) & all_pins
+
     def rotate(self, steps=1):
         """Rotate the key wheel the given number of steps."""
         self.pos = (self.pos + steps) % self.num_pins
@@ -114,8 +155,14 @@ class KeyWheel:
         the effective position, and False otherwise.
 
         """
-        n = (self.pos + self.guide_offset) % self.num_pins
-        return self.pins[n]
+        return bool((self.guide_pins >> self.pos) & 1)
+
+    def guide_bit(self):
+        """Returns 1 if the key wheel, in the current position, has a pin in
+        the effective position, and 0 otherwise.
+
+        """
+        return (self.guide_pins >> self.pos) & 1
 
     def set_pos(self, c):
         """Sets the position of the key wheel to the letter c."""
@@ -3,3 +3,4 @@
 # m209 is released under the MIT License (see LICENSE.txt).
 
 from .key_list import KeyList
+from .compiled import CompiledKey, compile_key_list
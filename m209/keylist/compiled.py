@@ -0,0 +1,57 @@
+# Copyright (C) 2013 by Brian Neal.
+# This file is part of m209, the M-209 simulation.
+# m209 is released under the MIT License (see LICENSE.txt).
+
+"""This module defines the CompiledKey class and the function to build one
+from a KeyList.
+
+Installing a KeyList into an M209 requires parsing and validating the lug
+settings string, building the drum count table, and validating and converting
+every key wheel's pin settings. A CompiledKey holds the results of that work
+so it only needs to be done once. CompiledKey objects are immutable and
+hashable, and can be shared freely among any number of M209 and StdProcedure
+objects, including across threads.
+
+"""
+import collections
+
+from .. import M209Error
+from ..data import KEY_WHEEL_DATA
+from ..drum import Drum
+from ..key_wheel import KeyWheel
+
+
+CompiledKey = collections.namedtuple('CompiledKey',
+                ['indicator', 'lugs', 'pin_list', 'letter_check', 'bars',
+                 'count_table', 'pin_masks'])
+
+
+def compile_key_list(key_list):
+    """Builds a CompiledKey from the supplied KeyList.
+
+    The lug settings and pin list are validated; a DrumError or KeyWheelError
+    is raised if they are invalid, and an M209Error if the pin list does not
+    have exactly 6 entries.
+
+    The lugs field of the result is in normalized key list format (see
+    Drum.to_key_list()). The bars, count_table and pin_masks fields hold the
+    drum bars, drum count table and key wheel pin bitmasks, respectively, as
+    tuples.
+
+    """
+    drum = Drum.from_key_list(key_list.lugs)
+
+    if len(key_list.pin_list) != len(KEY_WHEEL_DATA):
+        raise M209Error("compile_key_list(): invalid pin_list length")
+
+    pin_masks = []
+    for (letters, guide), pins in zip(KEY_WHEEL_DATA, key_list.pin_list):
+        pin_masks.append(KeyWheel(letters, guide, pins).pin_mask)
+
+    return CompiledKey(indicator=key_list.indicator,
+                       lugs=drum.key_list,
+                       pin_list=tuple(key_list.pin_list),
+                       letter_check=key_list.letter_check,
+                       bars=tuple(drum.bars),
+                       count_table=tuple(drum.count_table),
+                       pin_masks=tuple(pin_masks))
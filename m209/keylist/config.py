@@ -32,13 +32,136 @@ check = OZGPK AFVAJ JYRZW LRJEG MOVLU M
 
 """
 import configparser
+import os
 import random
+import threading
 
 from .key_list import KeyList
+from .. import instrument
 
 WHEELS = ['wheel{}'.format(n) for n in range(1, 7)]
 
 
+class KeyListStore:
+    """An indexed view of the key lists in a key list file.
+
+    The file is parsed once and an indicator to KeyList index is built. Before
+    every lookup the file's modification time and size are checked, and the
+    index is rebuilt only if the file has changed. Lookup time therefore does
+    not depend on the size of the file.
+
+    A file that does not exist or cannot be parsed is treated as containing no
+    key lists. A section that is missing a setting does not affect the others:
+    it is left out of the index, the names of its missing settings are kept in
+    the errors dict, keyed by indicator, and looking it up raises KeyError.
+
+    """
+    def __init__(self, fname):
+        self.fname = fname
+        # The index, errors and indicators from one parse of the file, replaced
+        # together under the lock so that get() never mixes two parses:
+        self._contents = ({}, {}, [])
+        self._file_stamp = None
+        self._lock = threading.Lock()
+
+    @property
+    def index(self):
+        """The dict of KeyLists, keyed by indicator."""
+        return self._contents[0]
+
+    @property
+    def errors(self):
+        """The dict of missing setting names, keyed by indicator."""
+        return self._contents[1]
+
+    @property
+    def indicators(self):
+        """The list of indicators in the file, in order."""
+        return self._contents[2]
+
+    def get(self, indicator=None):
+        """Returns the KeyList with the given indicator, or None if not found.
+
+        If indicator is None, a key list is chosen from the file at random.
+
+        Raises KeyError if the key list's section is missing a setting.
+
+        """
+        index, errors, indicators = self.refresh()
+        if indicator is None:
+            if not indicators:
+                return None
+            indicator = random.choice(indicators)
+        if indicator in errors:
+            raise KeyError(*errors[indicator])
+        return index.get(indicator)
+
+    def refresh(self):
+        """Rebuilds the index if the file has changed since it was last read.
+        Returns the index, errors and indicators as a tuple.
+
+        """
+        try:
+            st = os.stat(self.fname)
+            file_stamp = (st.st_mtime_ns, st.st_size, st.st_ino)
+        except OSError:
+            file_stamp = None
+
+        with self._lock:
+            if file_stamp != self._file_stamp:
+                self._load()
+                self._file_stamp = file_stamp
+                instrument.count('keylist.cache_misses')
+            else:
+                instrument.count('keylist.cache_hits')
+            return self._contents
+
+    def _load(self):
+        """Parses the file and rebuilds the index. Must be called with the lock
+        held.
+
+        """
+        config = configparser.ConfigParser(interpolation=None)
+        try:
+            config.read(self.fname)
+        except configparser.Error:
+            config = configparser.ConfigParser(interpolation=None)
+
+        index = {}
+        errors = {}
+        for indicator in config.sections():
+            section = config[indicator]
+            try:
+                index[indicator] = KeyList(
+                        indicator=indicator,
+                        lugs=section['lugs'],
+                        pin_list=[section[w] for w in WHEELS],
+                        letter_check=section['check'])
+            except KeyError:
+                errors[indicator] = [k for k in ['lugs'] + WHEELS + ['check']
+                                     if k not in section]
+
+        self._contents = (index, errors, config.sections())
+
+
+# KeyListStore instances used by read_key_list(), keyed by absolute path:
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(fname):
+    """Returns the shared KeyListStore for the file named fname, creating it if
+    necessary.
+
+    """
+    path = os.path.abspath(fname)
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = KeyListStore(path)
+    return store
+
+
 def read_key_list(fname, indicator=None):
     """Reads key list information from the file given by fname.
 
@@ -47,28 +170,11 @@ def read_key_list(fname, indicator=None):
 
     If indicator is None, a key list is chosen from the file at random.
 
+    The file is only parsed again if it has changed since the last call; see
+    KeyListStore.
+
     """
-    config = configparser.ConfigParser(interpolation=None)
-    try:
-        config.read(fname)
-    except configparser.Error:
-        return None
-
-    if not config.sections():
-        return None
-
-    if indicator and indicator not in config.sections():
-        return None
-    elif indicator is None:
-        # choose one at random
-        indicator = random.choice(config.sections())
-
-    section = config[indicator]
-    return KeyList(
-            indicator=indicator,
-            lugs=section['lugs'],
-            pin_list=[section[w] for w in WHEELS],
-            letter_check=section['check'])
+    return get_store(fname).get(indicator)
 
 
 def write(fname, key_lists):
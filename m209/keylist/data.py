@@ -28,6 +28,12 @@
 # algorithm could not come up with a solution then a soldier would have
 # difficulty finding a solution as well, assuming they generated the key lists
 # by hand. If they used a computer or algorithm, I'd sure like to see it!
+#
+# Update: the m209.keylist.lug_cache module exhaustively enumerates every valid
+# overlap distribution for a selection. It finds solutions for every selection
+# in the tables below, and proves that none of the 5 commented out selections
+# have a solution under the rules our algorithm follows. The exact solver in
+# the m209.keylist.solver module independently confirms this.
 
 GROUP_A = [
     [1, 2, 3, 4, 8, 10],
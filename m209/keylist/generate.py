@@ -5,15 +5,24 @@
 """This module contains routines to generate key lists."""
 
 import collections
+from concurrent.futures import ProcessPoolExecutor
 import itertools
 import logging
 import random
 
 from .key_list import KeyList
-from ..converter import M209
-from .. import M209Error
+from .compiled import CompiledKey
+from .. import M209Error, instrument
+from ..functional import cipher_masks
+from ..key_wheel import KeyWheelError
+from ..utils import group_text
 from ..data import KEY_WHEEL_DATA
-from .data import GROUP_A, GROUP_B, ALL_DRUM_ROTATE_INPUTS
+from .data import GROUP_A, GROUP_B
+from .lug_cache import (ALL_PERMUTATIONS, TABLE_SELECTIONS, add_solutions,
+                        build_cache, cached_solutions, chunk_limit,
+                        get_solutions, num_solutions, decode_solution)
+from .pin_sampler import sample_pin_list
+from .solver import solve
 from ..drum import Drum
 
 
@@ -27,36 +36,24 @@ logger = logging.getLogger(__name__)
 # raising a KeyListGenError:
 MAX_LUG_ATTEMPTS = 2048
 
-# Maximum number of attempts to generate valid pin settings before giving up and
-# raising a KeyListGenError:
+# Maximum number of attempts to generate valid pin settings by shuffling cards
+# before giving up and raising a KeyListGenError:
 MAX_PIN_ATTEMPTS = 64
 
 # Total number of pins on all 6 wheels:
 TOTAL_PINS = sum(len(letters) for letters, _ in KEY_WHEEL_DATA)
 
-# CONSEC_MAPS is a list of dicts, one for each key wheel. Each dict key is
-# a letter. The value is the string of 7 consecutive letters that would make the
-# key setting invalid according to Army procedure. The consecutive string
-# accounts for the letters on the key wheel and wrap-around.
-
-def build_consec_map(letters):
-    """Builds a "consecutive map" for the list of letters on a key wheel. This
-    is used to validate a pin list to make sure there are not too many effective
-    or ineffective pins in a consecutive sequence.
+# WHEEL_BITS is a list of dicts, one for each key wheel. Each dict key is
+# a letter. The value is the bit for that letter's pin in the wheel's pin mask.
+WHEEL_BITS = [{c: 1 << n for n, c in enumerate(letters)}
+              for letters, _ in KEY_WHEEL_DATA]
 
-    """
-    deque = collections.deque(letters)
-    consec = {}
-    for c in letters:
-        consec[c] = ''.join(itertools.islice(deque, 0, 7))
-        deque.rotate(-1)
-    return consec
-
-CONSEC_MAPS = [build_consec_map(letters) for letters, _ in KEY_WHEEL_DATA]
+# WHEEL_MASKS is a list of pin masks with every pin on the wheel set:
+WHEEL_MASKS = [(1 << len(letters)) - 1 for letters, _ in KEY_WHEEL_DATA]
 
 
 def generate_key_list(indicator, lug_selection=None,
-        max_lug_attempts=MAX_LUG_ATTEMPTS, max_pin_attempts=MAX_PIN_ATTEMPTS):
+        max_lug_attempts=MAX_LUG_ATTEMPTS, max_pin_attempts=None):
     """Create a key list at random with the given indicator.
 
     The procedure used is based upon manuals for the M-209 as found online:
@@ -73,19 +70,19 @@ def generate_key_list(indicator, lug_selection=None,
     1942, and TM-11-380B, 20 September 1943."
 
     The algorithm we use follows the procedure outlined in reference [2]. The
-    algorithm is simple and ad-hoc in nature. When required to make a decision
-    it relies on some simple heuristics and random numbers. If it cannot come up
-    with a solution it simply tries again, up to an iteration limit. This
-    algorithm was sufficient to generate solutions for all sets of numbers in
-    group A (given enough iterations). However there were some sets of numbers
-    where our algorithm could not find a solution, even when allowed to iterate
+    algorithm was originally simple and ad-hoc in nature. When required to make
+    a decision it relied on some simple heuristics and random numbers. If it
+    could not come up with a solution it simply tried again, up to an iteration
+    limit. This algorithm was sufficient to generate solutions for all sets of
+    numbers in group A (given enough iterations). However there were some sets
+    of numbers where it could not find a solution, even when allowed to iterate
     100,000 times. See the m209.keylist.data module for the problematic entries.
-    It is not known if our algorithm is just unlucky and not able to find
-    a solution, the algorithm is flawed and can't find certain solutions, or if
-    a solution doesn't actually exist. An interesting side project would be to
-    write a program to search the solution space for a given set of numbers to
-    see if a solution could actually be found. In any event, for our purposes,
-    we just remove the problematic entries from the table.
+
+    Lug settings for sets of numbers chosen from the tables are now picked from
+    an exhaustive enumeration of every valid solution; see the
+    m209.keylist.lug_cache module. This proved that the problematic entries do
+    not have a solution, so they remain removed from the table. The heuristic
+    algorithm is still used when the caller provides their own set of numbers.
 
     """
     logger.info("Creating key list %s", indicator)
@@ -98,6 +95,64 @@ def generate_key_list(indicator, lug_selection=None,
             letter_check=letter_check)
 
 
+def generate_key_lists(indicators, seed=None, jobs=1):
+    """Generator function to create a key list for each indicator in the
+    iterable indicators. Key lists are yielded in the same order as the
+    indicators.
+
+    If jobs is greater than 1, the key lists are generated in parallel by a pool
+    of jobs worker processes.
+
+    If seed is not None, the random number generator is seeded separately for
+    each key list with a value derived from seed and the indicator. The output
+    is then the same for a given seed regardless of the number of jobs. In the
+    single job case the state of the random module is restored afterwards.
+
+    """
+    tasks = ((indicator, None if seed is None else
+              '{}:{}'.format(seed, indicator)) for indicator in indicators)
+
+    if jobs > 1:
+        # Find the lug solutions for the table selections once, here, so the
+        # workers don't each have to:
+        build_cache()
+        with ProcessPoolExecutor(max_workers=jobs,
+                                 initializer=_init_worker,
+                                 initargs=(cached_solutions(), )) as executor:
+            yield from executor.map(_generate_key_list_task, tasks)
+        return
+
+    state = random.getstate() if seed is not None else None
+    try:
+        for task in tasks:
+            yield _generate_key_list_task(task)
+    finally:
+        if state is not None:
+            random.setstate(state)
+
+
+def _init_worker(solutions):
+    """Initializes a worker process of generate_key_lists(). The random number
+    generator is seeded, and the dict of lug solutions from the parent process
+    is added to the in-memory cache.
+
+    """
+    random.seed()
+    add_solutions(solutions)
+
+
+def _generate_key_list_task(task):
+    """Generates one key list for generate_key_lists(). The task parameter is
+    a 2-tuple of (indicator, seed). If seed is not None, the random number
+    generator is seeded with it first.
+
+    """
+    indicator, seed = task
+    if seed is not None:
+        random.seed(seed)
+    return generate_key_list(indicator)
+
+
 def generate_lugs(lug_selection=None, max_attempts=MAX_LUG_ATTEMPTS):
     """Return random lug settings based on Army procedure.
 
@@ -105,9 +160,17 @@ def generate_lugs(lug_selection=None, max_attempts=MAX_LUG_ATTEMPTS):
     for driving the lug settings algorithm. If None, a set of numbers is chosen
     from the tables in appendix II of the manual.
 
-    The parameter max_lug_attempts controls how many iterations the algorithm
-    can perform to find a solution before giving up. If forced to give up,
-    a KeyListGenError is raised.
+    When the set of numbers is chosen from the tables, a solution is picked
+    uniformly at random from every valid solution for that set, as enumerated
+    by the m209.keylist.lug_cache module.
+
+    When lug_selection is provided, the numbers are kept in the order given and
+    a heuristic random search is performed. The parameter max_attempts controls
+    how many iterations the search can perform to find a solution. If the
+    search gives up and the selection appears in the tables, a solution is
+    picked from the enumerated solutions instead. Otherwise the exact solver in
+    the m209.keylist.solver module is used to find a solution. If the solver
+    proves no solution exists, a KeyListGenError is raised.
 
     """
     selection_provided = lug_selection is not None
@@ -128,9 +191,10 @@ def generate_lugs(lug_selection=None, max_attempts=MAX_LUG_ATTEMPTS):
         selection = random.choice(group)
         logger.debug("Selection: %s", selection)
 
-        # 2b: Rearrange the numbers so they appear in a random order
-        random.shuffle(selection)
-        logger.debug("Shuffled selection: %s", selection)
+        # 2b: Rearrange the numbers so they appear in a random order. This is
+        # done by pick_lugs() as it picks a solution.
+        instrument.count('keygen.lug_attempts')
+        return pick_lugs(selection, shuffle=True)
 
     # 2c: Distribution of Overlaps
     overlap = sum(selection) - 27
@@ -149,12 +213,73 @@ def generate_lugs(lug_selection=None, max_attempts=MAX_LUG_ATTEMPTS):
             else:
                 logger.debug("Failed lug placement check")
     else:
-        raise KeyListGenError("generate_lugs: too many attempts: %s" % sorted(selection))
+        instrument.count('keygen.lug_attempts', max_attempts)
+        if tuple(sorted(selection)) in TABLE_SELECTIONS:
+            logger.info("Random search failed; picking an enumerated solution")
+            return pick_lugs(selection, shuffle=False)
+        logger.info("Random search failed; running the exact solver")
+        result = solve(selection, rng=random)
+        logger.info("Solver visited %d node(s)", result.nodes)
+        if result.overlaps is None:
+            raise KeyListGenError("generate_lugs: no solution exists: %s" % selection)
+        drum = Drum(build_lug_list(selection, result.overlaps))
+        return drum.to_key_list()
     logger.info("Lugs generated in %s iteration(s)", n + 1)
+    instrument.count('keygen.lug_attempts', n + 1)
 
     return drum.to_key_list()
 
 
+def pick_lugs(selection, shuffle=True):
+    """Return lug settings picked from the enumerated solutions for selection,
+    a list of 6 integers (see the m209.keylist.lug_cache module).
+
+    If shuffle is True, the numbers in the selection are arranged in a random
+    order, and the solution is picked uniformly at random. Otherwise the
+    numbers are kept in the order given, and the first solution that can be
+    arranged that way is picked, starting from a random solution.
+
+    Raises KeyListGenError if there is no solution.
+
+    """
+    canonical = sorted(selection)
+    solutions = get_solutions(canonical)
+    n = num_solutions(solutions)
+    logger.debug("%d solutions for %s", n, canonical)
+
+    # Each permutation maps the position of a number in the sorted selection
+    # to its position on the drum.
+    if shuffle:
+        perms = ALL_PERMUTATIONS
+    else:
+        perms = [perm for perm in ALL_PERMUTATIONS
+                 if all(selection[perm[i]] == canonical[i] for i in range(6))]
+    perms = random.sample(perms, len(perms))
+
+    start = random.randrange(n) if n else 0
+    for k in range(n):
+        solution = decode_solution(solutions, (start + k) % n)
+        for perm in perms:
+            overlaps = sorted((min(perm[x], perm[y]), max(perm[x], perm[y]), c)
+                              for x, y, c in solution)
+            if check_overlaps(overlaps):
+                break
+        else:
+            continue
+        break
+    else:
+        raise KeyListGenError("generate_lugs: no solution: %s" % canonical)
+
+    arranged = [0] * 6
+    for i, number in enumerate(canonical):
+        arranged[perm[i]] = number
+    logger.debug("Arranged selection: %s", arranged)
+    logger.debug('Overlaps: %s', overlaps)
+
+    drum = Drum(build_lug_list(arranged, overlaps))
+    return drum.to_key_list()
+
+
 def distribute_overlaps(selection, overlap):
     """Distributes the overlaps over the selection and returns an overlap list.
 
@@ -172,18 +297,8 @@ def distribute_overlaps(selection, overlap):
     combs = list(itertools.combinations(range(0, 6), 2))
     random.shuffle(combs)
 
-    # chunk_limit enforces the rules:
-    # (3) Several small overlaps should be used in preference to one large
-    # overlap.
-    # (4) There must not be more than four overlaps between any two numbers.
-    if 1 <= overlap <= 3:
-        divisor = 1
-    elif 4 <= overlap <= 8:
-        divisor = 2
-    else:
-        divisor = 3
-    chunk_limit = max(1, min(4, overlap // divisor))
-    logger.debug("chunk_limit: %d", chunk_limit)
+    limit = chunk_limit(overlap)
+    logger.debug("chunk_limit: %d", limit)
 
     overlaps = []
     for c in combs:
@@ -191,7 +306,7 @@ def distribute_overlaps(selection, overlap):
             break
         x, y = c
         # Figure out the largest 'chunk' we can remove from overlap
-        max_chunk = min(remaining[x], remaining[y], overlap, chunk_limit)
+        max_chunk = min(remaining[x], remaining[y], overlap, limit)
 
         if max_chunk <= 0:
             continue
@@ -274,32 +389,32 @@ def check_lug_placement(drum):
     range 1-27, inclusive, and False otherwise.
 
     """
-    values = set()
-
-    # Loop over all possible inputs to Drum.rotate(), noting the answer each
-    # time by storing it in our values set. When the size of our set reaches 27
-    # we know we have good settings.
+    # The drum's count table already holds the answer for every possible input
+    # to Drum.rotate(). Mask 0 (no effective pins) always yields 0 and is not
+    # interesting here, so we skip it.
+    values = set(drum.count_table[1:])
+    assert(min(values) >= 1 and max(values) <= 27)
 
-    for pins in ALL_DRUM_ROTATE_INPUTS:
-        val = drum.rotate(pins)
-        assert(1 <= val <= 27)
-        values.add(val)
+    return len(values) == 27
 
-        if len(values) == 27:
-            break
-    else:
-        return False
-
-    return True
 
-
-def generate_pin_list(max_attempts=MAX_PIN_ATTEMPTS):
+def generate_pin_list(max_attempts=None):
     """Return a random pin list based on Army procedure.
 
-    The max_attempts parameter controls how many iterations the algorithm can
-    perform before giving up. If forced to give up, an KeyListGenError is raised.
+    If max_attempts is None, a valid pin list is built directly by the
+    m209.keylist.pin_sampler module. This never fails and follows the same
+    distribution as the card shuffling procedure below.
+
+    Otherwise the cards are shuffled and dealt as described in the manual
+    until a valid pin list results. The max_attempts parameter controls how
+    many iterations the algorithm can perform before giving up. If forced to
+    give up, an KeyListGenError is raised.
 
     """
+    if max_attempts is None:
+        instrument.count('keygen.pin_attempts')
+        return sample_pin_list()
+
     cards = ['R'] * 78
     cards.extend(['L'] * (156 - len(cards)))
 
@@ -314,19 +429,72 @@ def generate_pin_list(max_attempts=MAX_PIN_ATTEMPTS):
         if pin_list_check(pin_list):
             break
     else:
+        instrument.count('keygen.pin_attempts', max_attempts)
         raise KeyListGenError("generate_pin_list: too many attempts")
 
     logger.info("Pin list generated in %s iteration(s)", n + 1)
+    instrument.count('keygen.pin_attempts', n + 1)
 
     return pin_list
 
 
-def generate_letter_check(lugs, pin_list):
-    """Return a letter check string for the given pin list and lug settings."""
+def generate_letter_check(lugs=None, pin_list=None, compiled_key=None):
+    """Return a letter check string for the given pin list and lug settings, or
+    for the CompiledKey compiled_key if it is not None.
+
+    The letter check is computed straight from the drum count table and key
+    wheel pin masks without building an M209.
 
-    m_209 = M209(lugs, pin_list)
-    m_209.set_key_wheels('A' * 6)
-    return m_209.encrypt('A' * 26, group=True)
+    A DrumError or KeyWheelError is raised if the settings are invalid, and an
+    M209Error if there are not exactly 6 key wheels' worth of pins.
+
+    """
+    if compiled_key is not None:
+        count_table = compiled_key.count_table
+        pin_masks = compiled_key.pin_masks
+        if len(pin_masks) != len(KEY_WHEEL_DATA):
+            raise M209Error("generate_letter_check(): invalid pin_masks length")
+    else:
+        if len(pin_list) != len(KEY_WHEEL_DATA):
+            raise M209Error("generate_letter_check(): invalid pin_list length")
+        count_table = Drum.from_key_list(lugs).count_table
+        pin_masks = []
+        for n, pins in enumerate(pin_list):
+            try:
+                pin_masks.append(wheel_pins_to_mask(n, pins))
+            except KeyError as ex:
+                raise KeyWheelError("Invalid pin: {}".format(ex.args[0]))
+
+    result = cipher_masks(count_table, pin_masks, 'A' * 6, 'A' * 26)
+    return group_text(result.text)
+
+
+def verify_letter_checks(key_lists):
+    """Verifies the letter check of every key list in the iterable key_lists.
+    The items may be KeyList or CompiledKey objects. Key lists without a letter
+    check are skipped.
+
+    Returns a list of the key lists whose letter check is wrong, or whose lug
+    or pin settings are invalid.
+
+    """
+    failures = []
+    for key_list in key_lists:
+        if not key_list.letter_check:
+            continue
+        try:
+            if isinstance(key_list, CompiledKey):
+                check = generate_letter_check(compiled_key=key_list)
+            else:
+                check = generate_letter_check(key_list.lugs, key_list.pin_list)
+        except M209Error:
+            failures.append(key_list)
+            continue
+
+        if check.split() != key_list.letter_check.split():
+            failures.append(key_list)
+
+    return failures
 
 
 def pin_list_check(pin_list):
@@ -337,7 +505,9 @@ def pin_list_check(pin_list):
     non-effective pins on any wheel.
 
     """
-    num_eff = sum(len(s) for s in pin_list)
+    masks = [wheel_pins_to_mask(n, pins) for n, pins in enumerate(pin_list)]
+
+    num_eff = sum(bin(mask).count('1') for mask in masks)
     ratio = num_eff / TOTAL_PINS
 
     if not (0.4 <= ratio <= 0.6):
@@ -346,34 +516,57 @@ def pin_list_check(pin_list):
 
     # Check for more than 6 consecutive effective pins on a wheel
 
-    for n, pins in enumerate(pin_list):
-        if check_consecutive(n, pins):
+    for n, mask in enumerate(masks):
+        if has_long_run(n, mask):
             logger.debug("Pin list consecutive effective check failed")
             return False
 
     # Check for more than 6 consecutive ineffective pins on a wheel
 
-    for n, pins in enumerate(pin_list):
-        if check_consecutive(n, invert_pins(n, pins)):
+    for n, mask in enumerate(masks):
+        if has_long_run(n, mask ^ WHEEL_MASKS[n]):
             logger.debug("Pin list consecutive ineffective check failed")
             return False
 
     return True
 
 
+def wheel_pins_to_mask(n, pins):
+    """Converts pins, a string of the effective pins on key wheel n, into a pin
+    mask. Bit k of the mask is set if the kth letter on the wheel is effective.
+
+    """
+    bits = WHEEL_BITS[n]
+    mask = 0
+    for c in pins:
+        mask |= bits[c]
+    return mask
+
+
+def has_long_run(n, mask):
+    """Returns True if the pin mask for key wheel n has more than 6 consecutive
+    bits set, accounting for wrap-around, and False otherwise.
+
+    """
+    # Place two copies of the mask side by side so that runs which wrap around
+    # the wheel appear as ordinary runs of bits:
+    x = mask | (mask << WHEEL_MASKS[n].bit_length())
+
+    # After each step, bit k is set only if bits k through k + m are all set,
+    # for m = 1, 3, and finally 6:
+    x &= x >> 1
+    x &= x >> 2
+    x &= x >> 3
+    return x != 0
+
+
 def check_consecutive(n, pins):
     """Check for consecutive pins on key wheel n. The pins parameter must be
     a string of the pins that are effective. Returns True if there are more than
     6 consecutive effective pins and False otherwise.
 
     """
-    consec = CONSEC_MAPS[n]
-    deque = collections.deque(pins)
-    for c in pins:
-        if consec[c] == ''.join(itertools.islice(deque, 0, 7)):
-            return True
-        deque.rotate(-1)
-    return False
+    return has_long_run(n, wheel_pins_to_mask(n, pins))
 
 
 def invert_pins(n, pins):
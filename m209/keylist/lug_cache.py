@@ -0,0 +1,486 @@
+# Copyright (C) 2013 by Brian Neal.
+# This file is part of m209, the M-209 simulation.
+# m209 is released under the MIT License (see LICENSE.txt).
+
+"""This module contains an exhaustive enumerator of lug settings solutions for
+the lug selections found in the GROUP_A and GROUP_B tables, along with an
+on-disk cache of the results.
+
+A solution is an overlap distribution for a selection of 6 numbers: for each of
+the 15 pairs of key wheel positions, the number of bars that have lugs in both
+positions (a "chunk"). A distribution is valid if:
+
+    * the chunks sum to the overlap (sum of the selection - 27)
+    * no chunk exceeds the chunk limit for the overlap (see chunk_limit())
+    * no position is involved in more overlaps than its number allows
+    * if there are 3 or more overlaps, at least 4 of the 6 numbers are involved
+    * the resulting drum can generate all values in the range 1-27, inclusive
+
+These rules do not depend on the order of the numbers in the selection, so
+solutions are enumerated and cached for the sorted selection only. The
+remaining Army rule, that overlaps include numbers which are side by side and
+numbers which are separated, does depend on the order and is applied when a
+solution is picked; see generate_lugs() in the m209.keylist.generate module.
+Any solution with 2 or more overlaps can always be arranged to satisfy it.
+
+Each solution is stored as a 5 byte integer, the 15 chunks being the digits of
+a base 5 number. The solutions for each selection are kept in memory as a bytes
+object.
+
+The solutions for every selection in the tables are shipped with the package
+in TABLE_FILE, so picking lug settings for them never requires an enumeration.
+TABLE_FILE is loaded on first use, which takes a few milliseconds; it can be
+rebuilt with write_table().
+
+Solutions for other selections are enumerated on demand. They can also be
+cached on disk, but only if a cache directory is given by the M209_CACHE_DIR
+environment variable or set_cache_dir(). There is one file per selection in
+that directory. user_cache_dir() returns the conventional location,
+~/.cache/m209 (or $XDG_CACHE_HOME/m209). build_cache() fills the caches for
+many selections ahead of time.
+
+"""
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import logging
+import lzma
+import operator
+import os
+import tempfile
+import threading
+
+from .data import GROUP_A, GROUP_B
+
+
+logger = logging.getLogger(__name__)
+
+# Bump this if the rules change so old cache files are ignored:
+CACHE_VERSION = 1
+
+# The 15 pairs of key wheel positions, in the order their chunks are encoded:
+PAIRS = list(itertools.combinations(range(6), 2))
+
+# Size of one encoded solution in bytes (5 ** 15 < 2 ** 40):
+SOLUTION_SIZE = 5
+
+# All sorted selections found in the tables:
+TABLE_SELECTIONS = frozenset(tuple(sorted(s)) for s in GROUP_A + GROUP_B)
+
+# The file of precomputed solutions for TABLE_SELECTIONS (see write_table()):
+TABLE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'lugs-v{}.xz'.format(CACHE_VERSION))
+
+# All the ways to arrange 6 numbers on the drum:
+ALL_PERMUTATIONS = list(itertools.permutations(range(6)))
+
+# For each pair, the pin masks that include both positions of the pair:
+_PAIR_SUPERSETS = [[m for m in range(64) if (m >> x) & 1 and (m >> y) & 1]
+                   for x, y in PAIRS]
+
+_ALL_COUNTS = frozenset(range(1, 28))
+
+
+def user_cache_dir():
+    """Returns the conventional per-user cache directory, ~/.cache/m209 (or
+    $XDG_CACHE_HOME/m209). It is not used unless passed to set_cache_dir().
+
+    """
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+            os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'm209')
+
+
+_cache_dir = os.environ.get('M209_CACHE_DIR') or None
+_solutions = {}
+_lock = threading.Lock()
+
+# The solutions loaded from TABLE_FILE, or None if not loaded yet:
+_table = None
+
+
+def get_cache_dir():
+    """Returns the directory used for the on-disk cache, or None if solutions
+    are only cached in memory.
+
+    """
+    with _lock:
+        return _cache_dir
+
+
+def set_cache_dir(path):
+    """Sets the directory used for the on-disk cache and clears the in-memory
+    cache. If path is None, solutions are only cached in memory.
+
+    """
+    global _cache_dir
+    with _lock:
+        _cache_dir = path
+        _solutions.clear()
+
+
+def chunk_limit(overlap):
+    """Returns the largest chunk of the overlap that may be placed on any one
+    pair of positions.
+
+    This enforces the rules:
+    (3) Several small overlaps should be used in preference to one large
+    overlap.
+    (4) There must not be more than four overlaps between any two numbers.
+
+    """
+    if 1 <= overlap <= 3:
+        divisor = 1
+    elif 4 <= overlap <= 8:
+        divisor = 2
+    else:
+        divisor = 3
+    return max(1, min(4, overlap // divisor))
+
+
+def enumerate_solutions(selection):
+    """Returns a list of every valid overlap distribution for the selection, a
+    list of 6 integers. Each distribution is a 15-tuple of chunks, one for each
+    pair in PAIRS. The selection is used in the order given.
+
+    """
+    results = []
+    SolutionSearch(selection).run(results.append)
+    return results
+
+
+class SolutionSearch:
+    """A depth-first search over the valid overlap distributions for a
+    selection of 6 numbers, used in the order given.
+
+    The pairs are given chunks in the order given by order, a list of indexes
+    into PAIRS, or in PAIRS order if it is None. The chunks tried for each
+    pair go up from 0, unless rng, a random.Random instance (or the random
+    module), is given to shuffle them. Branches are pruned as soon as the
+    remaining overlap can no longer be placed.
+
+    The drum count for pin mask m is the sum of the numbers in m less the
+    chunks of the pairs within m, since a bar with both lugs against effective
+    guide arms only shifts once. The chunk sums are maintained incrementally
+    as the search descends so each candidate can be checked quickly.
+
+    The nodes attribute counts the search nodes visited so far.
+
+    """
+    def __init__(self, selection, order=None, rng=None):
+        self.selection = list(selection)
+        self.order = list(range(len(PAIRS))) if order is None else list(order)
+        self.rng = rng
+        self.nodes = 0
+
+    def run(self, visit, prefix=()):
+        """Calls visit() with every valid distribution, a 15-tuple of chunks,
+        one for each pair in PAIRS. The search stops as soon as visit() returns
+        a true value, and run() returns True; otherwise it returns False once
+        the search is exhausted.
+
+        If prefix is given, the first len(prefix) pairs in the search order are
+        given those chunks instead of being searched.
+
+        """
+        selection = self.selection
+        order = self.order
+        rng = self.rng
+        overlap = sum(selection) - 27
+        limit = chunk_limit(overlap)
+        sums = [sum(n for i, n in enumerate(selection) if (m >> i) & 1)
+                for m in range(64)]
+        pair_sums = [0] * 64
+        remaining = list(selection)
+        chunks = [0] * len(PAIRS)
+
+        # The most overlap the pairs from position k onwards in order can
+        # absorb:
+        capacity = [limit * (len(order) - k) for k in range(len(order) + 1)]
+
+        def place(i, chunk):
+            x, y = PAIRS[i]
+            remaining[x] -= chunk
+            remaining[y] -= chunk
+            chunks[i] += chunk
+            for m in _PAIR_SUPERSETS[i]:
+                pair_sums[m] += chunk
+
+        def search(k, left):
+            self.nodes += 1
+            if left == 0:
+                counts = set(map(operator.sub, sums[1:], pair_sums[1:]))
+                if _ALL_COUNTS <= counts and _most_of_six(chunks):
+                    return visit(tuple(chunks))
+                return False
+            if left > capacity[k] or 2 * left > sum(remaining):
+                return False
+
+            i = order[k]
+            x, y = PAIRS[i]
+            values = list(range(min(limit, remaining[x], remaining[y], left)
+                                + 1))
+            if rng is not None:
+                rng.shuffle(values)
+            # Only the change from the previous chunk is placed each time:
+            for chunk in values:
+                if chunk != chunks[i]:
+                    place(i, chunk - chunks[i])
+                if search(k + 1, left - chunk):
+                    return True
+            if chunks[i]:
+                place(i, -chunks[i])
+            return False
+
+        left = overlap
+        for i, chunk in zip(order, prefix):
+            place(i, chunk)
+            left -= chunk
+        if left < 0 or min(remaining) < 0:
+            return False
+        return bool(search(len(prefix), left))
+
+
+def _most_of_six(chunks):
+    """Returns True if the distribution satisfies the rule "most of the six
+    numbers should be involved", which we only check with 3 or more overlaps.
+
+    """
+    used = [PAIRS[i] for i, chunk in enumerate(chunks) if chunk]
+    if len(used) < 3:
+        return True
+    return len(set(itertools.chain.from_iterable(used))) > 3
+
+
+def encode_solutions(solutions):
+    """Encodes a list of distributions as returned by enumerate_solutions() into
+    a compact bytes object.
+
+    """
+    data = bytearray()
+    for chunks in solutions:
+        value = 0
+        for chunk in chunks:
+            value = value * 5 + chunk
+        data += value.to_bytes(SOLUTION_SIZE, 'big')
+    return bytes(data)
+
+
+def num_solutions(data):
+    """Returns the number of solutions in the encoded bytes object data."""
+    return len(data) // SOLUTION_SIZE
+
+
+def decode_solution(data, n):
+    """Decodes the nth solution in the encoded bytes object data. Returns an
+    overlap list of 3-tuples of the form (position1, position2, overlap), as
+    used by the m209.keylist.generate module.
+
+    """
+    i = n * SOLUTION_SIZE
+    value = int.from_bytes(data[i:i + SOLUTION_SIZE], 'big')
+    chunks = []
+    for _ in PAIRS:
+        value, chunk = divmod(value, 5)
+        chunks.append(chunk)
+    chunks.reverse()
+    return [(x, y, chunk) for (x, y), chunk in zip(PAIRS, chunks) if chunk]
+
+
+def get_solutions(selection):
+    """Returns the encoded solutions for the selection, in sorted order, as a
+    bytes object. The in-memory cache is checked first, then TABLE_FILE, then
+    the on-disk cache. If not found, the solutions are enumerated and stored in
+    the in-memory and on-disk caches.
+
+    """
+    key = tuple(sorted(selection))
+    data = _find_solutions(key)
+    if data is None:
+        logger.info("Enumerating lug solutions for %s", list(key))
+        data = _enumerate_encoded(key)
+        _store_solutions({key: data}, write=True)
+    return data
+
+
+def build_cache(selections=None, jobs=1):
+    """Fills the cache with the solutions for every selection, enumerating
+    those not already cached or in TABLE_FILE. If selections is None, all
+    selections in GROUP_A and GROUP_B are used. If jobs is greater than 1, the
+    enumeration is done by a pool of worker processes.
+
+    Returns a dict mapping each sorted selection tuple to its number of
+    solutions.
+
+    """
+    if selections is None:
+        selections = sorted(TABLE_SELECTIONS)
+    keys = sorted(set(tuple(sorted(s)) for s in selections))
+
+    found = {}
+    for key in keys:
+        data = _find_solutions(key)
+        if data is not None:
+            found[key] = data
+    _store_solutions(found, write=False)
+
+    missing = [key for key in keys if key not in found]
+    if jobs > 1 and len(missing) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(_enumerate_encoded, missing))
+    else:
+        results = [_enumerate_encoded(key) for key in missing]
+    enumerated = dict(zip(missing, results))
+    _store_solutions(enumerated, write=True)
+
+    found.update(enumerated)
+    return {key: num_solutions(data) for key, data in found.items()}
+
+
+def cached_solutions():
+    """Returns a dict of the encoded solutions in the in-memory cache, keyed by
+    sorted selection tuple, for use with add_solutions().
+
+    """
+    with _lock:
+        return dict(_solutions)
+
+
+def add_solutions(solutions):
+    """Adds a dict of encoded solutions, as returned by cached_solutions(), to
+    the in-memory cache. This lets worker processes share the solutions
+    already found by their parent.
+
+    """
+    _store_solutions(solutions, write=False)
+
+
+def write_table(fname=TABLE_FILE, jobs=1):
+    """Enumerates the solutions for every selection in TABLE_SELECTIONS and
+    writes them to the file fname, in the format read into the cache from
+    TABLE_FILE. If jobs is greater than 1, the work is done by a pool of worker
+    processes.
+
+    The file is xz compressed. Each selection is stored as its 6 numbers, one
+    byte each, followed by its number of solutions as a 4 byte big-endian
+    integer and the encoded solutions.
+
+    """
+    keys = sorted(TABLE_SELECTIONS)
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(_enumerate_encoded, keys))
+    else:
+        results = [_enumerate_encoded(key) for key in keys]
+
+    with lzma.open(fname, 'wb') as fp:
+        for key, data in zip(keys, results):
+            fp.write(bytes(key))
+            fp.write(num_solutions(data).to_bytes(4, 'big'))
+            fp.write(data)
+
+
+def read_table(fname):
+    """Reads a file written by write_table() and returns a dict of encoded
+    solutions keyed by sorted selection tuple.
+
+    """
+    with lzma.open(fname, 'rb') as fp:
+        contents = fp.read()
+
+    solutions = {}
+    i = 0
+    while i < len(contents):
+        key = tuple(contents[i:i + 6])
+        n = int.from_bytes(contents[i + 6:i + 10], 'big')
+        i += 10
+        solutions[key] = contents[i:i + n * SOLUTION_SIZE]
+        i += n * SOLUTION_SIZE
+    return solutions
+
+
+def _load_table():
+    """Returns the solutions from TABLE_FILE, reading it on first use. If the
+    file cannot be read, a warning is logged and an empty dict is returned, so
+    the solutions are enumerated instead.
+
+    """
+    global _table
+    with _lock:
+        if _table is None:
+            try:
+                _table = read_table(TABLE_FILE)
+            except (OSError, lzma.LZMAError) as ex:
+                logger.warning("Unable to read lug table %s: %s", TABLE_FILE,
+                               ex)
+                _table = {}
+        return _table
+
+
+def _find_solutions(key):
+    """Returns the encoded solutions for a sorted selection tuple from the
+    in-memory cache, TABLE_FILE or the on-disk cache, or None if not found.
+
+    """
+    with _lock:
+        data = _solutions.get(key)
+        cache_dir = _cache_dir
+    if data is not None:
+        return data
+
+    if key in TABLE_SELECTIONS:
+        data = _load_table().get(key)
+    if data is None and cache_dir:
+        data = _read_cache_file(_cache_path(cache_dir, key))
+    if data is not None:
+        with _lock:
+            _solutions[key] = data
+    return data
+
+
+def _store_solutions(solutions, write):
+    """Adds a dict of encoded solutions to the in-memory cache, and if write is
+    True, to the on-disk cache if there is one.
+
+    """
+    with _lock:
+        _solutions.update(solutions)
+        cache_dir = _cache_dir
+    if write and cache_dir:
+        for key, data in solutions.items():
+            _write_cache_file(_cache_path(cache_dir, key), data)
+
+
+def _enumerate_encoded(key):
+    """Enumerates and encodes the solutions for a sorted selection tuple."""
+    return encode_solutions(enumerate_solutions(list(key)))
+
+
+def _cache_path(cache_dir, key):
+    """Returns the path of the cache file for a sorted selection tuple."""
+    name = 'lugs-v{}-{}.bin'.format(CACHE_VERSION, '-'.join(str(n) for n in key))
+    return os.path.join(cache_dir, name)
+
+
+def _read_cache_file(path):
+    """Returns the contents of a cache file, or None if it cannot be read."""
+    try:
+        with open(path, 'rb') as fp:
+            data = fp.read()
+    except OSError:
+        return None
+    if len(data) % SOLUTION_SIZE:
+        logger.warning("Ignoring corrupt lug cache file %s", path)
+        return None
+    return data
+
+
+def _write_cache_file(path, data):
+    """Atomically writes a cache file. Failures are logged and ignored."""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(data)
+        os.replace(tmp_path, path)
+    except OSError as ex:
+        logger.warning("Unable to write lug cache file %s: %s", path, ex)
@@ -0,0 +1,202 @@
+# Copyright (C) 2013 by Brian Neal.
+# This file is part of m209, the M-209 simulation.
+# m209 is released under the MIT License (see LICENSE.txt).
+
+"""This module contains a sampler that builds valid pin lists directly.
+
+The Army procedure for pin settings shuffles 78 "R" cards and 78 "L" cards and
+deals them out over the 131 pins of the six key wheels. The result is rejected
+and the procedure repeated if fewer than 40% or more than 60% of the pins are
+effective, or if any wheel has more than 6 consecutive effective or ineffective
+pins (accounting for wrap-around).
+
+Under that procedure every arrangement of the pins with K effective pins is
+equally likely, with a probability proportional to C(25, 78 - K), the number of
+ways the 25 undealt cards can hold the remaining "R" cards. This module
+samples from exactly the same distribution, restricted to the valid pin lists,
+without any rejection:
+
+    1. Pick the total K, weighting each value by C(25, 78 - K) times the number
+       of valid pin lists with K effective pins.
+    2. Split K among the wheels in proportion to the number of valid pin lists
+       with each split.
+    3. Build each wheel's pins uniformly at random from the valid sequences
+       with its share of the effective pins.
+
+The 40-60% ratio rule is implied since C(25, 78 - K) is zero unless K is
+between 53 and 78 (40.5% to 59.5%).
+
+A valid wheel alternates between r runs of effective pins and r runs of
+ineffective pins, each 1 to 6 pins long. Marking one run of effective pins,
+there are n ways to place it on a wheel of n pins, so the number of valid
+sequences with r runs of each kind is C(k, r) * C(n - k, r) * n / r, where
+C(s, r) counts the ways to split s pins into r runs. To build a wheel we pick
+r, split the pins into runs, and rotate the result to a random position.
+
+"""
+import bisect
+import functools
+import itertools
+import math
+import random
+
+from ..data import KEY_WHEEL_DATA
+
+
+# The number of "R" cards and the total number of cards in the deck:
+R_CARDS = 78
+TOTAL_CARDS = 156
+
+# The longest run of effective or ineffective pins allowed on a wheel:
+MAX_RUN = 6
+
+WHEEL_SIZES = [len(letters) for letters, _ in KEY_WHEEL_DATA]
+TOTAL_PINS = sum(WHEEL_SIZES)
+MAX_PINS = max(WHEEL_SIZES)
+
+# COMPOSITIONS[r][s] is the number of ways to split s pins into r runs of 1 to
+# MAX_RUN pins each:
+COMPOSITIONS = [[1] + [0] * MAX_PINS]
+for _ in range(MAX_PINS):
+    COMPOSITIONS.append([sum(COMPOSITIONS[-1][s - n]
+                             for n in range(1, min(s, MAX_RUN) + 1))
+                         for s in range(MAX_PINS + 1)])
+
+# RUN_WEIGHTS[r][s] is a list of cumulative weights for the length of the first
+# run when splitting s pins into r runs:
+RUN_WEIGHTS = [[list(itertools.accumulate(
+                    COMPOSITIONS[r - 1][s - n] if n <= s else 0
+                    for n in range(1, MAX_RUN + 1))) if r else None
+                for s in range(MAX_PINS + 1)]
+               for r in range(MAX_PINS + 1)]
+
+# Multiplier that makes n / r an integer for every possible number of runs r:
+_RUNS_SCALE = math.lcm(*range(1, MAX_PINS // 2 + 1))
+
+
+def sample_pin_list(rng=random):
+    """Return a random valid pin list. The rng parameter is the source of
+    random numbers; it may be a random.Random instance or the random module.
+
+    """
+    # Pick the total number of effective pins:
+    total = _choose(rng, _total_weights())
+
+    pin_list = []
+    for n, (letters, _) in enumerate(KEY_WHEEL_DATA):
+        # Pick this wheel's share of the effective pins:
+        k = _choose(rng, _split_weights(n, total))
+        total -= k
+
+        bits = sample_wheel(WHEEL_SIZES[n], k, rng)
+        pin_list.append(''.join(itertools.compress(letters, bits)))
+
+    return pin_list
+
+
+def sample_wheel(size, k, rng=random):
+    """Returns a list of size bits, chosen uniformly at random from the valid
+    circular pin sequences with k effective pins.
+
+    """
+    runs = _choose(rng, _runs_weights(size, k)) + 1
+    effective = _split_runs(rng, runs, k)
+    ineffective = _split_runs(rng, runs, size - k)
+
+    bits = []
+    for a, b in zip(effective, ineffective):
+        bits.extend([1] * a)
+        bits.extend([0] * b)
+
+    offset = rng.randrange(size)
+    return bits[offset:] + bits[:offset]
+
+
+@functools.lru_cache(maxsize=None)
+def wheel_counts(size):
+    """Returns a tuple whose kth element is the number of circular sequences of
+    size pins with k effective pins and no run of more than MAX_RUN effective
+    or ineffective pins.
+
+    """
+    return tuple(sum(COMPOSITIONS[r][k] * COMPOSITIONS[r][size - k] * size // r
+                     for r in range(1, size // 2 + 1))
+                 for k in range(size + 1))
+
+
+@functools.lru_cache(maxsize=None)
+def _total_weights():
+    """Returns a list of cumulative weights for the total number of effective
+    pins in a pin list.
+
+    """
+    undealt = TOTAL_CARDS - TOTAL_PINS
+    counts = _suffix_counts()[0]
+    return list(itertools.accumulate(
+        math.comb(undealt, R_CARDS - k) * counts[k]
+        if 0 <= R_CARDS - k <= undealt else 0
+        for k in range(TOTAL_PINS + 1)))
+
+
+@functools.lru_cache(maxsize=None)
+def _split_weights(n, total):
+    """Returns a list of cumulative weights for the number of effective pins on
+    key wheel n, given total effective pins on wheels n through 5.
+
+    """
+    counts = wheel_counts(WHEEL_SIZES[n])
+    rest = _suffix_counts()[n + 1]
+    return list(itertools.accumulate(
+        counts[k] * rest[total - k] if 0 <= total - k < len(rest) else 0
+        for k in range(len(counts))))
+
+
+@functools.lru_cache(maxsize=None)
+def _runs_weights(size, k):
+    """Returns a list of cumulative weights for the number of runs of effective
+    pins in a valid sequence of size pins with k effective pins. Index 0 is
+    for a single run.
+
+    """
+    return list(itertools.accumulate(
+        COMPOSITIONS[r][k] * COMPOSITIONS[r][size - k] * _RUNS_SCALE // r
+        for r in range(1, size // 2 + 1)))
+
+
+@functools.lru_cache(maxsize=None)
+def _suffix_counts():
+    """Returns a list of 7 lists. The nth list holds, for each k, the number of
+    valid pin settings for wheels n through 5 with k effective pins in total.
+
+    """
+    suffix = [[1]]
+    for size in reversed(WHEEL_SIZES):
+        counts = wheel_counts(size)
+        rest = suffix[0]
+        conv = [0] * (len(counts) + len(rest) - 1)
+        for i, a in enumerate(counts):
+            for j, b in enumerate(rest):
+                conv[i + j] += a * b
+        suffix.insert(0, conv)
+    return suffix
+
+
+def _split_runs(rng, runs, pins):
+    """Returns a list of run lengths, splitting pins into runs chosen uniformly
+    at random.
+
+    """
+    lengths = []
+    for r in range(runs, 0, -1):
+        n = _choose(rng, RUN_WEIGHTS[r][pins]) + 1
+        lengths.append(n)
+        pins -= n
+    return lengths
+
+
+def _choose(rng, cumulative):
+    """Returns an index into the list of cumulative integer weights, chosen at
+    random with probability proportional to its weight.
+
+    """
+    return bisect.bisect(cumulative, rng.randrange(cumulative[-1]))
@@ -0,0 +1,184 @@
+# Copyright (C) 2013 by Brian Neal.
+# This file is part of m209, the M-209 simulation.
+# m209 is released under the MIT License (see LICENSE.txt).
+
+"""This module contains an exact backtracking solver for lug settings.
+
+Given a selection of 6 numbers, the solver searches every overlap distribution
+that satisfies the Army rules followed by the m209.keylist.generate module:
+
+    * the chunks sum to the overlap (sum of the selection - 27)
+    * no chunk exceeds the chunk limit for the overlap (see chunk_limit())
+    * no position is involved in more overlaps than its number allows
+    * if there are 3 or more overlaps, at least 4 of the 6 numbers are involved
+    * if there are 2 or more overlaps, they include numbers which are side by
+      side and numbers which are separated
+    * the resulting drum can generate all values in the range 1-27, inclusive
+
+The search itself is a SolutionSearch from the m209.keylist.lug_cache module,
+which enumerates the distributions satisfying every rule but the side by side
+and separated one; each distribution it finds is checked against that rule.
+Branches are pruned as soon as the remaining overlap can no longer be placed.
+Because the search is exhaustive, a failure to find a solution is a proof that
+none exists; the number of search nodes visited is reported either way.
+
+The search tree is split on the chunks given to the first two pairs, so it can
+be spread across a pool of worker processes.
+
+"""
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import random
+
+from .lug_cache import ALL_PERMUTATIONS, PAIRS, SolutionSearch, chunk_limit
+
+
+# The result of a search. If overlaps is None, no solution exists and the
+# search is a proof of that. Otherwise overlaps is a sorted list of 3-tuples of
+# the form (position1, position2, overlap) for selection, the numbers in the
+# order they must appear on the drum. nodes is the number of search nodes
+# visited.
+SolverResult = namedtuple('SolverResult', ['selection', 'overlaps', 'nodes'])
+
+# Number of leading pairs the search tree is split on:
+_SPLIT_DEPTH = 2
+
+
+def solve(selection, arrange=False, jobs=1, rng=None):
+    """Search for lug settings for selection, a list of 6 integers, and return
+    a SolverResult.
+
+    If arrange is False, the numbers are kept in the order given and the side
+    by side and separated rules are checked in that order. If arrange is True,
+    the numbers may be rearranged in any order, as in step 2b of the Army
+    procedure; the order used is returned in the result.
+
+    If jobs is greater than 1, the search is spread across a pool of jobs
+    worker processes.
+
+    If rng is not None, it must be a random.Random instance (or the random
+    module). It is used to shuffle the order in which pairs and chunks are
+    tried, so that repeated calls return different solutions. Otherwise the
+    search order, and thus the result, is deterministic.
+
+    """
+    selection = list(selection)
+    if len(selection) != 6:
+        raise ValueError("selection must have 6 numbers")
+
+    overlap = sum(selection) - 27
+    order = list(range(len(PAIRS)))
+    if rng is not None:
+        rng.shuffle(order)
+
+    if overlap < 0:
+        return SolverResult(selection, None, 0)
+
+    tasks = [(selection, arrange, order, prefix,
+              None if rng is None else rng.getrandbits(64))
+             for prefix in _split(selection, overlap, order)]
+
+    nodes = 0
+    if jobs > 1:
+        executor = ProcessPoolExecutor(max_workers=jobs)
+        try:
+            for result in executor.map(_solve_task, tasks):
+                nodes += result.nodes
+                if result.overlaps is not None:
+                    return result._replace(nodes=nodes)
+        finally:
+            executor.shutdown(cancel_futures=True)
+    else:
+        for task in tasks:
+            result = _solve_task(task)
+            nodes += result.nodes
+            if result.overlaps is not None:
+                return result._replace(nodes=nodes)
+
+    return SolverResult(selection, None, nodes)
+
+
+def solve_selections(selections, arrange=True, jobs=1):
+    """Run solve() on every selection in the iterable selections. If jobs is
+    greater than 1, the selections are solved in parallel by a pool of jobs
+    worker processes. Returns a list of SolverResults in the same order.
+
+    """
+    tasks = [(list(s), arrange) for s in selections]
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            return list(executor.map(_solve_selection, tasks))
+    return [_solve_selection(task) for task in tasks]
+
+
+def _solve_selection(task):
+    """Worker function for solve_selections()."""
+    selection, arrange = task
+    return solve(selection, arrange=arrange)
+
+
+def _split(selection, overlap, order):
+    """Returns the list of chunk prefixes for the first _SPLIT_DEPTH pairs in
+    order that fit within the chunk limit and the capacity of the selection.
+
+    """
+    limit = chunk_limit(overlap)
+    prefixes = []
+    for prefix in itertools.product(range(limit + 1), repeat=_SPLIT_DEPTH):
+        if sum(prefix) > overlap:
+            continue
+        remaining = list(selection)
+        for i, chunk in zip(order, prefix):
+            x, y = PAIRS[i]
+            remaining[x] -= chunk
+            remaining[y] -= chunk
+        if min(remaining) >= 0:
+            prefixes.append(prefix)
+    return prefixes
+
+
+def _solve_task(task):
+    """Searches the subtree of a solve() task, a 5-tuple of (selection,
+    arrange, order, prefix, seed). Returns a SolverResult.
+
+    """
+    selection, arrange, order, prefix, seed = task
+    rng = None if seed is None else random.Random(seed)
+    found = []
+
+    def visit(chunks):
+        arrangement = _check_arrangement(selection, chunks, arrange)
+        if arrangement is not None:
+            found.append(arrangement)
+            return True
+        return False
+
+    search = SolutionSearch(selection, order, rng)
+    if search.run(visit, prefix):
+        arranged, overlaps = found[0]
+        return SolverResult(arranged, overlaps, search.nodes)
+    return SolverResult(selection, None, search.nodes)
+
+
+def _check_arrangement(selection, chunks, arrange):
+    """Checks the "side by side and separated" rule for the distribution
+    chunks. If arrange is True, every order of the numbers is tried.
+
+    Returns a 2-tuple of (selection, overlaps) with the numbers in the order
+    that passes, or None if the rule cannot be satisfied.
+
+    """
+    used = [(PAIRS[i], chunk) for i, chunk in enumerate(chunks) if chunk]
+    perms = ALL_PERMUTATIONS if arrange else ALL_PERMUTATIONS[:1]
+    for perm in perms:
+        overlaps = sorted((min(perm[x], perm[y]), max(perm[x], perm[y]), c)
+                          for (x, y), c in used)
+        if len(overlaps) < 2 or (
+                any(y - x == 1 for x, y, _ in overlaps) and
+                any(y - x > 1 for x, y, _ in overlaps)):
+            arranged = [0] * 6
+            for i, number in enumerate(selection):
+                arranged[perm[i]] = number
+            return arranged, overlaps
+    return None
@@ -0,0 +1,90 @@
+# Copyright (C) 2013 by Brian Neal.
+# This file is part of m209, the M-209 simulation.
+# m209 is released under the MIT License (see LICENSE.txt).
+
+"""Unit tests for the CompiledKey class."""
+
+import unittest
+
+from ..key_list import KeyList
+from ..compiled import CompiledKey, compile_key_list
+from m209 import M209Error
+from m209.converter import M209
+from m209.drum import DrumError
+from m209.key_wheel import KeyWheelError
+
+
+AA_KEY_LIST = KeyList(
+        indicator='AA',
+        lugs='0-4 0-5*4 0-6*6 1-0*5 1-2 1-5*4 3-0*3 3-4 3-6 5-6',
+        pin_list=[
+            'FGIKOPRSUVWYZ',
+            'DFGKLMOTUY',
+            'ADEFGIORTUVX',
+            'ACFGHILMRSU',
+            'BCDEFJKLPS',
+            'EFGHIJLMNP'
+        ],
+        letter_check='QLRRN TPTFU TRPTN MWQTV JLIJE J')
+
+
+class CompiledKeyTestCase(unittest.TestCase):
+
+    def test_compile(self):
+
+        key = compile_key_list(AA_KEY_LIST)
+        self.assertTrue(isinstance(key, CompiledKey))
+        self.assertEqual(AA_KEY_LIST.indicator, key.indicator)
+        self.assertEqual(AA_KEY_LIST.lugs, key.lugs)
+        self.assertEqual(tuple(AA_KEY_LIST.pin_list), key.pin_list)
+        self.assertEqual(64, len(key.count_table))
+        self.assertEqual(6, len(key.pin_masks))
+
+    def test_hashable(self):
+
+        key1 = compile_key_list(AA_KEY_LIST)
+        key2 = compile_key_list(AA_KEY_LIST)
+        self.assertEqual(key1, key2)
+        self.assertEqual(hash(key1), hash(key2))
+        self.assertEqual(1, len({key1, key2}))
+
+    def test_invalid(self):
+
+        self.assertRaises(DrumError, compile_key_list,
+                          AA_KEY_LIST._replace(lugs='1-1'))
+
+        pin_list = list(AA_KEY_LIST.pin_list)
+        pin_list[5] = 'XYZ'
+        self.assertRaises(KeyWheelError, compile_key_list,
+                          AA_KEY_LIST._replace(pin_list=pin_list))
+
+    def test_pin_list_length(self):
+
+        short = AA_KEY_LIST._replace(pin_list=AA_KEY_LIST.pin_list[:5])
+        self.assertRaises(M209Error, compile_key_list, short)
+
+        long = AA_KEY_LIST._replace(pin_list=AA_KEY_LIST.pin_list + ['A'])
+        self.assertRaises(M209Error, compile_key_list, long)
+
+        # The uncompiled path raises the same error:
+        self.assertRaises(M209Error, M209, AA_KEY_LIST.lugs, short.pin_list)
+
+        # A hand built CompiledKey can't leave stale pins behind:
+        key = compile_key_list(AA_KEY_LIST)
+        m = M209()
+        self.assertRaises(M209Error, m.set_compiled_key,
+                          key._replace(pin_masks=key.pin_masks[:5]))
+
+    def test_set_compiled_key(self):
+
+        key = compile_key_list(AA_KEY_LIST)
+        m1 = M209()
+        m1.set_compiled_key(key)
+        m2 = M209(AA_KEY_LIST.lugs, AA_KEY_LIST.pin_list)
+
+        self.assertEqual(AA_KEY_LIST.letter_check, m1.encrypt('A' * 26))
+        self.assertEqual(m2.get_settings(), m1.get_settings())
+
+        m1.set_key_wheels('YGXREL')
+        m2.set_key_wheels('YGXREL')
+        self.assertEqual(m2.encrypt('ATTACK AT DAWN'), m1.encrypt('ATTACK AT DAWN'))
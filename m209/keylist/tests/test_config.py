@@ -13,7 +13,7 @@ import tempfile
 import unittest
 
 from ..key_list import KeyList
-from ..config import read_key_list, write
+from ..config import read_key_list, write, KeyListStore, get_store
 
 
 @contextmanager
@@ -27,22 +27,38 @@ def file_remover(path):
         os.remove(path)
 
 
+AA_KEY_LIST = KeyList(
+        indicator='AA',
+        lugs='0-4 0-5*4 0-6*6 1-0*5 1-2 1-5*4 3-0*3 3-4 3-6 5-6',
+        pin_list=[
+            'FGIKOPRSUVWYZ',
+            'DFGKLMOTUY',
+            'ADEFGIORTUVX',
+            'ACFGHILMRSU',
+            'BCDEFJKLPS',
+            'EFGHIJLMNP'
+        ],
+        letter_check='QLRRN TPTFU TRPTN MWQTV JLIJE J')
+
+YL_KEY_LIST = KeyList(
+        indicator='YL',
+        lugs='1-0 2-0*4 0-3 0-4*3 0-5*3 0-6*11 2-5 2-6 3-4 4-5',
+        pin_list=[
+            'BFJKLOSTUWXZ',
+            'ABDJKLMORTUV',
+            'EHJKNPQRSX',
+            'ABCHIJLMPQR',
+            'BCDGJLNOPQS',
+            'AEFHIJP',
+        ],
+        letter_check='OZGPK AFVAJ JYRZW LRJEG MOVLU M')
+
+
 class ConfigFileTestCase(unittest.TestCase):
 
     def test_round_trip(self):
 
-        key_list1 = KeyList(
-                indicator='AA',
-                lugs='0-4 0-5*4 0-6*6 1-0*5 1-2 1-5*4 3-0*3 3-4 3-6 5-6',
-                pin_list= [
-                    'FGIKOPRSUVWYZ',
-                    'DFGKLMOTUY',
-                    'ADEFGIORTUVX',
-                    'ACFGHILMRSU',
-                    'BCDEFJKLPS',
-                    'EFGHIJLMNP'
-                ],
-                letter_check='QLRRN TPTFU TRPTN MWQTV JLIJE J')
+        key_list1 = AA_KEY_LIST
 
         fd, path = tempfile.mkstemp(suffix='.ini', text=True)
         os.close(fd)
@@ -55,3 +71,60 @@ class ConfigFileTestCase(unittest.TestCase):
 
             kl3 = read_key_list(path, 'BB')
             self.assertTrue(kl3 is None)
+
+    def test_store(self):
+
+        fd, path = tempfile.mkstemp(suffix='.ini', text=True)
+        os.close(fd)
+
+        with file_remover(path):
+            write(path, [AA_KEY_LIST])
+            store = KeyListStore(path)
+            self.assertEqual(AA_KEY_LIST, store.get('AA'))
+            self.assertEqual(AA_KEY_LIST, store.get())
+            self.assertTrue(store.get('YL') is None)
+            self.assertEqual(['AA'], store.indicators)
+
+            # Lookups should not re-read an unchanged file
+            index = store.index
+            store.get('AA')
+            self.assertTrue(index is store.index)
+
+            # Changes to the file should be noticed
+            write(path, [AA_KEY_LIST, YL_KEY_LIST])
+            self.assertEqual(YL_KEY_LIST, store.get('YL'))
+            self.assertEqual(['AA', 'YL'], store.indicators)
+            self.assertEqual((store.index, store.errors, store.indicators),
+                             store.refresh())
+
+            self.assertTrue(get_store(path) is get_store(path))
+            self.assertEqual(YL_KEY_LIST, read_key_list(path, 'YL'))
+
+        self.assertTrue(store.get('AA') is None)
+        self.assertTrue(store.get() is None)
+        self.assertTrue(read_key_list(path) is None)
+
+    def test_bad_section(self):
+
+        fd, path = tempfile.mkstemp(suffix='.ini', text=True)
+        os.close(fd)
+
+        with file_remover(path):
+            write(path, [AA_KEY_LIST, YL_KEY_LIST])
+            with open(path, 'a') as fp:
+                fp.write('[ZZ]\nlugs = 1-0\nwheel1 = ABC\n')
+
+            store = KeyListStore(path)
+            self.assertEqual(AA_KEY_LIST, store.get('AA'))
+            self.assertEqual(YL_KEY_LIST, store.get('YL'))
+            self.assertRaises(KeyError, store.get, 'ZZ')
+            self.assertEqual(['AA', 'YL', 'ZZ'], store.indicators)
+            self.assertEqual(['AA', 'YL'], sorted(store.index))
+            self.assertEqual({'ZZ': ['wheel2', 'wheel3', 'wheel4', 'wheel5',
+                                     'wheel6', 'check']}, store.errors)
+
+            # The parse is cached even though a section is bad:
+            index = store.index
+            self.assertRaises(KeyError, store.get, 'ZZ')
+            store.get('AA')
+            self.assertTrue(index is store.index)
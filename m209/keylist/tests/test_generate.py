@@ -8,8 +8,17 @@ import collections
 import random
 import unittest
 
-from ..generate import (generate_key_list, pin_list_check, check_overlaps,
-                        KeyListGenError)
+from ..generate import (generate_key_list, generate_key_lists, pin_list_check,
+                        check_overlaps, has_long_run, wheel_pins_to_mask,
+                        generate_letter_check, verify_letter_checks,
+                        KeyListGenError, _init_worker)
+from ..key_list import KeyList
+from ..compiled import compile_key_list
+from ..lug_cache import (TABLE_SELECTIONS, cached_solutions, encode_solutions,
+                         enumerate_solutions, get_solutions)
+from .test_lug_cache import use_temp_cache_dir
+from m209 import M209Error
+from m209.key_wheel import KeyWheelError
 from m209.converter import M209
 from m209.data import KEY_WHEEL_DATA
 from m209.drum import Drum
@@ -34,6 +43,8 @@ class GenerateTestCase(unittest.TestCase):
 
     def setUp(self):
 
+        use_temp_cache_dir(self.addCleanup)
+
         self.valid_pin_list = [
             'FGIKOPRSUVWYZ',
             'DFGKLMOTUY',
@@ -63,6 +74,66 @@ class GenerateTestCase(unittest.TestCase):
         for n in range(32):
             self.do_test_generate_key_list()
 
+    def test_generate_letter_check(self):
+
+        lugs = '0-4 0-5*4 0-6*6 1-0*5 1-2 1-5*4 3-0*3 3-4 3-6 5-6'
+        check = 'QLRRN TPTFU TRPTN MWQTV JLIJE J'
+        self.assertEqual(check, generate_letter_check(lugs, self.valid_pin_list))
+
+        key_list = KeyList('AA', lugs, self.valid_pin_list, check)
+        compiled_key = compile_key_list(key_list)
+        self.assertEqual(check, generate_letter_check(compiled_key=compiled_key))
+
+        pin_list = list(self.valid_pin_list)
+        pin_list[5] = 'EFGHIJLMNPZ'
+        self.assertRaises(KeyWheelError, generate_letter_check, lugs, pin_list)
+
+    def test_verify_letter_checks(self):
+
+        key_lists = [generate_key_list(ind) for ind in ('AA', 'AB', 'AC')]
+        self.assertEqual([], verify_letter_checks(key_lists))
+
+        compiled = [compile_key_list(k) for k in key_lists]
+        self.assertEqual([], verify_letter_checks(compiled))
+
+        bad = key_lists[1]._replace(letter_check=key_lists[0].letter_check)
+        invalid = key_lists[2]._replace(lugs='1-7')
+        unknown = key_lists[0]._replace(letter_check='')
+        key_lists = [key_lists[0], bad, compiled[1], invalid, unknown]
+        self.assertEqual([bad, invalid], verify_letter_checks(key_lists))
+
+        # Pin lists of the wrong length are failures, not crashes:
+        good = key_lists[0]
+        short = good._replace(pin_list=good.pin_list[:5])
+        long = good._replace(pin_list=good.pin_list + ['A'])
+        truncated = compiled[0]._replace(pin_masks=compiled[0].pin_masks[:5])
+        self.assertEqual([short, long, truncated],
+                         verify_letter_checks([short, good, long, truncated]))
+        self.assertRaises(M209Error, generate_letter_check, short.lugs,
+                          short.pin_list)
+
+    def test_generate_key_lists(self):
+
+        indicators = ['AA', 'BN', 'GG', 'ZZ', 'QX']
+        state = random.getstate()
+        key_lists1 = list(generate_key_lists(indicators, seed=42))
+        self.assertEqual(state, random.getstate())
+        self.assertEqual(indicators, [kl.indicator for kl in key_lists1])
+
+        key_lists2 = list(generate_key_lists(iter(indicators), seed=42, jobs=3))
+        self.assertEqual(key_lists1, key_lists2)
+
+        key_lists3 = list(generate_key_lists(indicators, jobs=2))
+        self.assertEqual(indicators, [kl.indicator for kl in key_lists3])
+
+        # Workers are given the lug solutions found by the parent:
+        self.assertEqual(TABLE_SELECTIONS,
+                         TABLE_SELECTIONS & set(cached_solutions()))
+        key = (1, 1, 3, 3, 8, 13)
+        solutions = {key: encode_solutions(enumerate_solutions(list(key)))}
+        _init_worker(solutions)
+        self.assertIs(solutions[key], get_solutions(list(key)))
+
     def do_test_lug_settings(self, selection, failures, max_lug_attempts=1024):
 
         try:
@@ -222,6 +293,33 @@ class GenerateTestCase(unittest.TestCase):
         pin_list[5] = 'DEFHIKLM'
         self.assertFalse(pin_list_check(pin_list))
 
+    def test_has_long_run(self):
+
+        def reference(n, mask):
+            size = len(KEY_WHEEL_DATA[n][0])
+            bits = [(mask >> k) & 1 for k in range(size)] * 2
+            return '1' * 7 in ''.join(str(b) for b in bits)
+
+        for n, (letters, _) in enumerate(KEY_WHEEL_DATA):
+            size = len(letters)
+            # Runs of 6 and 7, starting everywhere including across the end:
+            for start in range(size):
+                for run, expected in ((6, False), (7, True)):
+                    mask = 0
+                    for k in range(start, start + run):
+                        mask |= 1 << (k % size)
+                    self.assertEqual(expected, has_long_run(n, mask))
+
+            for i in range(200):
+                mask = random.getrandbits(size)
+                self.assertEqual(reference(n, mask), has_long_run(n, mask))
+
+    def test_wheel_pins_to_mask(self):
+        self.assertEqual(0, wheel_pins_to_mask(0, ''))
+        self.assertEqual(0b101, wheel_pins_to_mask(0, 'AC'))
+        self.assertEqual((1 << 17) - 1,
+                         wheel_pins_to_mask(5, KEY_WHEEL_DATA[5][0]))
+
 
 class CheckOverlapsTestCase(unittest.TestCase):
 
@@ -0,0 +1,216 @@
+# Copyright (C) 2013 by Brian Neal.
+# This file is part of m209, the M-209 simulation.
+# m209 is released under the MIT License (see LICENSE.txt).
+
+"""Tests for the lug solution enumerator and cache."""
+
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from ..lug_cache import (enumerate_solutions, encode_solutions, num_solutions,
+                         decode_solution, get_solutions, build_cache,
+                         get_cache_dir, set_cache_dir, user_cache_dir,
+                         read_table, PAIRS, TABLE_FILE, TABLE_SELECTIONS)
+from ..generate import (generate_lugs, pick_lugs, build_lug_list,
+                        check_lug_placement, KeyListGenError)
+from m209.drum import Drum
+
+
+# These group B selections are commented out in m209.keylist.data:
+UNSOLVABLE = [
+    [1, 2, 2, 4, 11, 13],
+    [1, 2, 3, 3, 11, 13],
+    [1, 2, 2, 4, 12, 13],
+    [1, 2, 2, 6, 13, 13],
+    [1, 2, 3, 5, 13, 13],
+]
+
+
+# Run in a fresh process by test_cold_process(). Prints the time taken to pick
+# lug settings for 100 table selections from the shipped table, including
+# loading it, and by the random search that was used before the table existed:
+COLD_SCRIPT = """
+import random, time
+from m209.keylist import lug_cache
+from m209.keylist.data import GROUP_A, GROUP_B
+from m209.keylist.generate import generate_lugs, pick_lugs
+
+def fail(selection):
+    raise AssertionError("enumerated {}".format(selection))
+lug_cache.enumerate_solutions = fail
+
+rng = random.Random(1)
+selections = [rng.sample(s, 6) for s in rng.sample(GROUP_A + GROUP_B, 100)]
+start = time.perf_counter()
+for s in selections:
+    pick_lugs(s)
+table_time = time.perf_counter() - start
+start = time.perf_counter()
+for s in selections:
+    generate_lugs(s)
+search_time = time.perf_counter() - start
+print(table_time, search_time)
+"""
+
+
+# Temporary lug cache directory shared by the tests of this process:
+_shared_cache_dir = None
+
+
+def use_temp_cache_dir(add_cleanup, fresh=False):
+    """Points the lug cache of this process, and of any worker processes it
+    starts, at a temporary directory. The previous settings are restored by
+    cleanups registered with add_cleanup, e.g. a TestCase's addCleanup or
+    addClassCleanup method. Returns the directory.
+
+    By default the directory is shared by every test in the process, so the
+    solutions are only enumerated once; it is removed when the process exits.
+    If fresh is True, a new empty directory is used and removed by a cleanup.
+
+    """
+    global _shared_cache_dir
+    if fresh:
+        tmpdir = tempfile.TemporaryDirectory()
+        add_cleanup(tmpdir.cleanup)
+    else:
+        if _shared_cache_dir is None:
+            _shared_cache_dir = tempfile.TemporaryDirectory()
+        tmpdir = _shared_cache_dir
+
+    add_cleanup(set_cache_dir, get_cache_dir())
+    patcher = mock.patch.dict(os.environ, {'M209_CACHE_DIR': tmpdir.name})
+    patcher.start()
+    add_cleanup(patcher.stop)
+    set_cache_dir(tmpdir.name)
+    return tmpdir.name
+
+
+class LugCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = use_temp_cache_dir(self.addCleanup, fresh=True)
+
+    def test_enumerate(self):
+        selection = [1, 2, 3, 4, 8, 10]
+        solutions = enumerate_solutions(selection)
+        self.assertTrue(solutions)
+        self.assertEqual(len(solutions), len(set(solutions)))
+
+        for chunks in solutions:
+            self.assertEqual(sum(selection) - 27, sum(chunks))
+            overlaps = [(x, y, c) for (x, y), c in zip(PAIRS, chunks) if c]
+            drum = Drum(build_lug_list(selection, overlaps))
+            self.assertTrue(check_lug_placement(drum))
+
+    def test_unsolvable(self):
+        for selection in UNSOLVABLE:
+            self.assertEqual([], enumerate_solutions(selection))
+            self.assertRaises(KeyListGenError, pick_lugs, selection)
+
+    def test_encode_decode(self):
+        solutions = enumerate_solutions([1, 2, 3, 5, 7, 11])
+        data = encode_solutions(solutions)
+        self.assertEqual(len(solutions), num_solutions(data))
+        for n, chunks in enumerate(solutions):
+            overlaps = [(x, y, c) for (x, y), c in zip(PAIRS, chunks) if c]
+            self.assertEqual(overlaps, decode_solution(data, n))
+
+    def test_disk_cache(self):
+        # Not in the tables, so not in TABLE_FILE:
+        selection = [1, 1, 3, 3, 8, 13]
+        data = get_solutions(selection)
+        self.assertEqual(1, len(os.listdir(self.cache_dir)))
+        self.assertTrue(get_solutions(list(reversed(selection))) is data)
+
+        # A fresh in-memory cache should load the file from disk
+        set_cache_dir(self.cache_dir)
+        self.assertEqual(data, get_solutions(selection))
+
+        counts = build_cache([selection, [1, 1, 3, 3, 8, 12],
+                              [1, 2, 3, 4, 8, 10]])
+        self.assertEqual(num_solutions(data), counts[tuple(selection)])
+        self.assertEqual(3, len(counts))
+        self.assertEqual(2, len(os.listdir(self.cache_dir)))
+
+    def test_cache_dir(self):
+        # The disk cache is only used when a directory is configured:
+        with mock.patch.dict(os.environ, {'HOME': self.cache_dir}, clear=True):
+            self.assertEqual(os.path.join(self.cache_dir, '.cache', 'm209'),
+                             user_cache_dir())
+            os.environ['XDG_CACHE_HOME'] = self.cache_dir
+            self.assertEqual(os.path.join(self.cache_dir, 'm209'),
+                             user_cache_dir())
+
+        set_cache_dir(None)
+        self.assertIsNone(get_cache_dir())
+        data = get_solutions([1, 2, 4, 5, 7, 9])
+        self.assertTrue(get_solutions([1, 2, 4, 5, 7, 9]) is data)
+        self.assertEqual([], os.listdir(self.cache_dir))
+
+    def test_table(self):
+        table = read_table(TABLE_FILE)
+        self.assertEqual(TABLE_SELECTIONS, set(table))
+        for key in random.Random(3).sample(sorted(table), 5):
+            self.assertEqual(encode_solutions(enumerate_solutions(list(key))),
+                             table[key])
+
+        # Table selections are never written to the disk cache:
+        set_cache_dir(self.cache_dir)
+        self.assertEqual(table[(1, 2, 3, 4, 8, 10)],
+                         get_solutions([10, 8, 4, 3, 2, 1]))
+        self.assertEqual([], os.listdir(self.cache_dir))
+
+    def test_cold_process(self):
+        # A new process without a cache directory must not enumerate, and must
+        # not be slower than the random search:
+        env = dict(os.environ)
+        env.pop('M209_CACHE_DIR', None)
+        root = os.path.dirname(os.path.dirname(os.path.dirname(
+                os.path.dirname(os.path.abspath(__file__)))))
+        env['PYTHONPATH'] = os.pathsep.join(
+                [root] + [p for p in [env.get('PYTHONPATH')] if p])
+        output = subprocess.run([sys.executable, '-c', COLD_SCRIPT], env=env,
+                                cwd=root, check=True, stdout=subprocess.PIPE,
+                                universal_newlines=True).stdout
+        table_time, search_time = map(float, output.split())
+        self.assertLessEqual(table_time, search_time)
+
+    def test_pick_lugs(self):
+        rng = random.Random(11)
+        for selection in [[1, 2, 3, 4, 8, 10], [1, 2, 4, 8, 11, 11],
+                          [1, 1, 3, 6, 12, 13]]:
+            for shuffle in [True, False]:
+                selection = rng.sample(selection, 6)
+                lugs = pick_lugs(selection, shuffle=shuffle)
+                drum = Drum.from_key_list(lugs)
+                self.assertEqual(Drum.NUM_BARS, len(drum.bars))
+                self.assertTrue(check_lug_placement(drum))
+
+                counts = [0] * 6
+                for bar in drum.bars:
+                    for n in bar:
+                        counts[n] += 1
+                if shuffle:
+                    self.assertEqual(sorted(selection), sorted(counts))
+                else:
+                    self.assertEqual(selection, counts)
+
+    def test_generate_lugs(self):
+        for n in range(20):
+            drum = Drum.from_key_list(generate_lugs())
+            self.assertTrue(check_lug_placement(drum))
+
+    def test_fallback(self):
+        # With no random search attempts allowed we must fall back to the
+        # enumerated solutions:
+        selection = [1, 1, 3, 6, 12, 13]
+        drum = Drum.from_key_list(generate_lugs(selection, max_attempts=0))
+        self.assertTrue(check_lug_placement(drum))
+
+        self.assertRaises(KeyListGenError, generate_lugs, [1, 1, 1, 1, 1, 30],
+                          max_attempts=0)
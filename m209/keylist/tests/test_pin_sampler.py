@@ -0,0 +1,90 @@
+# Copyright (C) 2013 by Brian Neal.
+# This file is part of m209, the M-209 simulation.
+# m209 is released under the MIT License (see LICENSE.txt).
+
+"""Tests for the direct pin list sampler."""
+
+import collections
+import random
+import unittest
+
+from ..pin_sampler import sample_pin_list, sample_wheel, wheel_counts
+from ..generate import generate_pin_list, pin_list_check, has_long_run
+
+
+# Number of pin lists drawn from each procedure for the statistical tests:
+NUM_SAMPLES = 3000
+
+# Bins for the total number of effective pins; values outside the range are
+# counted in the first or last bin:
+BINS = list(range(61, 71))
+
+# The chi-square critical value for len(BINS) - 1 = 9 degrees of freedom at
+# a significance level of 0.001:
+CHI_SQUARE_LIMIT = 27.88
+
+
+def histogram(pin_lists):
+    counts = collections.Counter()
+    for pin_list in pin_lists:
+        total = sum(len(pins) for pins in pin_list)
+        counts[min(max(total, BINS[0]), BINS[-1])] += 1
+    return [counts[b] for b in BINS]
+
+
+class PinSamplerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.state = random.getstate()
+        random.seed(209)
+
+    def tearDown(self):
+        random.setstate(self.state)
+
+    def test_wheel_counts(self):
+        # Compare against a brute force count for the smallest wheel:
+        size = 17
+        full = (1 << size) - 1
+        counts = [0] * (size + 1)
+        for mask in range(1 << size):
+            if not (has_long_run(5, mask) or has_long_run(5, mask ^ full)):
+                counts[bin(mask).count('1')] += 1
+        self.assertEqual(counts, list(wheel_counts(size)))
+
+    def test_sample_wheel(self):
+        for k in range(3, 15):
+            bits = sample_wheel(17, k)
+            self.assertEqual(17, len(bits))
+            self.assertEqual(k, sum(bits))
+            mask = sum(bit << n for n, bit in enumerate(bits))
+            self.assertFalse(has_long_run(5, mask))
+            self.assertFalse(has_long_run(5, mask ^ ((1 << 17) - 1)))
+
+    def test_valid(self):
+        for n in range(200):
+            self.assertTrue(pin_list_check(sample_pin_list()))
+            self.assertTrue(pin_list_check(generate_pin_list()))
+
+    def test_rng(self):
+        a = sample_pin_list(random.Random(1))
+        b = sample_pin_list(random.Random(1))
+        self.assertEqual(a, b)
+
+    def test_distribution(self):
+        # Compare the number of effective pins produced by the sampler to the
+        # card shuffling procedure with a two sample chi-square test:
+        rng = random.Random(4)
+        direct = [sample_pin_list(rng) for n in range(NUM_SAMPLES)]
+        shuffled = [generate_pin_list(max_attempts=64)
+                    for n in range(NUM_SAMPLES)]
+
+        a = histogram(direct)
+        b = histogram(shuffled)
+        chi_square = sum((x - y) ** 2 / (x + y) for x, y in zip(a, b) if x + y)
+        self.assertLess(chi_square, CHI_SQUARE_LIMIT)
+
+        # The mean number of effective pins on each wheel should agree:
+        for n in range(6):
+            mean_a = sum(len(p[n]) for p in direct) / NUM_SAMPLES
+            mean_b = sum(len(p[n]) for p in shuffled) / NUM_SAMPLES
+            self.assertAlmostEqual(mean_a, mean_b, delta=0.25)
@@ -0,0 +1,74 @@
+# Copyright (C) 2013 by Brian Neal.
+# This file is part of m209, the M-209 simulation.
+# m209 is released under the MIT License (see LICENSE.txt).
+
+"""Tests for the exact lug settings solver."""
+
+import random
+import unittest
+
+from ..solver import solve, solve_selections
+from ..generate import (generate_lugs, build_lug_list, check_overlaps,
+                        check_lug_placement, KeyListGenError)
+from .test_lug_cache import UNSOLVABLE, use_temp_cache_dir
+from m209.drum import Drum
+
+
+class SolverTestCase(unittest.TestCase):
+
+    def setUp(self):
+        use_temp_cache_dir(self.addCleanup)
+
+    def check_result(self, result):
+        self.assertIsNotNone(result.overlaps)
+        self.assertTrue(check_overlaps(result.overlaps))
+        drum = Drum(build_lug_list(result.selection, result.overlaps))
+        self.assertTrue(check_lug_placement(drum))
+
+    def test_solve(self):
+        selection = [1, 1, 3, 6, 12, 13]
+        result = solve(selection)
+        self.assertEqual(selection, result.selection)
+        self.check_result(result)
+
+        # The search order is deterministic without an rng:
+        self.assertEqual(result, solve(selection))
+
+    def test_solve_random(self):
+        selection = [2, 1, 13, 3, 12, 6]
+        for seed in range(5):
+            result = solve(selection, rng=random.Random(seed))
+            self.assertEqual(selection, result.selection)
+            self.check_result(result)
+
+    def test_solve_arrange(self):
+        result = solve([1, 2, 3, 4, 8, 10], arrange=True)
+        self.assertEqual([1, 2, 3, 4, 8, 10], sorted(result.selection))
+        self.check_result(result)
+
+    def test_unsolvable(self):
+        for selection in UNSOLVABLE:
+            result = solve(selection, arrange=True)
+            self.assertIsNone(result.overlaps)
+            self.assertGreater(result.nodes, 0)
+
+    def test_jobs(self):
+        selection = UNSOLVABLE[0]
+        serial = solve(selection, arrange=True)
+        parallel = solve(selection, arrange=True, jobs=2)
+        self.assertEqual(serial, parallel)
+
+        results = solve_selections(UNSOLVABLE[:2] + [[1, 1, 3, 6, 12, 13]],
+                                   jobs=2)
+        self.assertEqual([None, None], [r.overlaps for r in results[:2]])
+        self.check_result(results[2])
+
+    def test_generate_lugs_fallback(self):
+        # Not in the tables, so the solver is used when the random search is
+        # not allowed any attempts:
+        selection = [1, 1, 3, 3, 8, 13]
+        drum = Drum.from_key_list(generate_lugs(selection, max_attempts=0))
+        self.assertTrue(check_lug_placement(drum))
+
+        self.assertRaises(KeyListGenError, generate_lugs, [1, 2, 2, 4, 11, 13],
+                          max_attempts=0)
@@ -7,27 +7,34 @@ utility.
 
 """
 import argparse
+import json
 import logging
 import os.path
 import random
 import re
 import sys
+import tempfile
 
 from . import M209Error
-from .converter import M209_ALPHABET_SET
+from .converter import ENGINES, M209_ALPHABET_SET
 from .data import KEY_WHEEL_DATA
-from .keylist.generate import generate_key_list
 from .keylist.key_list import valid_indicator, IndicatorIter
-from .keylist.config import write as write_config, read_key_list
-from .procedure import StdProcedure
+
+# The key list, procedure, server and bench modules are imported by the sub-commands
+# that use them, so that encrypt and decrypt requests sent to a server with
+# --socket don't pay for importing them.
 
 
 DESC = "M-209 simulator and utility program"
 DEFAULT_KEY_LIST = 'm209keys.cfg'
+SOCKET_ENV = 'M209_SOCKET'
 LOG_CHOICES = ['debug', 'info', 'warning', 'error', 'critical']
 SYS_IND_RE = re.compile(r'^[A-Z]{1}$')
 M209_ALPHABET_LOWER = set(c.lower() for c in M209_ALPHABET_SET)
 
+# Number of characters read from a plaintext or ciphertext file at a time:
+READ_SIZE = 64 * 1024
+
 
 def validate_key_list_indicator(s):
     """Validation/conversion function for validating the supplied starting key
@@ -63,6 +70,24 @@ def validate_num_key_lists(s):
     return val
 
 
+def validate_jobs(s):
+    """Validation/conversion function for validating the number of worker
+    processes.
+
+    Returns the integer value if valid, otherwise raises an ArgumentTypeError
+
+    """
+    msg = "value must be a positive integer"
+    try:
+        val = int(s)
+    except ValueError:
+        raise argparse.ArgumentTypeError(msg)
+
+    if val < 1:
+        raise argparse.ArgumentTypeError(msg)
+    return val
+
+
 def validate_ext_indicator(s):
     """Validation function for the external message indicator option.
 
@@ -95,8 +120,9 @@ def validate_sys_indicator(s):
     raise argparse.ArgumentTypeError('value must be 1 letter')
 
 
-def plaintext_filter(fp):
-    """Generator function to filter input plaintext.
+class PlaintextTable(dict):
+    """A str.translate() table for filtering input plaintext. The mapping for
+    each character is computed the first time it is looked up.
 
     * upper case letters are passed as-is.
     * lower case letters are converted to upper case.
@@ -104,14 +130,43 @@ def plaintext_filter(fp):
     * All other characters are dropped from the input.
 
     """
-    for line in fp:
-        for c in line:
-            if c in M209_ALPHABET_SET:
-                yield c
-            elif c in M209_ALPHABET_LOWER:
-                yield c.upper()
-            elif c.isspace():
-                yield 'Z'
+    def __missing__(self, key):
+        c = chr(key)
+        if c in M209_ALPHABET_SET:
+            value = key
+        elif c in M209_ALPHABET_LOWER:
+            value = ord(c.upper())
+        elif c.isspace():
+            value = ord('Z')
+        else:
+            value = None
+        self[key] = value
+        return value
+
+
+PLAINTEXT_TABLE = PlaintextTable()
+
+
+def plaintext_filter(fp, read_size=READ_SIZE):
+    """Generator function to filter input plaintext as per PlaintextTable.
+
+    fp may be a file object, which is read read_size characters at a time, a
+    string, or any other iterable of strings, such as a list or generator of
+    lines. Each chunk of input is filtered with a single str.translate() call,
+    and the filtered chunks are yielded.
+
+    """
+    if isinstance(fp, str):
+        chunks = [fp]
+    elif hasattr(fp, 'read'):
+        chunks = iter(lambda: fp.read(read_size), '')
+    else:
+        chunks = fp
+
+    for chunk in chunks:
+        chunk = chunk.translate(PLAINTEXT_TABLE)
+        if chunk:
+            yield chunk
 
 
 def encrypt(args):
@@ -123,6 +178,12 @@ def encrypt(args):
     elif not args.text and not args.file:
         sys.exit("Please supply either -f/--file or -t/--text\n")
 
+    if args.socket:
+        return encrypt_remote(args)
+
+    from .keylist.config import read_key_list
+    from .procedure import StdProcedure
+
     # Get a key list from the key list file
     if not os.path.isfile(args.key_file):
         sys.exit("key list file not found: {}\n".format(args.key_file))
@@ -133,14 +194,60 @@ def encrypt(args):
 
     # Get the plaintext
     if args.text:
+        infile = None
         plaintext = plaintext_filter(args.text)
     else:
         infile = open(args.file, 'r') if args.file != '-' else sys.stdin
         plaintext = plaintext_filter(infile)
 
+    # Write the ciphertext groups as they are produced so large inputs don't
+    # have to fit in memory:
     proc = StdProcedure(key_list=key_list)
-    ct = proc.encrypt(plaintext, ext_msg_ind=args.ext_ind, sys_ind=args.sys_ind)
-    print(ct)
+    try:
+        groups = proc.encrypt_stream(plaintext, ext_msg_ind=args.ext_ind,
+                                     sys_ind=args.sys_ind)
+        write_groups(groups, sys.stdout)
+    finally:
+        if infile is not None and infile is not sys.stdin:
+            infile.close()
+
+
+def encrypt_remote(args):
+    """Encrypt subcommand processor that sends the plaintext to a server (see
+    the serve subcommand) instead of encrypting it in this process.
+
+    """
+    from .protocol import call
+
+    if args.text:
+        plaintext = ''.join(plaintext_filter(args.text))
+    elif args.file == '-':
+        plaintext = ''.join(plaintext_filter(sys.stdin))
+    else:
+        with open(args.file, 'r') as infile:
+            plaintext = ''.join(plaintext_filter(infile))
+
+    ciphertext = call(args.socket, {'op': 'encrypt',
+                                    'key_file': args.key_file,
+                                    'text': plaintext,
+                                    'key_list_ind': args.key_list_ind,
+                                    'ext_ind': args.ext_ind,
+                                    'sys_ind': args.sys_ind})
+    sys.stdout.write(ciphertext + '\n')
+
+
+def write_groups(groups, fp):
+    """Writes the iterable of message groups to the file object fp on one line,
+    separated by spaces. Groups are written as they are produced, so output
+    begins before the last group is available.
+
+    """
+    sep = ''
+    for group in groups:
+        fp.write(sep + group)
+        sep = ' '
+    fp.write('\n')
+    fp.flush()
 
 
 def decrypt(args):
@@ -152,47 +259,83 @@ def decrypt(args):
     elif not args.text and not args.file:
         sys.exit("Please supply either -f/--file or -t/--text\n")
 
+    if args.socket:
+        return decrypt_remote(args)
+
+    from .keylist.config import read_key_list
+    from .procedure import StdProcedure
+
     # Check for key list file
     if not os.path.isfile(args.key_file):
         sys.exit("key list file not found: {}\n".format(args.key_file))
 
-    # Get the ciphertext to decrypt
+    # Read the ciphertext a chunk at a time so large messages don't have to fit
+    # in memory:
     if args.text:
-        msg = args.text
+        infile = None
+        stream = [args.text]
     else:
-        # Read contents of ciphertext file
-        if args.file == '-':
-            msg = sys.stdin.read()
-        else:
-            with open(args.file, 'r') as fp:
-                msg = fp.read()
-        msg = msg.strip()
+        infile = open(args.file, 'r') if args.file != '-' else sys.stdin
+        stream = iter(lambda: infile.read(READ_SIZE), '')
 
-    # Start the decrypt procedure
-    proc = StdProcedure()
-    params = proc.set_decrypt_message(msg)
+    try:
+        # Start the decrypt procedure
+        proc = StdProcedure()
+        params = proc.set_decrypt_stream(stream)
+
+        # Find a key list for the message
+        key_list = read_key_list(args.key_file, params.key_list_ind)
+        if key_list is None:
+            sys.exit("Could not find key list {} in {}\n".format(
+                params.key_list_ind, args.key_file))
+
+        # Install the key list and perform the decrypt operation
+        proc.set_key_list(key_list)
+        try:
+            for plaintext in proc.decrypt_stream():
+                sys.stdout.write(plaintext)
+        finally:
+            sys.stdout.write('\n')
+            sys.stdout.flush()
+    finally:
+        if infile is not None and infile is not sys.stdin:
+            infile.close()
+
+
+def decrypt_remote(args):
+    """Decrypt subcommand processor that sends the message to a server (see the
+    serve subcommand) instead of decrypting it in this process.
 
-    # Find a key list for the message
-    key_list = read_key_list(args.key_file, params.key_list_ind)
-    if key_list is None:
-        sys.exit("Could not find key list {} in {}\n".format(
-            params.key_list_ind, args.key_file))
+    """
+    from .protocol import call
+
+    if args.text:
+        ciphertext = args.text
+    elif args.file == '-':
+        ciphertext = sys.stdin.read()
+    else:
+        with open(args.file, 'r') as infile:
+            ciphertext = infile.read()
 
-    # Install the key list and perform the decrypt operation
-    proc.set_key_list(key_list)
-    plaintext = proc.decrypt()
-    print(plaintext)
+    plaintext = call(args.socket, {'op': 'decrypt',
+                                   'key_file': args.key_file,
+                                   'text': ciphertext})
+    sys.stdout.write(plaintext + '\n')
 
 
 def keygen(args):
     """Key list generation subcommand processor"""
+    from .keylist.generate import generate_key_lists
+    from .keylist.config import write as write_config
+
     logging.info("Creating key list file: %s", args.key_file)
 
     if not args.overwrite and os.path.exists(args.key_file):
         sys.exit("File '{}' exists. Use -o to overwrite\n".format(args.key_file))
 
     if args.start is None:   # random indicators
-        indicators = random.sample([i for i in IndicatorIter()], args.number)
+        rng = random.Random(args.seed) if args.seed is not None else random
+        indicators = rng.sample([i for i in IndicatorIter()], args.number)
         indicators.sort()
     else:
         it = IndicatorIter(args.start)
@@ -203,11 +346,101 @@ def keygen(args):
 
         indicators = (next(it) for n in range(args.number))
 
-    key_lists = (generate_key_list(indicator) for indicator in indicators)
+    key_lists = generate_key_lists(indicators, seed=args.seed, jobs=args.jobs)
 
     write_config(args.key_file, key_lists)
 
 
+def serve(args):
+    """Server subcommand processor"""
+    from .server import serve as run_server
+
+    if args.socket and args.port is not None:
+        sys.exit("Please supply either --socket or --port, not both\n")
+    elif args.socket:
+        logging.info("Serving on %s", args.socket)
+    elif args.port is not None:
+        logging.info("Serving on %s port %d", args.host, args.port)
+    else:
+        sys.exit("Please supply either --socket or --port\n")
+
+    if not os.path.isdir(args.key_dir):
+        sys.exit("key directory not found: {}\n".format(args.key_dir))
+    logging.info("Serving key list files from %s",
+                 os.path.abspath(args.key_dir))
+
+    metrics_server = None
+    if args.metrics_port is not None:
+        from .exporter import start_http_server
+        metrics_server = start_http_server(args.metrics_port, args.host)
+        logging.info("Serving metrics on http://%s:%d/metrics", args.host,
+                     metrics_server.server_port)
+
+    try:
+        run_server(args.socket, host=args.host, port=args.port,
+                   workers=args.workers, key_dir=args.key_dir)
+    finally:
+        if metrics_server is not None:
+            metrics_server.shutdown()
+            metrics_server.server_close()
+
+
+def bench(args):
+    """Benchmark subcommand processor"""
+    from . import bench as bm
+
+    baseline = bm.load_baseline(args.baseline) if args.baseline else None
+    min_time = bm.MIN_TIME if args.min_time is None else args.min_time
+    threshold = (bm.THRESHOLD if args.threshold is None else
+                 args.threshold / 100.0)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        key_file = os.path.join(tmpdir, 'bench.cfg')
+        suite = bm.build_suite(key_file, args.length or bm.LENGTHS,
+                               args.engine)
+        suite = bm.select(suite, args.bench)
+
+        if args.list:
+            for benchmark in suite:
+                print(benchmark.name)
+            return
+        if not suite:
+            sys.exit("No benchmarks match {}\n".format(' '.join(args.bench)))
+        if bm.uses_key_file(suite):
+            bm.write_key_file(key_file)
+
+        # Print text results as they are produced:
+        text = args.format == 'text'
+        if text:
+            print(bm.HEADER)
+
+        results = []
+        comparisons = []
+        for benchmark in suite:
+            result = bm.measure(benchmark, min_time)
+            results.append(result)
+            comparison = None
+            if baseline is not None:
+                for comparison in bm.compare([result], baseline, threshold):
+                    comparisons.append(comparison)
+            if text:
+                print(bm.format_result(result, comparison), flush=True)
+
+    if not text:
+        data = bm.to_json(results, args.engine)
+        if baseline is not None:
+            data['comparisons'] = [c._asdict() for c in comparisons]
+        print(json.dumps(data, indent=2))
+
+    if args.save:
+        bm.save_baseline(args.save, results, args.engine)
+
+    regressed = [c.name for c in comparisons if c.regressed]
+    if regressed:
+        sys.exit("{} benchmark(s) regressed by more than {:g}%: {}\n".format(
+            len(regressed), threshold * 100.0, ', '.join(regressed)))
+
+
 def main(argv=None):
     """Entry point for the m209 command-line utility."""
 
@@ -238,6 +471,11 @@ def main(argv=None):
     enc_parser.add_argument('-s', '--sys-ind', metavar='S',
         type=validate_sys_indicator,
         help='1-letter system indicator; if omitted a random one is used')
+    enc_parser.add_argument('--socket', metavar='PATH',
+        default=os.environ.get(SOCKET_ENV),
+        help='send the request to the server listening on this Unix socket; '
+             'the key list file is then relative to the server\'s key '
+             'directory [default: ${}]'.format(SOCKET_ENV))
     enc_parser.set_defaults(subcommand=encrypt)
 
     # create the sub-parser for decrypt
@@ -251,6 +489,11 @@ def main(argv=None):
         help='path to ciphertext file or - for stdin')
     dec_parser.add_argument('-t', '--text',
         help='text string to decrypt')
+    dec_parser.add_argument('--socket', metavar='PATH',
+        default=os.environ.get(SOCKET_ENV),
+        help='send the request to the server listening on this Unix socket; '
+             'the key list file is then relative to the server\'s key '
+             'directory [default: ${}]'.format(SOCKET_ENV))
     dec_parser.set_defaults(subcommand=decrypt)
 
     # create the sub-parser for generating key lists
@@ -267,8 +510,71 @@ def main(argv=None):
         help='starting indicator; if omitted, random indicators are used')
     kg_parser.add_argument('-n', '--number', type=validate_num_key_lists, default=1,
         help='number of key lists to generate [default: %(default)s]')
+    kg_parser.add_argument('-j', '--jobs', type=validate_jobs, default=1,
+        help='number of worker processes to use [default: %(default)s]')
+    kg_parser.add_argument('--seed',
+        help='master random seed; output is deterministic for a given seed')
     kg_parser.set_defaults(subcommand=keygen)
 
+    # create the sub-parser for the server
+
+    srv_parser = subparsers.add_parser('serve',
+        description='Serve encrypt, decrypt and keygen requests',
+        help='run a server for encrypt, decrypt and keygen requests',
+        epilog='Either the --socket or --port arguments must be supplied')
+    srv_parser.add_argument('--socket', metavar='PATH',
+        help='path of the Unix socket to listen on')
+    srv_parser.add_argument('--host', default='127.0.0.1',
+        help='TCP address to listen on with --port or --metrics-port '
+             '[default: %(default)s]')
+    srv_parser.add_argument('--port', type=int,
+        help='TCP port to listen on')
+    srv_parser.add_argument('-j', '--workers', type=validate_jobs,
+        help='number of worker processes to use; if omitted, one per '
+             'processor')
+    srv_parser.add_argument('-d', '--key-dir', metavar='DIR', default='.',
+        help='directory of the key list files clients may use; clients name '
+             'them relative to it [default: current directory]')
+    srv_parser.add_argument('--metrics-port', type=int,
+        help='serve Prometheus metrics over HTTP on this port at /metrics, on '
+             'the --host address')
+    srv_parser.set_defaults(subcommand=serve)
+
+    # create the sub-parser for benchmarks
+
+    bench_parser = subparsers.add_parser('bench',
+        description='Time encrypt, decrypt and key list operations',
+        help='run benchmarks')
+    bench_parser.add_argument('-b', '--bench', metavar='PATTERN',
+        action='append',
+        help='run only benchmarks matching this wildcard pattern; may be '
+             'repeated')
+    bench_parser.add_argument('-n', '--length', type=validate_jobs,
+        action='append',
+        help='message length in letters for the encrypt and decrypt '
+             'benchmarks; may be repeated')
+    # The --min-time and --threshold defaults are taken from the bench module
+    # when the sub-command runs, so that it isn't imported here:
+    bench_parser.add_argument('-t', '--min-time', type=float,
+        help='minimum seconds to run each benchmark '
+             '[default: m209.bench.MIN_TIME]')
+    bench_parser.add_argument('--engine', choices=ENGINES, default='python',
+        help='cipher engine to use [default: %(default)s]')
+    bench_parser.add_argument('--format', choices=['text', 'json'],
+        default='text', help='output format [default: %(default)s]')
+    bench_parser.add_argument('--baseline', metavar='FILE',
+        help='compare results to this baseline file and exit with an error '
+             'if any benchmark regressed')
+    bench_parser.add_argument('--threshold', metavar='PERCENT', type=float,
+        help='percent slowdown from the baseline, measured by median (p50) '
+             'latency, that counts as a regression '
+             '[default: 100 * m209.bench.THRESHOLD]')
+    bench_parser.add_argument('--save', metavar='FILE',
+        help='save the results to this baseline file')
+    bench_parser.add_argument('--list', action='store_true',
+        help='list the benchmarks and exit')
+    bench_parser.set_defaults(subcommand=bench)
+
     args = parser.parse_args(args=argv)
 
     log_level = getattr(logging, args.log.upper())
@@ -19,24 +19,57 @@ procedure known to the author.
 
 """
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import itertools
 import random
 import re
 
-from . import M209Error
+from . import M209Error, instrument
 from .converter import M209, M209_ALPHABET_SET, M209_ALPHABET_LIST
+from .data import KEY_WHEEL_DATA
 from .key_wheel import KeyWheelError
-from .utils import group_text
+from .keylist.compiled import CompiledKey
 
 
 class ProcedureError(M209Error):
     pass
 
 
+class MessageFormatError(ProcedureError):
+    """Exception raised when a message to decrypt is malformed. The position
+    attribute is the offset of the error in the message.
+
+    """
+    def __init__(self, reason, position):
+        super().__init__("invalid decrypt message format: {} at position {}"
+                         .format(reason, position))
+        self.reason = reason
+        self.position = position
+
+
 DecryptParams = namedtuple('DecryptParams',
                     ['sys_ind', 'ext_msg_ind', 'key_list_ind', 'ciphertext'])
 
+# The result of parse_message(). Each field is a (start, end) pair of offsets
+# into the message.
+MessageSpans = namedtuple('MessageSpans', ['header', 'body', 'trailer'])
+
+# Number of letters in the indicator groups at each end of a message:
+INDICATOR_LETTERS = 10
+
+STREAM_RE = re.compile(r'[A-Z]*\Z')
+# The whitespace characters allowed in a message, and a regex that matches any
+# other character that is not a letter:
+WHITESPACE = ' \t\n\r\f\v'
+INVALID_CHAR_RE = re.compile(r'[^A-Z \t\n\r\f\v]')
+
+# Default number of plaintext letters StdProcedure.encrypt_stream() reads and
+# encrypts at a time:
+STREAM_CHUNK_SIZE = 4096
 
-MSG_RE = re.compile(r'^([A-Z]{5}) ([A-Z]{5}) ((?:[A-Z]{5} )+)\1 \2$')
+# Default number of messages sent to a worker process at a time by
+# StdProcedure.encrypt_many() and decrypt_many():
+BATCH_CHUNKSIZE = 16
 
 
 class StdProcedure:
@@ -65,10 +98,14 @@ class StdProcedure:
            key list necessary to decrypt the message, a ProcedureError is
            raised.
 
+    To decrypt a message as it is read from a file or other stream, use
+    set_decrypt_stream() and decrypt_stream() in steps 1 and 3 instead.
+
     """
     def __init__(self, m_209=None, key_list=None):
         self.m_209 = m_209 if m_209 else M209()
         self.decrypt_params = None
+        self._decrypt_stream = None
 
         if key_list:
             self.set_key_list(key_list)
@@ -85,15 +122,28 @@ class StdProcedure:
     def set_key_list(self, key_list):
         """Use the supplied key list for all future encrypt/decrypt operations.
 
-        Configure the M209 with the key list parameters.
+        Configure the M209 with the key list parameters. The key_list may be
+        either a KeyList or a CompiledKey. Installing a CompiledKey avoids
+        parsing and validating the key settings again.
 
         """
         if len(key_list.indicator) != 2:
             raise ProcedureError("invalid key list indicator")
 
+        reg = instrument.registry
+        if reg is not None:
+            start = instrument.clock()
+
         self.key_list = key_list
-        self.m_209.set_drum_lugs(key_list.lugs)
-        self.m_209.set_all_pins(key_list.pin_list)
+        if isinstance(key_list, CompiledKey):
+            self.m_209.set_compiled_key(key_list)
+        else:
+            self.m_209.set_drum_lugs(key_list.lugs)
+            self.m_209.set_all_pins(key_list.pin_list)
+
+        if reg is not None:
+            reg.count('procedure.key_list_installs')
+            reg.observe('procedure.set_key_list', instrument.clock() - start)
 
     def encrypt(self, plaintext, spaces=True, ext_msg_ind=None, sys_ind=None):
         """Encrypts a plaintext message using standard procedure. The encrypted text
@@ -113,12 +163,49 @@ class StdProcedure:
         A ProcedureError will be raised if the procedure does not have a key
         list to work with.
 
+        """
+        reg = instrument.registry
+        if reg is not None:
+            start = instrument.clock()
+
+        msg = ' '.join(self.encrypt_stream(plaintext, spaces=spaces,
+                                           ext_msg_ind=ext_msg_ind,
+                                           sys_ind=sys_ind))
+        if reg is not None:
+            # The body of the message is all but the 4 indicator groups:
+            letters = (len(msg) + 1) // 6 * 5 - 20
+            reg.observe('procedure.encrypt', instrument.clock() - start,
+                        letters)
+        return msg
+
+    def encrypt_stream(self, plaintext, spaces=True, ext_msg_ind=None,
+                       sys_ind=None, chunk_size=STREAM_CHUNK_SIZE):
+        """Encrypts a plaintext message using standard procedure, producing the
+        output incrementally. Returns an iterator over the 5-letter groups of
+        the encrypted message, including the message indicator groups. Joining
+        the groups with spaces gives the same result as encrypt().
+
+        The parameters are the same as for encrypt(). In addition, plaintext
+        may be any iterable of strings, such as the chunks produced by
+        m209.main.plaintext_filter(), or of single characters. It is enciphered
+        about chunk_size letters at a time, so memory use does not depend on the
+        length of the message, and the first groups are available before all of
+        the plaintext has been read.
+
+        The key list and indicators are checked, and the M209 is set up, when
+        this method is called. Errors in the plaintext are raised as the groups
+        are produced.
+
         """
         # Ensure we have a key list indicator and there is no ambiguity:
 
         if not self.key_list:
             raise ProcedureError("encrypt requires a key list")
 
+        reg = instrument.registry
+        if reg is not None:
+            start = instrument.clock()
+
         self.m_209.letter_counter = 0
 
         # Set key wheels to external message indicator
@@ -149,69 +236,144 @@ class StdProcedure:
         # Set the key wheels to the internal message indicator
         self._set_int_message_indicator(int_msg_ind)
 
-        # Now encipher the message on the M209
-        ciphertext = self.m_209.encrypt(plaintext, group=True, spaces=spaces)
+        if reg is not None:
+            reg.count('procedure.indicator_generations')
+            reg.observe('procedure.indicators', instrument.clock() - start)
+
+        # The message indicators pad each end of the message
+
+        pad1 = sys_ind * 2 + ext_msg_ind[:3]
+        pad2 = ext_msg_ind[3:] + self.key_list.indicator
+
+        return self._encrypt_groups(plaintext, spaces, chunk_size, pad1, pad2)
+
+    def _encrypt_groups(self, plaintext, spaces, chunk_size, pad1, pad2):
+        """Generator function for encrypt_stream(). The M209 must already be
+        set to the internal message indicator.
+
+        """
+        yield pad1
+        yield pad2
+
+        # Now encipher the message on the M209, a chunk at a time. Any letters
+        # that don't fill a group are carried over to the next chunk.
+        leftover = ''
+        count = 0
+        for chunk in _plaintext_chunks(plaintext, chunk_size):
+            ciphertext = leftover + self.m_209.encrypt(chunk, group=False,
+                                                       spaces=spaces)
+            count += len(chunk)
+            instrument.count('procedure.letters_encrypted', len(chunk))
+            end = len(ciphertext) - len(ciphertext) % 5
+            for i in range(0, end, 5):
+                yield ciphertext[i:i + 5]
+            leftover = ciphertext[end:]
 
         # If the final group in the ciphertext has less than 5 letters, pad with
         # X's to make a complete group:
 
-        i = ciphertext.rfind(' ')
-        if i != -1:
-            x_count = 6 - (len(ciphertext) - i)
-        else:   # only 1 group
-            x_count = 5 - len(ciphertext)
+        if leftover or not count:
+            yield leftover + 'X' * (5 - len(leftover))
 
-        if x_count:
-            ciphertext = ciphertext + 'X' * x_count
+        yield pad1
+        yield pad2
 
-        # Add the message indicators to pad each end of the message
+    def encrypt_many(self, plaintexts, workers=None, chunksize=BATCH_CHUNKSIZE,
+                     spaces=True, seed=None):
+        """Encrypts many plaintext messages in parallel using a pool of worker
+        processes. Returns a list of encrypted messages, as returned by
+        encrypt(), in the same order as the input plaintexts.
 
-        pad1 = sys_ind * 2 + ext_msg_ind[:3]
-        pad2 = ext_msg_ind[3:] + self.key_list.indicator
+        plaintexts - an iterable of plaintext strings
+        workers - the number of worker processes to use; if None, the number of
+            processors on the machine is used
+        chunksize - the number of messages sent to a worker process at a time
+        spaces - see encrypt()
+        seed - if not None, the external message and system indicators for
+            each message are generated by a random number generator seeded
+            with this value, making the results reproducible. Otherwise they
+            are chosen at random by the worker processes.
 
-        msg_parts = [pad1, pad2, ciphertext, pad1, pad2]
+        The installed key list is sent to each worker process only once, when
+        the process is started. A ProcedureError will be raised if the
+        procedure does not have a key list to work with.
 
-        # Assemble the final message
-        return ' '.join(msg_parts)
+        """
+        if not self.key_list:
+            raise ProcedureError("encrypt requires a key list")
+
+        rng = random.Random(seed) if seed is not None else None
+        jobs = []
+        for plaintext in plaintexts:
+            if rng:
+                ext_msg_ind = ''.join(rng.choice(letters)
+                                      for letters, _ in KEY_WHEEL_DATA)
+                sys_ind = rng.choice(M209_ALPHABET_LIST)
+            else:
+                ext_msg_ind = sys_ind = None
+            jobs.append((plaintext, spaces, ext_msg_ind, sys_ind))
+
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=_init_worker,
+                                 initargs=(self.key_list, )) as executor:
+            return list(executor.map(_encrypt_job, jobs, chunksize=chunksize))
+
+    def decrypt_many(self, messages, workers=None, chunksize=BATCH_CHUNKSIZE):
+        """Decrypts many messages in parallel using a pool of worker processes.
+        Returns a list of plaintext strings, as returned by decrypt(), in the
+        same order as the input messages.
+
+        messages - an iterable of message strings, as accepted by
+            set_decrypt_message()
+        workers - the number of worker processes to use; if None, the number of
+            processors on the machine is used
+        chunksize - the number of messages sent to a worker process at a time
+
+        All messages must have been encrypted with the installed key list. The
+        key list is sent to each worker process only once, when the process is
+        started. A ProcedureError is raised if any message is invalid or
+        requires a different key list.
+
+        """
+        if not self.key_list:
+            raise ProcedureError("decrypt requires a key list")
+
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=_init_worker,
+                                 initargs=(self.key_list, )) as executor:
+            return list(executor.map(_decrypt_job, messages, chunksize=chunksize))
 
     def set_decrypt_message(self, msg):
         """Prepare to decrypt the supplied message.
 
-        The messsage can be grouped into 5-letter groups separated by spaces or
-        accepted without spaces.
+        The messsage can be grouped into 5-letter groups separated by
+        whitespace or accepted without whitespace. It is checked with
+        parse_message(); a MessageFormatError is raised if it is malformed.
 
-        Returns a DecryptParams tuple to the caller. The caller should ensure
-        the procedure instance has the required key list before calling decrypt.
+        Returns a DecryptParams tuple to the caller. The ciphertext field is
+        the body of the message exactly as it appears in msg. The caller should
+        ensure the procedure instance has the required key list before calling
+        decrypt.
 
         """
-        # See if we need to group the message.
-        if ' ' not in msg:
-            msg = group_text(msg)
+        spans = parse_message(msg)
 
-        # Perform some basic checks on the message to see if it looks like an
-        # M209 message.
-
-        # Ensure the message passes a regex format check
-        m = MSG_RE.match(msg)
-        if not m:
-            raise ProcedureError("invalid decrypt message format")
-
-        group1 = m.group(1)
-        group2 = m.group(2)
+        header = ''.join(msg[slice(*spans.header)].split())
 
         # Check system indicator is repeated twice
-        if group1[0] != group1[1]:
+        if header[0] != header[1]:
             raise ProcedureError("missing system indicator")
 
-        sys_ind = group1[0]
-        ext_msg_ind = group1[2:] + group2[:3]
-        key_list_ind = group2[3:]
-        ciphertext = m.group(3).rstrip()
+        sys_ind = header[0]
+        ext_msg_ind = header[2:8]
+        key_list_ind = header[8:]
+        ciphertext = msg[slice(*spans.body)]
 
         self.decrypt_params = DecryptParams(sys_ind=sys_ind,
                                     ext_msg_ind=ext_msg_ind,
                                     key_list_ind=key_list_ind,
                                     ciphertext=ciphertext)
+        self._decrypt_stream = None
 
         return self.decrypt_params
 
@@ -223,9 +385,113 @@ class StdProcedure:
         configured with the required key list.
 
         """
-        if not self.decrypt_params:
+        if not self.decrypt_params or self.decrypt_params.ciphertext is None:
             raise ProcedureError("no prior call to set_decrypt_message")
 
+        reg = instrument.registry
+        if reg is not None:
+            start = instrument.clock()
+
+        self._start_decrypt()
+        ciphertext = ''.join(self.decrypt_params.ciphertext.split())
+        plaintext = self.m_209.decrypt(ciphertext, spaces=False, z_sub=True)
+
+        if reg is not None:
+            reg.count('procedure.letters_decrypted', len(ciphertext))
+            reg.observe('procedure.decrypt', instrument.clock() - start,
+                        len(ciphertext))
+        return plaintext
+
+    def set_decrypt_stream(self, stream):
+        """Prepare to decrypt a message read incrementally from stream, an
+        iterable of strings such as a file object, or the chunks produced by
+        iter(lambda: fp.read(n), '').
+
+        Only the two header groups are read from the stream; the rest of the
+        message is read by decrypt_stream(). Whitespace in the stream is
+        ignored, so the message may or may not be grouped.
+
+        Returns a DecryptParams tuple to the caller, as per
+        set_decrypt_message(). The ciphertext field is None since the
+        ciphertext has not been read yet. The caller should ensure the
+        procedure instance has the required key list before calling
+        decrypt_stream().
+
+        """
+        letters = _stream_letters(stream)
+        header = ''
+        for chunk in letters:
+            header += chunk
+            if len(header) >= 10:
+                break
+        else:
+            raise ProcedureError("invalid decrypt message format")
+
+        header, pending = header[:10], header[10:]
+
+        # Check system indicator is repeated twice
+        if header[0] != header[1]:
+            raise ProcedureError("missing system indicator")
+
+        self.decrypt_params = DecryptParams(sys_ind=header[0],
+                                    ext_msg_ind=header[2:8],
+                                    key_list_ind=header[8:],
+                                    ciphertext=None)
+        self._decrypt_stream = (header, pending, letters)
+
+        return self.decrypt_params
+
+    def decrypt_stream(self):
+        """Decrypt the message from a previous set_decrypt_stream() call.
+        Returns an iterator over strings of plaintext, produced as the
+        ciphertext is read from the stream. Joining the strings gives the same
+        result as decrypt().
+
+        The last two groups of the message must repeat the two header groups.
+        Since the end of the stream is not known until it is reached, the last
+        10 letters read are held back until then. If they do not match the
+        header, or the message is otherwise malformed, a ProcedureError is
+        raised after all of the plaintext has been produced.
+
+        A ProcedureError will be raised when this method is called if the
+        procedure instance has not been configured with the required key list.
+
+        """
+        if not self.decrypt_params or self._decrypt_stream is None:
+            raise ProcedureError("no prior call to set_decrypt_stream")
+
+        self._start_decrypt()
+        stream, self._decrypt_stream = self._decrypt_stream, None
+        return self._decrypt_groups(*stream)
+
+    def _decrypt_groups(self, header, pending, letters):
+        """Generator function for decrypt_stream(). The M209 must already be
+        set to the internal message indicator.
+
+        """
+        count = 0
+        for chunk in itertools.chain([''], letters):
+            pending += chunk
+            if len(pending) > 10:
+                ciphertext = pending[:-10]
+                pending = pending[-10:]
+                count += len(ciphertext)
+                plaintext = self.m_209.decrypt(ciphertext, spaces=False,
+                                               z_sub=True)
+                instrument.count('procedure.letters_decrypted',
+                                 len(ciphertext))
+                yield plaintext
+
+        if count == 0 or count % 5:
+            raise ProcedureError("invalid decrypt message format")
+        if pending != header:
+            raise ProcedureError("message trailer does not match header")
+
+    def _start_decrypt(self):
+        """Checks the required key list is installed and sets the key wheels to
+        the internal message indicator for the current decrypt parameters.
+
+        """
         if not self.key_list or (
                 self.key_list.indicator != self.decrypt_params.key_list_ind):
             raise ProcedureError("key list '{}' required".format(
@@ -234,6 +500,10 @@ class StdProcedure:
         # We assume the caller called set_key_list() if necessary, so the M209
         # has been keyed.
 
+        reg = instrument.registry
+        if reg is not None:
+            start = instrument.clock()
+
         self.m_209.letter_counter = 0
         self.m_209.set_key_wheels(self.decrypt_params.ext_msg_ind)
 
@@ -246,9 +516,10 @@ class StdProcedure:
         self._set_int_message_indicator(int_msg_ind)
 
         self.m_209.letter_counter = 0
-        plaintext = self.m_209.decrypt(self.decrypt_params.ciphertext,
-                                       spaces=True, z_sub=True)
-        return plaintext
+
+        if reg is not None:
+            reg.count('procedure.indicator_generations')
+            reg.observe('procedure.indicators', instrument.clock() - start)
 
     def _set_int_message_indicator(self, indicator):
         """Sets the key wheels to the given internal message indicator as per
@@ -268,3 +539,167 @@ class StdProcedure:
                 assert False, "Ran out of letters building internal message indicator"
             else:
                 n += 1
+
+
+def parse_message(msg):
+    """Checks the format of the message string msg in a single pass and locates
+    its parts without copying them.
+
+    A message consists of two groups of indicators, a body of one or more
+    5-letter groups, and the two indicator groups repeated. ASCII whitespace
+    is ignored, so the groups may be separated by any whitespace or not at
+    all.
+
+    Returns a MessageSpans tuple of (start, end) offsets into msg for the
+    header groups, the body and the trailer groups. The spans begin and end
+    with a letter. A MessageFormatError giving the position of the problem is
+    raised if the message is malformed.
+
+    """
+    # Find the header and trailer by scanning from each end:
+    header_start, header_end = _scan_letters(msg, 0, len(msg), 1)
+    trailer_start, trailer_end = _scan_letters(msg, header_end, len(msg), -1)
+
+    # The body lies between them, less any surrounding whitespace:
+    body_start = _skip_space(msg, header_end, trailer_start, 1)
+    body_end = _skip_space(msg, body_start, trailer_start, -1)
+    if body_start == body_end:
+        raise MessageFormatError("missing message body", body_start)
+
+    m = INVALID_CHAR_RE.search(msg, body_start, body_end)
+    if m:
+        raise MessageFormatError("invalid character", m.start())
+
+    space = sum(msg.count(c, body_start, body_end) for c in WHITESPACE)
+    if (body_end - body_start - space) % 5:
+        raise MessageFormatError("incomplete group", body_end)
+
+    # The trailer must repeat the header:
+    header = [i for i in range(header_start, header_end)
+              if msg[i] not in WHITESPACE]
+    trailer = [i for i in range(trailer_start, trailer_end)
+               if msg[i] not in WHITESPACE]
+    for i, j in zip(header, trailer):
+        if msg[i] != msg[j]:
+            raise MessageFormatError("trailer does not match header", j)
+
+    return MessageSpans(header=(header_start, header_end),
+                        body=(body_start, body_end),
+                        trailer=(trailer_start, trailer_end))
+
+
+def _scan_letters(msg, start, end, step):
+    """Scans msg between the offsets start and end, from the start if step is 1
+    or from the end if step is -1, for INDICATOR_LETTERS letters, skipping
+    whitespace. Returns the (start, end) span of the letters found.
+
+    """
+    count = 0
+    first = last = None
+    i = start if step > 0 else end - 1
+    while count < INDICATOR_LETTERS:
+        if not (start <= i < end):
+            raise MessageFormatError("message too short", len(msg))
+        c = msg[i]
+        if 'A' <= c <= 'Z':
+            if first is None:
+                first = i
+            last = i
+            count += 1
+        elif c not in WHITESPACE:
+            raise MessageFormatError("invalid character", i)
+        i += step
+
+    if step > 0:
+        return first, last + 1
+    return last, first + 1
+
+
+def _skip_space(msg, start, end, step):
+    """Returns the offset of the first non-whitespace character between start
+    and end, scanning forwards if step is 1. If step is -1, scans backwards and
+    returns the offset just past the last non-whitespace character. If there
+    is none, the offset the scan stopped at is returned.
+
+    """
+    if step > 0:
+        while start < end and msg[start] in WHITESPACE:
+            start += 1
+        return start
+    while end > start and msg[end - 1] in WHITESPACE:
+        end -= 1
+    return end
+
+
+def _stream_letters(stream):
+    """Generator function that yields the strings from the iterable stream with
+    all whitespace removed. A ProcedureError is raised if any other character
+    is not a letter in the range 'A'-'Z'.
+
+    """
+    for chunk in stream:
+        letters = ''.join(chunk.split())
+        if letters and not STREAM_RE.match(letters):
+            raise ProcedureError("invalid decrypt message format")
+        yield letters
+
+
+def _plaintext_chunks(plaintext, chunk_size):
+    """Generator function that yields the plaintext as strings of at most
+    chunk_size characters. The plaintext may be a string or an iterable of
+    strings of any length; short strings, such as single characters, are
+    collected into a chunk before it is yielded.
+
+    """
+    if isinstance(plaintext, str):
+        plaintext = [plaintext]
+
+    pending = []
+    size = 0
+    for s in plaintext:
+        while len(s) > chunk_size - size:
+            n = chunk_size - size
+            pending.append(s[:n])
+            yield ''.join(pending)
+            pending = []
+            size = 0
+            s = s[n:]
+        if s:
+            pending.append(s)
+            size += len(s)
+
+    if pending:
+        yield ''.join(pending)
+
+
+# The StdProcedure used by each worker process for encrypt_many() and
+# decrypt_many():
+_worker_proc = None
+
+
+def _init_worker(key_list):
+    """Initializes a worker process for encrypt_many() and decrypt_many() with
+    the given key list.
+
+    """
+    global _worker_proc
+    # Worker processes may inherit the parent's random number generator state;
+    # reseed so they don't all generate the same indicators.
+    random.seed()
+    _worker_proc = StdProcedure(key_list=key_list)
+
+
+def _encrypt_job(job):
+    """Encrypts one message in a worker process. The job parameter is a tuple
+    of (plaintext, spaces, ext_msg_ind, sys_ind).
+
+    """
+    plaintext, spaces, ext_msg_ind, sys_ind = job
+    return _worker_proc.encrypt(plaintext, spaces=spaces,
+                                ext_msg_ind=ext_msg_ind, sys_ind=sys_ind)
+
+
+def _decrypt_job(msg):
+    """Decrypts one message in a worker process."""
+    _worker_proc.set_decrypt_message(msg)
+    return _worker_proc.decrypt()
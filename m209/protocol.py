@@ -0,0 +1,101 @@
+# Copyright (C) 2013 by Brian Neal.
+# This file is part of m209, the M-209 simulation.
+# m209 is released under the MIT License (see LICENSE.txt).
+
+"""This module contains the message format shared by the m209 server and its
+clients.
+
+Each request and each response is a JSON object encoded as UTF-8 on a single
+line. A request names an operation and its arguments, for example:
+
+{"op": "encrypt", "key_file": "m209keys.cfg", "text": "ATTACK AT DAWN"}
+
+A successful response holds the result of the operation:
+
+{"result": "GGABC DEFYL ..."}
+
+If the operation fails, the response holds an error message instead:
+
+{"error": "key list not found in file: m209keys.cfg"}
+
+A request may also have an "id" member, which the server copies into the
+response. This lets a client match responses to requests when it sends many
+requests on one connection without waiting for the responses.
+
+A server address is either the path of a Unix domain socket or a
+(host, port) tuple for TCP.
+
+"""
+import json
+import socket
+
+from . import M209Error
+
+
+# The longest line, in bytes, accepted by the server or a client:
+MAX_LINE = 16 * 1024 * 1024
+
+
+class ServiceError(M209Error):
+    """Exception raised by a client when the server reports an error, or when a
+    request or response is invalid.
+
+    """
+    pass
+
+
+def encode(obj):
+    """Returns the request or response obj encoded as one line of bytes."""
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+def decode(line):
+    """Decodes a line of bytes into a request or response dictionary. A
+    ServiceError is raised if the line is not a JSON object.
+
+    """
+    try:
+        obj = json.loads(line)
+    except ValueError as ex:
+        raise ServiceError("invalid message: {}".format(ex))
+
+    if not isinstance(obj, dict):
+        raise ServiceError("invalid message: expected a JSON object")
+    return obj
+
+
+def result(response):
+    """Returns the result from a response dictionary, or raises a ServiceError
+    if it holds an error.
+
+    """
+    if 'error' in response:
+        raise ServiceError(response['error'])
+    return response.get('result')
+
+
+def call(address, request, timeout=None):
+    """Sends the request dictionary to the server at address over a new
+    connection and returns the result. A ServiceError is raised if the server
+    reports an error.
+
+    """
+    if isinstance(address, str):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(address)
+        except OSError:
+            sock.close()
+            raise
+    else:
+        sock = socket.create_connection(address, timeout)
+
+    with sock:
+        sock.sendall(encode(request))
+        with sock.makefile('rb') as fp:
+            line = fp.readline(MAX_LINE + 1)
+
+    if not line.endswith(b'\n'):
+        raise ServiceError("no response from server")
+    return result(decode(line))
@@ -0,0 +1,489 @@
+# Copyright (C) 2013 by Brian Neal.
+# This file is part of m209, the M-209 simulation.
+# m209 is released under the MIT License (see LICENSE.txt).
+
+"""This module contains a server that performs encrypt, decrypt and key list
+generation operations on behalf of clients connected over a Unix domain socket
+or TCP.
+
+Running the m209 command-line utility once per message costs an interpreter
+start, module imports, and parsing the key list file. A long running server
+pays these costs once: key list files stay parsed (see
+m209.keylist.config.KeyListStore) and every key list used is compiled once and
+kept. See m209.protocol for the message format.
+
+A client may send any number of requests without waiting for the responses.
+Up to MAX_PIPELINE requests per connection are worked on at once, and each
+response is sent as soon as it is ready, so responses may arrive out of order;
+a client that pipelines requests should give each one an id. Short encrypt and
+decrypt requests and batches are performed in the event loop. Key list
+generation and long messages and batches are sent to a pool of worker
+processes.
+
+Clients name key list files by paths relative to the server's key directory.
+Absolute paths, paths containing "..", and paths that lead outside the
+directory, e.g. through a symbolic link, are refused, so clients cannot use the
+server to probe the rest of the file system.
+
+"""
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import multiprocessing
+import os
+import random
+import stat
+
+from . import M209Error, instrument
+from .keylist.compiled import compile_key_list
+from .keylist.config import read_key_list
+from .keylist.key_list import valid_indicator, IndicatorIter
+from .procedure import StdProcedure
+from .protocol import MAX_LINE, ServiceError, encode, decode
+
+
+# The most requests a connection may have in flight at once:
+MAX_PIPELINE = 64
+
+# Encrypt and decrypt requests, including batches, with more letters than this
+# are sent to the worker pool instead of being performed in the event loop:
+INLINE_TEXT_LIMIT = 16 * 1024
+
+# The most key lists that can be generated by one request:
+MAX_KEY_LISTS = 26 ** 2
+
+
+class CipherService:
+    """Performs the operations requested of the server. Compiled keys are
+    cached, and a key is compiled again only if its key list file changes.
+
+    The workers parameter is the number of worker processes used for batches,
+    key list generation and long messages. If None, the number of processors
+    on the machine is used. If 0, all work is done in the calling process.
+
+    The key_file argument of a request is a path relative to the directory
+    key_dir, which defaults to the current directory.
+
+    """
+    def __init__(self, workers=None, key_dir=None):
+        self.workers = workers
+        self.key_dir = os.path.realpath(key_dir or os.curdir)
+        self._pool = None
+        # (key file path, indicator) -> (KeyList, CompiledKey)
+        self._keys = {}
+
+    def close(self):
+        """Shuts down the worker pool, if it was started."""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def get_key(self, key_file, indicator=None):
+        """Returns the CompiledKey for the key list with the given indicator in
+        the file key_file. If indicator is None, a key list is chosen at
+        random. Returns None if the key list is not found.
+
+        """
+        key_list = read_key_list(key_file, indicator)
+        if key_list is None:
+            return None
+
+        cache_key = (os.path.abspath(key_file), key_list.indicator)
+        entry = self._keys.get(cache_key)
+        if entry is None or entry[0] is not key_list:
+            entry = (key_list, compile_key_list(key_list))
+            self._keys[cache_key] = entry
+            instrument.count('server.key_cache_misses')
+        else:
+            instrument.count('server.key_cache_hits')
+        return entry[1]
+
+    def handle(self, request):
+        """Performs the operation described by the request dictionary in the
+        calling process and returns a response dictionary.
+
+        """
+        try:
+            func, args, _ = self._prepare(request)
+            response = {'result': func(*args)}
+        except M209Error as ex:
+            instrument.count_error(ex)
+            response = {'error': str(ex)}
+        except Exception as ex:
+            response = _internal_error(ex)
+        return _add_id(request, response)
+
+    async def handle_async(self, request):
+        """Coroutine that performs the operation described by the request
+        dictionary and returns a response dictionary. Heavy operations are run
+        in the worker pool.
+
+        """
+        try:
+            func, args, heavy = self._prepare(request)
+            if heavy and self.workers != 0:
+                if self._pool is None:
+                    # Forked workers would inherit the open client sockets and
+                    # keep them from closing, so the workers are spawned.
+                    self._pool = ProcessPoolExecutor(
+                            max_workers=self.workers,
+                            mp_context=multiprocessing.get_context('spawn'),
+                            initializer=random.seed)
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(self._pool, func, *args)
+            else:
+                result = func(*args)
+            response = {'result': result}
+        except M209Error as ex:
+            instrument.count_error(ex)
+            response = {'error': str(ex)}
+        except Exception as ex:
+            response = _internal_error(ex)
+        return _add_id(request, response)
+
+    def _prepare(self, request):
+        """Checks the request and looks up the keys it needs. Returns a tuple of
+        (func, args, heavy), where func(*args) performs the operation and heavy
+        is True if it should be run in the worker pool.
+
+        """
+        op = request.get('op')
+        if op == 'encrypt':
+            text = _arg(request, 'text')
+            key = self._encrypt_key(request)
+            job = (text, _arg(request, 'ext_ind', False),
+                   _arg(request, 'sys_ind', False))
+            return _encrypt, (key,) + job, len(text) > INLINE_TEXT_LIMIT
+
+        elif op == 'decrypt':
+            text = _arg(request, 'text')
+            key = self._decrypt_key(_arg(request, 'key_file'), text)
+            return _decrypt, (key, text), len(text) > INLINE_TEXT_LIMIT
+
+        elif op == 'encrypt_batch':
+            texts = _list_arg(request, 'texts')
+            key = self._encrypt_key(request)
+            ext_inds = _list_arg(request, 'ext_inds', len(texts))
+            sys_inds = _list_arg(request, 'sys_inds', len(texts))
+            jobs = list(zip(texts, ext_inds, sys_inds))
+            return _encrypt_batch, (key, jobs), _is_heavy(texts)
+
+        elif op == 'decrypt_batch':
+            key_file = _arg(request, 'key_file')
+            texts = _list_arg(request, 'texts')
+            jobs = []
+            for text in texts:
+                try:
+                    jobs.append((self._decrypt_key(key_file, text), text, None))
+                except M209Error as ex:
+                    instrument.count_error(ex)
+                    jobs.append((None, text, str(ex)))
+            return _decrypt_batch, (jobs,), _is_heavy(texts)
+
+        elif op == 'keygen':
+            return _keygen, _keygen_args(request), True
+
+        raise ServiceError("unknown operation: {}".format(op))
+
+    def _encrypt_key(self, request):
+        """Returns the CompiledKey named by the key_file and key_list_ind
+        arguments of an encrypt request.
+
+        """
+        key_file = _arg(request, 'key_file')
+        path = self._key_path(key_file)
+        key = self.get_key(path, _arg(request, 'key_list_ind', False))
+        if key is None:
+            raise ServiceError("key list not found in file: {}".format(key_file))
+        return key
+
+    def _decrypt_key(self, key_file, text):
+        """Returns the CompiledKey from the file key_file for the message text."""
+        path = self._key_path(key_file)
+        params = _get_procedure().set_decrypt_message(text)
+        key = self.get_key(path, params.key_list_ind)
+        if key is None:
+            raise ServiceError("Could not find key list {} in {}".format(
+                params.key_list_ind, key_file))
+        return key
+
+    def _key_path(self, key_file):
+        """Returns the path of the key list file key_file, given by a client
+        relative to key_dir. Raises a ServiceError if the name is absolute or
+        contains "..", or if the file is outside key_dir or does not exist.
+
+        """
+        parts = key_file.replace('\\', '/').split('/')
+        if (not key_file or os.path.isabs(key_file) or
+                os.path.splitdrive(key_file)[0] or '..' in parts):
+            raise ServiceError("invalid key list file name: {}".format(
+                key_file))
+
+        path = os.path.realpath(os.path.join(self.key_dir, key_file))
+        if (os.path.commonpath([self.key_dir, path]) != self.key_dir or
+                not os.path.isfile(path)):
+            raise ServiceError("key list file not found: {}".format(key_file))
+        return path
+
+
+def _internal_error(ex):
+    """Logs an unexpected exception and returns an error response for it, so
+    the client is not left waiting.
+
+    """
+    instrument.count_error(ex)
+    logging.exception("Error handling request")
+    return {'error': 'internal error: {}: {}'.format(type(ex).__name__, ex)}
+
+
+def _is_heavy(texts):
+    """Returns True if the list of strings texts is too long to encrypt or
+    decrypt in the event loop.
+
+    """
+    return sum(len(text) for text in texts) > INLINE_TEXT_LIMIT
+
+
+def _add_id(request, response):
+    """Copies the id of the request, if any, into the response and returns the
+    response.
+
+    """
+    if 'id' in request:
+        response['id'] = request['id']
+    return response
+
+
+def _arg(request, name, required=True):
+    """Returns the string argument name from the request dictionary. Optional
+    arguments that are missing or null are returned as None.
+
+    """
+    value = request.get(name)
+    if value is None and not required:
+        return None
+    if not isinstance(value, str):
+        raise ServiceError("invalid or missing argument: {}".format(name))
+    return value
+
+
+def _list_arg(request, name, length=None):
+    """Returns the argument name from the request dictionary, which must be a
+    list of strings. If length is given, the argument is optional, may also
+    hold nulls, and must have length items if present; if missing, a list of
+    length Nones is returned.
+
+    """
+    value = request.get(name)
+    if value is None and length is not None:
+        return [None] * length
+    if (not isinstance(value, list) or
+            (length is not None and len(value) != length) or
+            not all(isinstance(v, str) or (v is None and length is not None)
+                    for v in value)):
+        raise ServiceError("invalid or missing argument: {}".format(name))
+    return value
+
+
+def _keygen_args(request):
+    """Returns the (indicators, seed) arguments for _keygen() from a keygen
+    request. The request holds either a list of indicators, or the number of
+    key lists to generate with random indicators, and an optional seed.
+
+    """
+    seed = request.get('seed')
+    if seed is not None and not isinstance(seed, (str, int)):
+        raise ServiceError("invalid or missing argument: seed")
+
+    if request.get('indicators') is not None:
+        indicators = _list_arg(request, 'indicators')
+        if not all(valid_indicator(s) for s in indicators):
+            raise ServiceError("invalid or missing argument: indicators")
+    else:
+        number = request.get('number')
+        if (not isinstance(number, int) or isinstance(number, bool) or
+                not 1 <= number <= MAX_KEY_LISTS):
+            raise ServiceError("invalid or missing argument: number")
+        rng = random.Random(seed) if seed is not None else random
+        indicators = sorted(rng.sample(list(IndicatorIter()), number))
+
+    if len(indicators) > MAX_KEY_LISTS:
+        raise ServiceError("too many key lists requested")
+    return indicators, seed
+
+
+# The StdProcedure used by the functions below, created on first use in each
+# process:
+_procedure = None
+
+
+def _get_procedure():
+    """Returns the StdProcedure for this process."""
+    global _procedure
+    if _procedure is None:
+        _procedure = StdProcedure()
+    return _procedure
+
+
+def _encrypt(key, text, ext_ind, sys_ind):
+    """Encrypts text with the CompiledKey key and returns the message."""
+    proc = _get_procedure()
+    proc.set_key_list(key)
+    return proc.encrypt(text, ext_msg_ind=ext_ind, sys_ind=sys_ind)
+
+
+def _decrypt(key, text):
+    """Decrypts the message text with the CompiledKey key and returns the
+    plaintext.
+
+    """
+    proc = _get_procedure()
+    proc.set_decrypt_message(text)
+    proc.set_key_list(key)
+    return proc.decrypt()
+
+
+def _encrypt_batch(key, jobs):
+    """Encrypts each (text, ext_ind, sys_ind) tuple in the list jobs with the
+    CompiledKey key. Returns a list of response dictionaries, one per job.
+
+    """
+    return [_batch_item(_encrypt, key, *job) for job in jobs]
+
+
+def _decrypt_batch(jobs):
+    """Decrypts each (key, text, error) tuple in the list jobs. Jobs with an
+    error message are not decrypted; the error is reported instead. Returns a
+    list of response dictionaries, one per job.
+
+    """
+    return [{'error': error} if error else _batch_item(_decrypt, key, text)
+            for key, text, error in jobs]
+
+
+def _batch_item(func, *args):
+    """Returns the response dictionary for one item of a batch."""
+    try:
+        return {'result': func(*args)}
+    except M209Error as ex:
+        instrument.count_error(ex)
+        return {'error': str(ex)}
+
+
+def _keygen(indicators, seed):
+    """Generates a key list for each indicator and returns them as a list of
+    dictionaries.
+
+    """
+    from .keylist.generate import generate_key_lists
+
+    return [dict(key_list._asdict())
+            for key_list in generate_key_lists(indicators, seed=seed)]
+
+
+async def _handle_client(service, reader, writer):
+    """Reads requests from a client, one per line, and writes the response to
+    each as it is ready until the client disconnects. Up to MAX_PIPELINE
+    requests are worked on at once.
+
+    """
+    slots = asyncio.Semaphore(MAX_PIPELINE)
+    write_lock = asyncio.Lock()
+    pending = set()
+
+    async def send(response):
+        async with write_lock:
+            writer.write(encode(response))
+            await writer.drain()
+
+    async def run(request):
+        try:
+            await send(await service.handle_async(request))
+        except ConnectionError:
+            pass
+        finally:
+            slots.release()
+
+    try:
+        while True:
+            await slots.acquire()
+            try:
+                line = await reader.readline()
+            except ValueError:
+                await send({'error': 'request too long'})
+                break
+            if not line:
+                break
+
+            try:
+                request = decode(line)
+            except ServiceError as ex:
+                slots.release()
+                await send({'error': str(ex)})
+                continue
+
+            task = asyncio.ensure_future(run(request))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+
+        # Finish the requests in flight before closing the connection:
+        if pending:
+            await asyncio.gather(*pending)
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(socket_path=None, service=None, host=None, port=None):
+    """Starts a server and returns the asyncio Server object.
+
+    If socket_path is given, the server listens on that Unix domain socket. A
+    stale socket file left at socket_path by an earlier server is removed.
+    Otherwise the server listens on TCP host and port.
+
+    If service is None, a new CipherService is used.
+
+    """
+    if service is None:
+        service = CipherService()
+
+    async def handler(reader, writer):
+        await _handle_client(service, reader, writer)
+
+    if socket_path is None:
+        return await asyncio.start_server(handler, host=host, port=port,
+                                          limit=MAX_LINE)
+
+    try:
+        if stat.S_ISSOCK(os.stat(socket_path).st_mode):
+            os.remove(socket_path)
+    except FileNotFoundError:
+        pass
+
+    return await asyncio.start_unix_server(handler, path=socket_path,
+                                           limit=MAX_LINE)
+
+
+def serve(socket_path=None, host=None, port=None, workers=None, key_dir=None):
+    """Runs a server until interrupted, listening on the Unix domain socket
+    socket_path if given, otherwise on TCP host and port. The workers and
+    key_dir parameters are as per CipherService.
+
+    """
+    service = CipherService(workers=workers, key_dir=key_dir)
+
+    async def run():
+        server = await start_server(socket_path, service, host=host, port=port)
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    finally:
+        service.close()
+        if socket_path is not None:
+            try:
+                os.remove(socket_path)
+            except OSError:
+                pass
@@ -0,0 +1,146 @@
+# Copyright (C) 2013 by Brian Neal.
+# This file is part of m209, the M-209 simulation.
+# m209 is released under the MIT License (see LICENSE.txt).
+
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from .. import bench
+from ..keylist.tests.test_lug_cache import use_temp_cache_dir
+from ..main import main
+
+
+class BenchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        use_temp_cache_dir(self.addCleanup)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(50, bench.percentile(values, 50))
+        self.assertEqual(99, bench.percentile(values, 99))
+        self.assertEqual(1, bench.percentile([1], 99))
+        self.assertEqual(1, bench.percentile([1, 2, 3], 0))
+
+    def test_measure(self):
+        calls = []
+        result = bench.measure(bench.Benchmark('test', lambda: calls.append(1),
+                                               10), min_time=0.0, min_ops=5)
+        self.assertEqual('test', result.name)
+        self.assertEqual(5, result.ops)
+        self.assertEqual(6, len(calls))
+        self.assertAlmostEqual(result.ops_per_sec * 10, result.letters_per_sec)
+        self.assertLessEqual(result.p50, result.p99)
+
+    def test_suite(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            key_file = os.path.join(tmpdir, 'bench.cfg')
+            suite = bench.build_suite(key_file, lengths=[5])
+            self.assertFalse(os.path.exists(key_file))
+            names = [b.name for b in suite]
+            self.assertIn('M209.encrypt/5', names)
+            self.assertIn('read_key_list/676/parse', names)
+            self.assertTrue(bench.uses_key_file(suite))
+
+            # Every benchmark can be run once the key file is written:
+            bench.write_key_file(key_file)
+            for benchmark in suite:
+                benchmark.func()
+
+            selected = bench.select(suite, ['M209.*', 'generate_lugs'])
+            self.assertEqual(['M209.encrypt/5', 'M209.decrypt/5',
+                              'generate_lugs'], [b.name for b in selected])
+            self.assertIs(suite, bench.select(suite, None))
+            self.assertFalse(bench.uses_key_file(selected))
+
+    def test_baseline(self):
+        results = [bench.Result('a', 10, 100.0, 0.0, 0.010, 0.020),
+                   bench.Result('b', 10, 100.0, 0.0, 0.010, 0.020)]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, 'baseline.json')
+            bench.save_baseline(fname, results)
+            baseline = bench.load_baseline(fname)
+        self.assertEqual({'a': results[0], 'b': results[1]}, baseline)
+
+        new_results = [results[0]._replace(p50=0.005),
+                       results[1]._replace(p50=0.020),
+                       bench.Result('c', 10, 100.0, 0.0, 0.010, 0.020)]
+        comparisons = bench.compare(new_results, baseline)
+        self.assertEqual(['a', 'b'], [c.name for c in comparisons])
+        self.assertAlmostEqual(1.0, comparisons[0].change)
+        self.assertFalse(comparisons[0].regressed)
+        self.assertAlmostEqual(-0.5, comparisons[1].change)
+        self.assertTrue(comparisons[1].regressed)
+        self.assertFalse(bench.compare(new_results, baseline, 0.6)[1].regressed)
+
+        self.assertIn('REGRESSED', bench.format_result(new_results[1],
+                                                       comparisons[1]))
+
+
+class BenchCommandTestCase(unittest.TestCase):
+
+    def setUp(self):
+        use_temp_cache_dir(self.addCleanup)
+
+    def run_main(self, argv):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            main(['bench', '-t', '0', '-n', '5'] + argv)
+        return out.getvalue()
+
+    def test_text_and_json(self):
+        output = self.run_main(['-b', 'M209.*'])
+        lines = output.splitlines()
+        self.assertEqual(bench.HEADER, lines[0])
+        self.assertEqual(3, len(lines))
+        self.assertTrue(lines[1].startswith('M209.encrypt/5 '))
+
+        data = json.loads(self.run_main(['-b', 'generate_pin_list',
+                                         '--format', 'json']))
+        self.assertEqual(['generate_pin_list'],
+                         [r['name'] for r in data['results']])
+
+    def test_list(self):
+        output = self.run_main(['--list', '-b', 'read_key_list*'])
+        self.assertEqual(['read_key_list/676', 'read_key_list/676/parse'],
+                         output.split())
+
+    def test_key_file(self):
+        # The key file is only written for the read_key_list benchmarks:
+        with mock.patch.object(bench, 'write_key_file') as write_key_file:
+            self.run_main(['--list'])
+            self.run_main(['-b', 'M209.*', '-b', 'generate_lugs'])
+            self.assertFalse(write_key_file.called)
+
+    def test_baseline(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, 'baseline.json')
+            self.run_main(['-b', 'M209.encrypt/*', '--save', fname])
+            with open(fname, 'r') as fp:
+                data = json.load(fp)
+            self.assertEqual('M209.encrypt/5', data['results'][0]['name'])
+
+            # Make the baseline impossibly fast:
+            data['results'][0]['p50'] = 1e-12
+            with open(fname, 'w') as fp:
+                json.dump(data, fp)
+            self.assertRaises(SystemExit, self.run_main,
+                              ['-b', 'M209.encrypt/*', '--baseline', fname])
+            self.run_main(['-b', 'M209.encrypt/*', '--baseline', fname,
+                           '--threshold', '100'])
+
+            # Make it impossibly slow:
+            data['results'][0]['p50'] = 1e6
+            with open(fname, 'w') as fp:
+                json.dump(data, fp)
+            output = self.run_main(['-b', 'M209.encrypt/*', '--baseline',
+                                    fname, '--format', 'json'])
+            self.assertFalse(json.loads(output)['comparisons'][0]['regressed'])
+
+    def test_no_match(self):
+        self.assertRaises(SystemExit, self.run_main, ['-b', 'nope'])
@@ -0,0 +1,103 @@
+# Copyright (C) 2013 by Brian Neal.
+# This file is part of m209, the M-209 simulation.
+# m209 is released under the MIT License (see LICENSE.txt).
+
+import asyncio
+import threading
+
+from ..client import AsyncClient, Client
+from ..procedure import StdProcedure
+from ..protocol import ServiceError
+from .test_server import ServerTestBase, KEY_LIST, PLAINTEXT
+
+
+TEXTS = ['HOLD THE BRIDGE', 'SEND MORE AMMO', 'RETREAT AT ONCE', '']
+
+
+class ClientTestCase(ServerTestBase):
+
+    def expected(self, texts, ext_inds):
+        proc = StdProcedure(key_list=KEY_LIST)
+        return [proc.encrypt(text, ext_msg_ind=ext_ind, sys_ind='G')
+                for text, ext_ind in zip(texts, ext_inds)]
+
+    def test_sync_client(self):
+        texts = TEXTS * 50
+        ext_inds = ['ABCDE' + 'ABCDEFGHIJ'[n % 10] for n in range(len(texts))]
+        sys_inds = ['G'] * len(texts)
+
+        for address in (self.socket_path, self.tcp_address):
+            with Client(address, pool_size=2, batch_size=16) as client:
+                messages = client.encrypt_many(self.key_file, texts, 'AA',
+                                               ext_inds, sys_inds)
+                self.assertEqual(self.expected(texts, ext_inds), messages)
+
+                plaintexts = client.decrypt_many(self.key_file, messages)
+                proc = StdProcedure(key_list=KEY_LIST)
+                for message, plaintext in zip(messages, plaintexts):
+                    proc.set_decrypt_message(message)
+                    self.assertEqual(proc.decrypt(), plaintext)
+
+                self.assertEqual(messages[0], client.encrypt(
+                        self.key_file, texts[0], 'AA', ext_inds[0], 'G'))
+
+    def test_threads(self):
+        results = {}
+
+        def worker(client, n):
+            ext_ind = 'ABCDE' + 'ABCDEFGHIJ'[n % 10]
+            results[n] = (ext_ind, client.encrypt(self.key_file, PLAINTEXT,
+                                                  'AA', ext_ind, 'G'))
+
+        with Client(self.socket_path) as client:
+            threads = [threading.Thread(target=worker, args=(client, n))
+                       for n in range(20)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        for ext_ind, message in results.values():
+            self.assertEqual(self.expected([PLAINTEXT], [ext_ind])[0], message)
+
+    def test_async_client(self):
+        texts = TEXTS * 10
+        ext_inds = ['ABCDE' + 'ABCDEFGHIJ'[n % 10] for n in range(len(texts))]
+
+        async def run(batch_size):
+            async with AsyncClient(self.tcp_address,
+                                   batch_size=batch_size) as client:
+                messages = await asyncio.gather(*(
+                        client.encrypt(self.key_file, text, 'AA', ext_ind, 'G')
+                        for text, ext_ind in zip(texts, ext_inds)))
+                key_lists = await client.keygen(['AB', 'CD'], seed='x')
+            return messages, key_lists
+
+        for batch_size in (1, 7, 64):
+            messages, key_lists = asyncio.run(run(batch_size))
+            self.assertEqual(self.expected(texts, ext_inds), messages)
+            self.assertEqual(['AB', 'CD'], [k.indicator for k in key_lists])
+
+    def test_errors(self):
+        messages = [self.expected([PLAINTEXT], ['ABCDEF'])[0], 'GGABC DEF',
+                    'GGABC DEFZZ NQHNL GGABC DEFZZ']
+
+        async def run():
+            async with AsyncClient(self.socket_path) as client:
+                return await asyncio.gather(
+                        *(client.decrypt(self.key_file, m) for m in messages),
+                        client.encrypt(self.key_file, PLAINTEXT, 'ZZ'),
+                        return_exceptions=True)
+
+        results = asyncio.run(run())
+        self.assertEqual(PLAINTEXT, results[0])
+        self.assertIsInstance(results[1], ServiceError)
+        self.assertIn('invalid decrypt message format', str(results[1]))
+        self.assertIsInstance(results[2], ServiceError)
+        self.assertIn('Could not find key list ZZ', str(results[2]))
+        self.assertIsInstance(results[3], ServiceError)
+        self.assertIn('key list not found', str(results[3]))
+
+        with Client(self.socket_path + 'x') as client:
+            self.assertRaisesRegex(ServiceError, 'cannot connect',
+                                   client.encrypt, self.key_file, 'A')
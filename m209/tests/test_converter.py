@@ -7,7 +7,7 @@
 import unittest
 
 from .. import M209Error
-from ..converter import M209
+from ..converter import M209, grouped_length
 
 
 # Data taken from Mark J. Blair's AA key list
@@ -177,3 +177,136 @@ class M209TestCase(unittest.TestCase):
 
         self.assertEqual(settings.lugs, AA_LUGS)
         self.assertEqual(settings.pin_list, AA_PIN_LIST)
+
+    def test_guide_arm_mask(self):
+
+        m = M209(AA_LUGS, AA_PIN_LIST)
+        m.set_key_wheels('YGXREL')
+        for n in range(100):
+            expected = 0
+            for i, kw in enumerate(m.key_wheels):
+                if kw.is_effective():
+                    expected |= 1 << i
+            self.assertEqual(expected, m.guide_arm_mask())
+            m.encrypt('A')
+
+    def test_advance(self):
+
+        m1 = M209(AA_LUGS, AA_PIN_LIST)
+        m2 = M209(AA_LUGS, AA_PIN_LIST)
+        for k in [0, 1, 25, 26, 1000, 123457]:
+            m1.set_key_wheels('YGXREL')
+            m1.letter_counter = 0
+            m1.encrypt('A' * k)
+            m2.set_key_wheels('YGXREL')
+            m2.letter_counter = 0
+            m2.advance(k)
+
+            self.assertEqual(m1.letter_counter, m2.letter_counter)
+            self.assertEqual([kw.display() for kw in m1.key_wheels],
+                             [kw.display() for kw in m2.key_wheels])
+
+        self.assertRaises(M209Error, m2.advance, -1)
+
+    def test_seek(self):
+
+        m = M209(AA_LUGS, AA_PIN_LIST)
+        m.set_key_wheels('AAAAAA')
+        ct = m.encrypt('A' * 26, group=False)
+
+        for k in [20, 3, 0, 25, 10]:
+            m.seek(k)
+            self.assertEqual(k, m.letter_counter)
+            self.assertEqual(ct[k:], m.encrypt('A' * (26 - k), group=False))
+
+        self.assertRaises(M209Error, m.seek, -1)
+
+    def test_decrypt_offset(self):
+
+        m = M209(AA_LUGS, AA_PIN_LIST)
+        pt = 'ATTACK AT DAWN'
+        m.set_key_wheels('YGXREL')
+        ct = m.encrypt(pt, group=False)
+
+        m.set_key_wheels('YGXREL')
+        m.letter_counter = 0
+        result = m.decrypt(ct[7:], offset=7)
+        self.assertEqual(pt[7:], result)
+        self.assertEqual(len(pt), m.letter_counter)
+
+    def test_encrypt_bytes(self):
+
+        m = M209(AA_LUGS, AA_PIN_LIST)
+        pt = 'ATTACK AT DAWN'
+        for group in [True, False]:
+            m.set_key_wheels('YGXREL')
+            expected = m.encrypt(pt, group=group).encode('ascii')
+
+            for data in [pt.encode('ascii'), bytearray(pt, 'ascii'),
+                         memoryview(pt.encode('ascii'))]:
+                m.set_key_wheels('YGXREL')
+                m.letter_counter = 0
+                self.assertEqual(expected, m.encrypt_bytes(data, group=group))
+                self.assertEqual(len(pt), m.letter_counter)
+
+        self.assertEqual(AA_CHECK.encode('ascii'),
+                         M209(AA_LUGS, AA_PIN_LIST).encrypt_bytes(b'A' * 26))
+
+        self.assertRaises(M209Error, m.encrypt_bytes, b'ATTACK!')
+        self.assertRaises(M209Error, m.encrypt_bytes, b'ATTACK AT', spaces=False)
+
+    def test_decrypt_bytes(self):
+
+        m = M209(AA_LUGS, AA_PIN_LIST)
+        pt = 'ATTACK AT DAWN'
+        m.set_key_wheels('YGXREL')
+        ct = m.encrypt(pt).encode('ascii')
+
+        m.set_key_wheels('YGXREL')
+        self.assertEqual(pt.encode('ascii'), m.decrypt_bytes(ct))
+
+        m.set_key_wheels('YGXREL')
+        self.assertEqual(pt.replace(' ', 'Z').encode('ascii'),
+                         m.decrypt_bytes(bytearray(ct), z_sub=False))
+
+        self.assertRaises(M209Error, m.decrypt_bytes, ct, spaces=False)
+
+    def test_encrypt_into(self):
+
+        m = M209(AA_LUGS, AA_PIN_LIST)
+        out = bytearray(grouped_length(26) + 10)
+        m.set_key_wheels('AAAAAA')
+        n = m.encrypt_into(b'A' * 26, out, group=True)
+        self.assertEqual(grouped_length(26), n)
+        self.assertEqual(AA_CHECK.encode('ascii'), out[:n])
+
+        # The defaults are the same as for encrypt_bytes():
+        m.set_key_wheels('AAAAAA')
+        n = m.encrypt_into(b'A' * 26, out)
+        m.set_key_wheels('AAAAAA')
+        self.assertEqual(m.encrypt_bytes(b'A' * 26), out[:n])
+
+        out = bytearray(25)
+        self.assertRaises(M209Error, m.encrypt_into, b'A' * 26, out)
+        self.assertRaises(M209Error, m.encrypt_into, b'A' * 25, out, group=True)
+        self.assertRaises(M209Error, m.encrypt_into, b'A' * 25, b' ' * 25)
+
+    def test_in_place(self):
+
+        m = M209(AA_LUGS, AA_PIN_LIST)
+        buf = bytearray(b'ATTACKZATZDAWN')
+        m.set_key_wheels('YGXREL')
+        n = m.encrypt_into(buf, buf, group=False)
+        self.assertEqual(len(buf), n)
+        m.set_key_wheels('YGXREL')
+        self.assertEqual(m.encrypt('ATTACKZATZDAWN', group=False).encode('ascii'),
+                         buf)
+
+        m.set_key_wheels('YGXREL')
+        n = m.decrypt_into(buf, memoryview(buf), z_sub=False)
+        self.assertEqual(b'ATTACKZATZDAWN', buf[:n])
+
+    def test_grouped_length(self):
+
+        for n in range(30):
+            self.assertEqual(len(M209().encrypt('A' * n)), grouped_length(n))
@@ -4,9 +4,10 @@
 
 """test_drum.py - Unit tests for the Drum class for the M-209 simulation."""
 
+import random
 import unittest
 
-from ..drum import Drum, DrumError
+from ..drum import Drum, DrumError, pins_to_mask
 
 
 class DrumTestCase(unittest.TestCase):
@@ -129,6 +130,40 @@ class DrumTestCase(unittest.TestCase):
         drum = Drum([(2, 4)] * 10)
         self.assertEqual(10, drum.rotate([False, False, False, False, True, False]))
 
+    def test_rotate_mask(self):
+
+        drum = Drum.from_key_list('0-4 0-5*4 0-6*6 1-0*5 1-2 1-5*4 3-0*3 3-4 3-6 5-6')
+        self.assertEqual(Drum.NUM_MASKS, len(drum.count_table))
+        self.assertEqual(0, drum.rotate_mask(0))
+        self.assertEqual(Drum.NUM_BARS, drum.rotate_mask(Drum.NUM_MASKS - 1))
+
+        for mask in range(Drum.NUM_MASKS):
+            pins = [bool(mask & (1 << n)) for n in range(6)]
+            self.assertEqual(mask, pins_to_mask(pins))
+
+            count = 0
+            for lug_pair in drum.bars:
+                if any(pins[index] for index in lug_pair):
+                    count += 1
+            self.assertEqual(count, drum.rotate_mask(mask))
+            self.assertEqual(count, drum.rotate(pins))
+
+    def test_count_table(self):
+
+        rng = random.Random(1)
+        lugs = [(n, ) for n in range(6)] + [(a, b) for a in range(6)
+                                            for b in range(a + 1, 6)]
+        for _ in range(200):
+            bars = [rng.choice(lugs)
+                    for _ in range(rng.randint(0, Drum.NUM_BARS))]
+            drum = Drum(bars)
+            for mask in range(Drum.NUM_MASKS):
+                count = 0
+                for lug_pair in drum.bars:
+                    if any(mask & (1 << index) for index in lug_pair):
+                        count += 1
+                self.assertEqual(count, drum.count_table[mask])
+
     def test_to_key_list(self):
 
         drum = Drum.from_key_list('1-0*5 0-3*3 0-4 0-5*4 0-6*6 1-2 1-5*4 3-4 3-6 5-6')
@@ -0,0 +1,132 @@
+# Copyright (C) 2013 by Brian Neal.
+# This file is part of m209, the M-209 simulation.
+# m209 is released under the MIT License (see LICENSE.txt).
+
+"""Unit tests for the Prometheus metrics exporter."""
+
+import os
+import tempfile
+import unittest
+import urllib.error
+import urllib.request
+
+from .. import instrument
+from ..exporter import (CONTENT_TYPE, Exporter, Histogram, metric_name,
+                        start_http_server)
+from ..keylist.config import write
+from ..procedure import StdProcedure
+from ..server import CipherService
+from .test_instrument import FM, PLAINTEXT
+
+
+class HistogramTestCase(unittest.TestCase):
+
+    def test_lines(self):
+        h = Histogram((1, 2))
+        for value in (0.5, 1, 1.5, 3):
+            h.observe(value)
+        self.assertEqual([
+            'x_bucket{a="b",le="1"} 2',
+            'x_bucket{a="b",le="2"} 3',
+            'x_bucket{a="b",le="+Inf"} 4',
+            'x_sum{a="b"} 6.0',
+            'x_count{a="b"} 4',
+        ], h.lines('x', (('a', 'b'), )))
+
+    def test_metric_name(self):
+        self.assertEqual('m209_drum_evaluations',
+                         metric_name('m209.drum_evaluations'))
+        self.assertEqual('m209_keylist_cache_hits',
+                         metric_name('keylist.cache_hits'))
+
+
+class ExporterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.reg = instrument.enable()
+        self.exporter = Exporter()
+
+    def tearDown(self):
+        self.exporter.close()
+        instrument.disable()
+
+    def test_render(self):
+        self.assertIs(self.reg, self.exporter.registry)
+
+        proc = StdProcedure(key_list=FM)
+        proc.encrypt(PLAINTEXT)
+        proc.encrypt('A' * 300)
+        self.reg.count('keygen.lug_attempts', 3)
+        instrument.count_error(ValueError())
+
+        lines = self.exporter.render().splitlines()
+        self.assertIn('# TYPE m209_drum_evaluations_total counter', lines)
+        self.assertIn('m209_procedure_letters_encrypted_total 314', lines)
+        self.assertIn('m209_keygen_lug_attempts_total 3', lines)
+
+        # Errors are labelled by type, and every type is always present:
+        self.assertIn('m209_errors_total{type="other"} 1', lines)
+        self.assertIn('m209_errors_total{type="KeyListGenError"} 0', lines)
+
+        self.assertIn('# TYPE m209_procedure_encrypt_seconds histogram', lines)
+        self.assertIn('m209_procedure_encrypt_seconds_count{size="16"} 1',
+                      lines)
+        self.assertIn('m209_procedure_encrypt_seconds_count{size="4096"} 1',
+                      lines)
+        self.assertIn('m209_procedure_set_key_list_seconds_count 1', lines)
+        self.assertIn('m209_keygen_lug_attempts_per_call_bucket{le="2"} 0',
+                      lines)
+        self.assertIn('m209_keygen_lug_attempts_per_call_bucket{le="4"} 1',
+                      lines)
+
+    def test_server(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            key_file = os.path.join(tmpdir, 'keys.cfg')
+            write(key_file, [FM])
+
+            service = CipherService(workers=0, key_dir=tmpdir)
+            request = {'op': 'encrypt', 'key_file': 'keys.cfg', 'text': 'A'}
+            for _ in range(3):
+                self.assertIn('result', service.handle(request))
+            request['ext_ind'] = 'ZZZZZZ'
+            self.assertIn('error', service.handle(request))
+
+        lines = self.exporter.render().splitlines()
+        self.assertIn('m209_keylist_cache_misses_total 1', lines)
+        self.assertIn('m209_keylist_cache_hits_total 3', lines)
+        self.assertIn('m209_server_key_cache_misses_total 1', lines)
+        self.assertIn('m209_server_key_cache_hits_total 3', lines)
+        self.assertIn('m209_errors_total{type="ProcedureError"} 1', lines)
+
+    def test_decrypt_error(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            write(os.path.join(tmpdir, 'keys.cfg'), [FM])
+
+            # The MessageFormatError raised for a bad message is a
+            # ProcedureError:
+            service = CipherService(workers=0, key_dir=tmpdir)
+            request = {'op': 'decrypt', 'key_file': 'keys.cfg', 'text': 'A'}
+            self.assertIn('error', service.handle(request))
+
+        lines = self.exporter.render().splitlines()
+        self.assertIn('m209_errors_total{type="ProcedureError"} 1', lines)
+        self.assertIn('m209_errors_total{type="other"} 0', lines)
+        self.assertFalse(any('MessageFormatError' in line for line in lines))
+
+    def test_http(self):
+        server = start_http_server(0, exporter=self.exporter)
+        try:
+            url = 'http://127.0.0.1:{}'.format(server.server_port)
+            with urllib.request.urlopen(url + '/metrics') as response:
+                self.assertEqual(CONTENT_TYPE,
+                                 response.headers['Content-Type'])
+                body = response.read().decode('utf-8')
+            self.assertIn('# TYPE m209_errors_total counter', body)
+
+            with self.assertRaises(urllib.error.HTTPError) as cm:
+                urllib.request.urlopen(url + '/')
+            self.assertEqual(404, cm.exception.code)
+            cm.exception.close()
+        finally:
+            server.shutdown()
+            server.server_close()
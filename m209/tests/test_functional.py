@@ -0,0 +1,72 @@
+# Copyright (C) 2013 by Brian Neal.
+# This file is part of m209, the M-209 simulation.
+# m209 is released under the MIT License (see LICENSE.txt).
+
+"""test_functional.py - Unit tests for the functional cipher interface."""
+
+from concurrent.futures import ThreadPoolExecutor
+import random
+import string
+import unittest
+
+import m209
+from .. import M209Error
+from ..converter import M209
+from ..functional import cipher
+from ..keylist import KeyList, compile_key_list
+from .test_converter import AA_LUGS, AA_PIN_LIST, AA_CHECK
+
+
+AA_KEY = compile_key_list(KeyList(indicator='AA', lugs=AA_LUGS,
+                                  pin_list=AA_PIN_LIST, letter_check=AA_CHECK))
+
+
+class FunctionalTestCase(unittest.TestCase):
+
+    def test_letter_check(self):
+        result = cipher(AA_KEY, 'AAAAAA', 'A' * 26)
+        self.assertEqual(AA_CHECK.replace(' ', ''), result.text)
+
+        m = M209(AA_LUGS, AA_PIN_LIST)
+        m.encrypt('A' * 26)
+        self.assertEqual(''.join(kw.display() for kw in m.key_wheels),
+                         result.positions)
+
+    def test_package_export(self):
+        self.assertTrue(m209.cipher is cipher)
+
+    def test_matches_m209(self):
+        rng = random.Random(7)
+        m = M209(AA_LUGS, AA_PIN_LIST)
+        for n in [0, 1, 50, 500]:
+            pt = ''.join(rng.choice(string.ascii_uppercase) for i in range(n))
+            start = m.set_random_key_wheels()
+            ct = m.encrypt(pt, group=False)
+            end = ''.join(kw.display() for kw in m.key_wheels)
+
+            self.assertEqual((ct, end), tuple(cipher(AA_KEY, start, pt)))
+            self.assertEqual(pt, cipher(AA_KEY, start, ct).text)
+
+    def test_offset(self):
+        ct = cipher(AA_KEY, 'YGXREL', 'ATTACKZATZDAWN').text
+        result = cipher(AA_KEY, 'YGXREL', ct[10:], offset=10)
+        self.assertEqual('DAWN', result.text)
+
+        head = cipher(AA_KEY, 'YGXREL', ct[:10])
+        tail = cipher(AA_KEY, head.positions, ct[10:])
+        self.assertEqual(result, tail)
+
+    def test_errors(self):
+        self.assertRaises(M209Error, cipher, AA_KEY, 'AAAAA', 'A')
+        self.assertRaises(M209Error, cipher, AA_KEY, 'AAAAAW', 'A')
+        self.assertRaises(M209Error, cipher, AA_KEY, 'AAAAAA', 'A A')
+        self.assertRaises(M209Error, cipher, AA_KEY, 'AAAAAA', 'a')
+        self.assertRaises(M209Error, cipher, AA_KEY, 'AAAAAA', 'A', offset=-1)
+
+    def test_threads(self):
+        pt = 'ATTACKZATZDAWN' * 20
+        expected = cipher(AA_KEY, 'YGXREL', pt)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(
+                lambda n: cipher(AA_KEY, 'YGXREL', pt), range(64)))
+        self.assertTrue(all(r == expected for r in results))
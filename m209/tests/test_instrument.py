@@ -0,0 +1,193 @@
+# Copyright (C) 2013 by Brian Neal.
+# This file is part of m209, the M-209 simulation.
+# m209 is released under the MIT License (see LICENSE.txt).
+
+"""Unit tests for the instrumentation registry and hooks."""
+
+import threading
+import unittest
+
+from .. import M209Error, instrument
+from ..converter import M209
+from ..key_wheel import KeyWheelError
+from ..keylist import KeyList
+from ..keylist.generate import generate_lugs, generate_pin_list
+from ..keylist.tests.test_lug_cache import use_temp_cache_dir
+from ..procedure import MessageFormatError, StdProcedure
+
+
+PLAINTEXT = 'ATTACK AT DAWN'
+CIPHERTEXT = 'GGABC DEFFM NQHNL CAARZ OLTVX GGABC DEFFM'
+
+FM = KeyList(indicator="FM",
+             lugs='1-0 2-0*8 0-3*7 0-4*5 0-5*2 1-5 1-6 3-4 4-5',
+             pin_list=[
+                 'BCEJOPSTUVXY',
+                 'ACDHJLMNOQRUYZ',
+                 'AEHJLOQRUV',
+                 'DFGILMNPQS',
+                 'CEHIJLNPS',
+                 'ACDFHIMN'
+             ],
+             letter_check='TNMYS CRMKK UHLKW LDQHM RQOLW R')
+
+
+class RegistryTestCase(unittest.TestCase):
+
+    def test_counters_and_timers(self):
+        reg = instrument.Registry()
+        reg.count('a')
+        reg.count('a', 4)
+        reg.observe('t', 2.0)
+        reg.observe('t', 1.0)
+        reg.observe('t', 3.0)
+
+        snapshot = reg.snapshot()
+        self.assertEqual({'a': 5}, snapshot.counters)
+        self.assertEqual({'t': instrument.TimerStats(3, 6.0, 1.0, 3.0)},
+                         snapshot.timers)
+
+        # Snapshots are not affected by later updates:
+        reg.count('a')
+        self.assertEqual(5, snapshot.counters['a'])
+
+        reg.reset()
+        self.assertEqual(instrument.Snapshot({}, {}), reg.snapshot())
+
+    def test_listeners(self):
+        reg = instrument.Registry()
+        updates = []
+        listener = lambda *args: updates.append(args)
+        reg.add_listener(listener)
+        reg.count('a', 2)
+        reg.observe('t', 0.5)
+        reg.observe('t', 0.25, 10)
+        reg.remove_listener(listener)
+        reg.count('a')
+        self.assertEqual([('counter', 'a', 2, None), ('timer', 't', 0.5, None),
+                          ('timer', 't', 0.25, 10)], updates)
+
+    def test_threads(self):
+        reg = instrument.Registry()
+
+        def worker():
+            for _ in range(1000):
+                reg.count('a')
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(4000, reg.snapshot().counters['a'])
+
+
+class InstrumentTestCase(unittest.TestCase):
+
+    def setUp(self):
+        use_temp_cache_dir(self.addCleanup)
+        self.reg = instrument.enable()
+
+    def tearDown(self):
+        instrument.disable()
+
+    def test_enable_disable(self):
+        self.assertIs(self.reg, instrument.registry)
+        instrument.count('a')
+        instrument.observe('t', 1.0)
+        self.assertEqual({'a': 1}, instrument.snapshot().counters)
+
+        reg = instrument.Registry()
+        self.assertIs(reg, instrument.enable(reg))
+        self.assertIs(reg, instrument.disable())
+        self.assertIsNone(instrument.registry)
+        self.assertIsNone(instrument.snapshot())
+
+        # Updates are dropped while disabled:
+        instrument.count('a')
+        M209().encrypt('AAAAA')
+        self.assertEqual(instrument.Snapshot({}, {}), reg.snapshot())
+
+    def test_procedure(self):
+        proc = StdProcedure(key_list=FM)
+        result = proc.encrypt(PLAINTEXT, ext_msg_ind='ABCDEF', sys_ind='G')
+        self.assertEqual(CIPHERTEXT, result)
+
+        proc.set_decrypt_message(CIPHERTEXT)
+        proc.decrypt()
+
+        snapshot = self.reg.snapshot()
+        self.assertEqual({
+            'procedure.key_list_installs': 1,
+            'procedure.indicator_generations': 2,
+            'procedure.letters_encrypted': 14,
+            'procedure.letters_decrypted': 15,
+            'm209.drum_evaluations': 24 + 14 + 12 + 15,
+            'm209.wheel_steps': 24 + 14 + 12 + 15,
+        }, snapshot.counters)
+        self.assertEqual({'procedure.set_key_list', 'procedure.indicators',
+                          'procedure.encrypt', 'procedure.decrypt',
+                          'm209.encrypt', 'm209.decrypt'},
+                         set(snapshot.timers))
+        self.assertEqual(2, snapshot.timers['procedure.indicators'].count)
+        self.assertEqual(3, snapshot.timers['m209.encrypt'].count)
+
+        # Cipher operation timers report the letters ciphered:
+        timings = []
+        self.reg.add_listener(lambda kind, name, value, letters:
+                              timings.append((name, letters)))
+        proc.encrypt(PLAINTEXT, ext_msg_ind='ABCDEF', sys_ind='G')
+        proc.decrypt()
+        self.assertIn(('procedure.encrypt', 15), timings)
+        self.assertIn(('procedure.decrypt', 15), timings)
+        self.assertIn(('m209.encrypt', 14), timings)
+
+    def test_decrypt_stream(self):
+        proc = StdProcedure(key_list=FM)
+        proc.set_decrypt_stream(iter([CIPHERTEXT[:12], CIPHERTEXT[12:]]))
+        ''.join(proc.decrypt_stream())
+        counters = self.reg.snapshot().counters
+        self.assertEqual(15, counters['procedure.letters_decrypted'])
+
+    def test_m209(self):
+        m = M209(FM.lugs, FM.pin_list)
+        m.encrypt('AAAAA')
+        m.decrypt('AAAAA AAAAA', offset=3)
+        m.encrypt_bytes(b'AAAAA')
+        m.decrypt_bytes(b'AAAAA AAA')
+        m.advance(7)
+        m.seek(0)
+
+        counters = self.reg.snapshot().counters
+        self.assertEqual(5 + 10 + 5 + 8, counters['m209.drum_evaluations'])
+        self.assertEqual(5 + 3 + 10 + 5 + 8 + 7 + 38,
+                         counters['m209.wheel_steps'])
+
+        # Failed operations are timed too:
+        timers = self.reg.snapshot().timers
+        self.assertRaises(M209Error, m.encrypt, 'AA1')
+        self.assertRaises(M209Error, m.decrypt, 'AA1')
+        snapshot = self.reg.snapshot()
+        self.assertEqual(timers['m209.encrypt'].count + 1,
+                         snapshot.timers['m209.encrypt'].count)
+        self.assertEqual(timers['m209.decrypt'].count + 1,
+                         snapshot.timers['m209.decrypt'].count)
+
+    def test_count_error(self):
+        instrument.count_error(ValueError())
+        instrument.count_error(M209Error())
+        instrument.count_error(MessageFormatError('bad', 0))
+        instrument.count_error(KeyWheelError())
+        self.assertEqual({'errors.other': 2, 'errors.ProcedureError': 1,
+                          'errors.KeyWheelError': 1},
+                         self.reg.snapshot().counters)
+
+    def test_keygen(self):
+        generate_lugs()
+        generate_lugs([1, 2, 3, 4, 8, 10])
+        generate_pin_list()
+        generate_pin_list(max_attempts=1000)
+
+        counters = self.reg.snapshot().counters
+        self.assertGreaterEqual(counters['keygen.lug_attempts'], 2)
+        self.assertGreaterEqual(counters['keygen.pin_attempts'], 2)
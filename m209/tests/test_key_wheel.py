@@ -110,3 +110,29 @@ class KeyWheelTestCase(unittest.TestCase):
         kw = KeyWheel(string.ascii_uppercase, 'P', 'FGIKOPRSUVWYZ')
         self.assertEqual(str(kw), ('-A -B -C -D -E F- G- -H I- -J K- -L -M -N '
                                    'O- P- -Q R- S- -T U- V- W- -X Y- Z-'))
+
+    def test_guide_bit(self):
+        letters = string.ascii_uppercase
+        kw = KeyWheel(letters, 'P', 'FGIKOPRSUVWYZ')
+        for n in range(2 * len(letters)):
+            expected = 1 if kw.guide_letter() in 'FGIKOPRSUVWYZ' else 0
+            self.assertEqual(expected, kw.guide_bit())
+            self.assertEqual(bool(expected), kw.is_effective())
+            kw.rotate()
+
+    def test_set_pin_mask(self):
+        kw = KeyWheel('ABCDEFG', 'C')
+        kw.set_pin_mask(0b1000101)
+        self.assertEqual('ACG', kw.effective_pins)
+        self.assertEqual([True, False, True, False, False, False, True], kw.pins)
+
+        kw2 = KeyWheel('ABCDEFG', 'C', 'ACG')
+        self.assertEqual(kw.pin_mask, kw2.pin_mask)
+        self.assertEqual(kw.guide_pins, kw2.guide_pins)
+
+        self.assertRaises(KeyWheelError, kw.set_pin_mask, -1)
+        self.assertRaises(KeyWheelError, kw.set_pin_mask, 1 << 7)
+
+    def test_slots(self):
+        kw = KeyWheel('ABCDEFG', 'C')
+        self.assertRaises(AttributeError, setattr, kw, 'foo', 1)
@@ -2,17 +2,44 @@
 # This file is part of m209, the M-209 simulation.
 # m209 is released under the MIT License (see LICENSE.txt).
 
+import contextlib
+import io
 import os
 import tempfile
 import unittest
 
-from ..main import main
+from ..main import main, plaintext_filter
+from ..keylist.config import read_key_list
+from ..keylist.tests.test_lug_cache import use_temp_cache_dir
+from ..procedure import StdProcedure
+
+
+class PlaintextFilterTestCase(unittest.TestCase):
+
+    def test_filter(self):
+        text = 'Meet at 0900,\tnear the\r\nBRIDGE! \u00e9\u3000'
+        expected = 'MEETZATZZNEARZTHEZZBRIDGEZZ'
+        self.assertEqual(expected, ''.join(plaintext_filter(text)))
+
+        for read_size in (1, 4, 100):
+            chunks = list(plaintext_filter(io.StringIO(text), read_size))
+            self.assertEqual(expected, ''.join(chunks))
+            self.assertTrue(all(chunks))
+
+        # Iterables of lines are accepted as before:
+        lines = io.StringIO(text).readlines()
+        self.assertEqual(expected, ''.join(plaintext_filter(lines)))
+        self.assertEqual(expected,
+                         ''.join(plaintext_filter(line for line in lines)))
+
+        self.assertEqual([], list(plaintext_filter('123,.!')))
 
 
 class KeyGenTestCase(unittest.TestCase):
 
     def setUp(self):
 
+        use_temp_cache_dir(self.addCleanup)
         self.fp = tempfile.NamedTemporaryFile(mode='w')
 
     def tearDown(self):
@@ -46,6 +73,27 @@ class KeyGenTestCase(unittest.TestCase):
         main(argv)
 
 
+    def test_jobs_seed(self):
+        """Test parallel generation is deterministic for a given seed"""
+
+        argv = ['keygen', '--number=10', '-o', '-z', self.fp.name,
+                '--seed=209']
+        main(argv)
+        with open(self.fp.name) as fp:
+            serial = fp.read()
+
+        main(argv + ['--jobs=3'])
+        with open(self.fp.name) as fp:
+            parallel = fp.read()
+
+        self.assertEqual(serial, parallel)
+
+    def test_bad_jobs(self):
+
+        argv = ['keygen', '-o', '-z', self.fp.name, '--jobs=0']
+        self.assertRaises(SystemExit, main, argv)
+
+
 class EncryptDecryptBadArgsTestCase(unittest.TestCase):
 
     def test_no_key_file(self):
@@ -66,6 +114,7 @@ class EncryptDecryptTestCase(unittest.TestCase):
 
     def setUp(self):
 
+        use_temp_cache_dir(self.addCleanup)
         self.fp = tempfile.NamedTemporaryFile(mode='w')
         argv = ['keygen', '--start=GG', '--number=10', '-o', '-z', self.fp.name]
         main(argv)
@@ -112,6 +161,50 @@ class EncryptDecryptTestCase(unittest.TestCase):
         finally:
             os.remove(filename)
 
+    def test_encrypt_file_stream(self):
+
+        infile = tempfile.NamedTemporaryFile(mode='w', delete=False)
+        text = 'Rendezvous at zero seven thirty.\n' * 500
+        infile.write(text)
+        filename = infile.name
+        infile.close()
+
+        argv = ['encrypt', '-f', filename, '-k', 'GG', '-e', 'ABCDEF', '-s', 'Q',
+                '-z', self.fp.name]
+        out = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(out):
+                main(argv)
+        finally:
+            os.remove(filename)
+
+        pt = ''.join(c if c.isalpha() else 'Z' for c in text.upper()
+                     if c.isalpha() or c.isspace())
+        proc = StdProcedure(key_list=read_key_list(self.fp.name, 'GG'))
+        expected = proc.encrypt(pt, ext_msg_ind='ABCDEF', sys_ind='Q')
+        self.assertEqual(expected + '\n', out.getvalue())
+
+    def test_decrypt_file_stream(self):
+
+        proc = StdProcedure(key_list=read_key_list(self.fp.name, 'GG'))
+        pt = 'ATTACKZATZDAWN' * 1000
+        ct = proc.encrypt(pt)
+
+        infile = tempfile.NamedTemporaryFile(mode='w', delete=False)
+        infile.write(ct + '\n')
+        filename = infile.name
+        infile.close()
+
+        argv = ['decrypt', '-f', filename, '-z', self.fp.name]
+        out = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(out):
+                main(argv)
+        finally:
+            os.remove(filename)
+
+        self.assertEqual(pt.replace('Z', ' '), out.getvalue()[:len(pt)])
+
     def test_decrypt_text(self):
 
         argv = ['decrypt', '-t', 'OOOZS IENGA DSGJX OOOZS IENGA', '-z', self.fp.name]
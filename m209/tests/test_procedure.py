@@ -6,8 +6,9 @@
 
 import unittest
 
-from ..keylist import KeyList
-from ..procedure import StdProcedure, ProcedureError
+from ..keylist import KeyList, compile_key_list
+from ..procedure import (StdProcedure, ProcedureError, MessageFormatError,
+                         parse_message)
 
 
 PLAINTEXT = 'ATTACK AT DAWN'
@@ -45,6 +46,139 @@ class ProcedureTestCase(unittest.TestCase):
         plaintext = self.proc.decrypt()
         self.assertEqual(plaintext[:len(PLAINTEXT)], PLAINTEXT)
 
+    def test_parse_message(self):
+        spans = parse_message(CIPHERTEXT)
+        self.assertEqual(spans.header, (0, 11))
+        self.assertEqual(spans.body, (12, 29))
+        self.assertEqual(spans.trailer, (30, 41))
+
+        # Any whitespace, or none at all, is accepted:
+        msg = '\n  GGABCDEFFM\tNQHNL\r\nCAARZ OLTVXGGABC  DEFFM \n'
+        spans = parse_message(msg)
+        self.assertEqual(msg[slice(*spans.header)], 'GGABCDEFFM')
+        self.assertEqual(msg[slice(*spans.body)], 'NQHNL\r\nCAARZ OLTVX')
+        self.assertEqual(msg[slice(*spans.trailer)], 'GGABC  DEFFM')
+
+        self.proc.set_decrypt_message(msg)
+        plaintext = self.proc.decrypt()
+        self.assertEqual(plaintext[:len(PLAINTEXT)], PLAINTEXT)
+
+    def test_parse_message_errors(self):
+        cases = [
+            ('GGABC DEFFM', 'too short', 11),
+            ('GGABC DEFFM GGABC DEFFM', 'missing message body', 12),
+            ('GGABC DEFFM NQHNL CAArZ OLTVX GGABC DEFFM', 'character', 21),
+            ('GGABC DEFFM NQHNL CAARZ OLTV GGABC DEFFM', 'incomplete', 28),
+            ('GGABC DEFFM NQHNL CAARZ OLTVX GGABC DEFFN', 'trailer', 40),
+            ('GGA-C DEFFM NQHNL CAARZ OLTVX GGABC DEFFM', 'character', 3),
+        ]
+        for msg, reason, position in cases:
+            with self.assertRaisesRegex(MessageFormatError, reason) as cm:
+                parse_message(msg)
+            self.assertEqual(position, cm.exception.position)
+            self.assertIn('invalid decrypt message format', str(cm.exception))
+
+    def test_decrypt_stream(self):
+        # Feed the message in small, uneven pieces:
+        msg = CIPHERTEXT.replace(' ', '\n', 3)
+        stream = (msg[i:i + 3] for i in range(0, len(msg), 3))
+        params = self.proc.set_decrypt_stream(stream)
+        self.assertEqual(params.sys_ind, 'G')
+        self.assertEqual(params.ext_msg_ind, 'ABCDEF')
+        self.assertEqual(params.key_list_ind, 'FM')
+        self.assertIsNone(params.ciphertext)
+
+        plaintext = ''.join(self.proc.decrypt_stream())
+        self.proc.set_decrypt_message(CIPHERTEXT)
+        self.assertEqual(plaintext, self.proc.decrypt())
+
+        # Ungrouped input works too:
+        self.proc.set_decrypt_stream([CIPHERTEXT.replace(' ', '')])
+        self.assertEqual(plaintext, ''.join(self.proc.decrypt_stream()))
+
+    def test_decrypt_stream_trailer(self):
+        msg = CIPHERTEXT[:-1] + 'N'
+        self.proc.set_decrypt_stream([msg])
+        groups = self.proc.decrypt_stream()
+        self.assertEqual(next(groups)[:5], PLAINTEXT[:5])
+        self.assertRaisesRegex(ProcedureError, 'trailer', list, groups)
+
+        for msg in (CIPHERTEXT[:12] + CIPHERTEXT[-11:],
+                    CIPHERTEXT[:-7] + CIPHERTEXT[-6:]):
+            self.proc.set_decrypt_stream([msg])
+            self.assertRaisesRegex(ProcedureError, 'message format', list,
+                                   self.proc.decrypt_stream())
+
+    def test_compiled_key(self):
+        key = compile_key_list(self.fm)
+        proc = StdProcedure(key_list=key)
+        self.assertTrue(proc.get_key_list() is key)
+
+        result = proc.encrypt(PLAINTEXT, ext_msg_ind='ABCDEF', sys_ind='G')
+        self.assertEqual(result, CIPHERTEXT)
+
+        proc.set_decrypt_message(CIPHERTEXT)
+        plaintext = proc.decrypt()
+        self.assertEqual(plaintext[:len(PLAINTEXT)], PLAINTEXT)
+
+    def test_encrypt_many(self):
+        plaintexts = [PLAINTEXT * n for n in range(1, 41)]
+        results = self.proc.encrypt_many(plaintexts, workers=2, chunksize=3,
+                                         seed=209)
+        self.assertEqual(len(plaintexts), len(results))
+
+        # Results must be in order and match a serial encrypt using the same
+        # indicators:
+        for plaintext, msg in zip(plaintexts, results):
+            groups = msg.split()
+            sys_ind = groups[0][0]
+            ext_msg_ind = groups[0][2:] + groups[1][:3]
+            self.assertEqual(msg, self.proc.encrypt(plaintext,
+                             ext_msg_ind=ext_msg_ind, sys_ind=sys_ind))
+
+        # Seeded results are reproducible regardless of worker count:
+        results2 = self.proc.encrypt_many(plaintexts, workers=3, seed=209)
+        self.assertEqual(results, results2)
+
+        decrypted = self.proc.decrypt_many(results, workers=2, chunksize=5)
+        self.assertEqual(plaintexts, [result[:len(pt)] for pt, result in
+                                      zip(plaintexts, decrypted)])
+
+    def test_many_errors(self):
+        proc = StdProcedure()
+        self.assertRaises(ProcedureError, proc.encrypt_many, [PLAINTEXT])
+        self.assertRaises(ProcedureError, proc.decrypt_many, [CIPHERTEXT])
+
+        self.assertRaises(ProcedureError, self.proc.decrypt_many,
+                          [CIPHERTEXT, 'GGABC DEFYL NQHNL CAARZ OLTVX GGABC DEFYL'],
+                          workers=2)
+
+    def test_encrypt_stream(self):
+        groups = self.proc.encrypt_stream(iter(PLAINTEXT), ext_msg_ind='ABCDEF',
+                                          sys_ind='G')
+        self.assertEqual(next(groups), 'GGABC')
+        self.assertEqual(' '.join(groups), CIPHERTEXT[6:])
+
+        # The result must not depend on the chunk size:
+        pt = 'THE QUICK BROWN FOX JUMPS OVER THE LAZY DOG' * 20
+        expected = self.proc.encrypt(pt, ext_msg_ind='ABCDEF', sys_ind='G')
+        for chunk_size in (1, 3, 5, 7, 4096):
+            groups = self.proc.encrypt_stream(pt, ext_msg_ind='ABCDEF',
+                                              sys_ind='G', chunk_size=chunk_size)
+            self.assertEqual(' '.join(groups), expected)
+
+        # Nor on how the plaintext is split up:
+        for n in (1, 9, 300):
+            chunks = (pt[i:i + n] for i in range(0, len(pt), n))
+            groups = self.proc.encrypt_stream(chunks, ext_msg_ind='ABCDEF',
+                                              sys_ind='G', chunk_size=64)
+            self.assertEqual(' '.join(groups), expected)
+
+        groups = list(self.proc.encrypt_stream('', ext_msg_ind='ABCDEF',
+                                               sys_ind='G'))
+        self.assertEqual(5, len(groups))
+        self.assertEqual('XXXXX', groups[2])
+
     def test_encrypt_padding(self):
         """Ensure we pad the final group out to 5 chars."""
 
@@ -102,6 +236,14 @@ class ProcedureErrorsTestCase(unittest.TestCase):
         proc = StdProcedure(key_list=self.fm)
         self.assertRaises(ProcedureError, proc.encrypt, 'TEST', ext_msg_ind='WWWWWW')
 
+    def test_encrypt_stream_errors(self):
+        # Errors in the parameters are raised before any groups are produced:
+        proc = StdProcedure()
+        self.assertRaises(ProcedureError, proc.encrypt_stream, 'TEST')
+        proc = StdProcedure(key_list=self.fm)
+        self.assertRaises(ProcedureError, proc.encrypt_stream, 'TEST',
+                          sys_ind='!')
+
     def test_encrypt_bad_sys_ind(self):
         proc = StdProcedure(key_list=self.fm)
         self.assertRaises(ProcedureError, proc.encrypt, 'TEST', sys_ind='!')
@@ -111,6 +253,20 @@ class ProcedureErrorsTestCase(unittest.TestCase):
         self.assertRaisesRegex(ProcedureError, 'message format',
                 proc.set_decrypt_message, 'TEST')
 
+    def test_decrypt_stream_errors(self):
+        proc = StdProcedure(key_list=self.fm)
+        self.assertRaises(ProcedureError, proc.decrypt_stream)
+        self.assertRaisesRegex(ProcedureError, 'message format',
+                proc.set_decrypt_stream, ['GGABC DEF'])
+        self.assertRaisesRegex(ProcedureError, 'message format',
+                proc.set_decrypt_stream, ['GGABC DEF12'])
+        self.assertRaisesRegex(ProcedureError, 'system indicator',
+                proc.set_decrypt_stream, ['GHABC DEFFM'])
+
+        proc.set_decrypt_stream(['GGABC DEFYL NQHNL CAARZ OLTVX GGABC DEFYL'])
+        self.assertRaisesRegex(ProcedureError, 'YL', proc.decrypt_stream)
+        self.assertRaises(ProcedureError, proc.decrypt)
+
     def test_decrypt_invalid_sys_ind(self):
         proc = StdProcedure(key_list=self.fm)
 
@@ -0,0 +1,273 @@
+# Copyright (C) 2013 by Brian Neal.
+# This file is part of m209, the M-209 simulation.
+# m209 is released under the MIT License (see LICENSE.txt).
+
+import asyncio
+import contextlib
+import io
+import json
+import os
+import socket
+import tempfile
+import threading
+import unittest
+
+from ..client import call, encrypt, decrypt
+from ..keylist.config import read_key_list, write
+from ..keylist.key_list import KeyList
+from ..keylist.tests.test_lug_cache import use_temp_cache_dir
+from ..main import main
+from ..procedure import StdProcedure
+from ..protocol import ServiceError
+from ..server import CipherService, start_server
+
+
+KEY_LIST = KeyList(
+    indicator='AA',
+    lugs='0-4 0-5*4 0-6*6 1-0*5 1-2 1-5*4 3-0*3 3-4 3-6 5-6',
+    pin_list=[
+        'FGIKOPRSUVWYZ',
+        'DFGKLMOTUY',
+        'ADEFGIORTUVX',
+        'ACFGHILMRSU',
+        'BCDEFJKLPS',
+        'EFGHIJLMNP'],
+    letter_check='QLRRN TPTFU TRPTN MWQTV JLIJE J')
+
+PLAINTEXT = 'HOLD THE BRIDGE'
+
+
+class ServerTestBase(unittest.TestCase):
+    """Runs a server on a Unix socket and on TCP in a background thread for
+    the tests in a subclass.
+
+    """
+    @classmethod
+    def setUpClass(cls):
+        use_temp_cache_dir(cls.addClassCleanup)
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        # Clients name key list files relative to the service's key_dir:
+        cls.key_file = 'keys.cfg'
+        write(os.path.join(cls.tmpdir.name, cls.key_file), [KEY_LIST])
+        cls.socket_path = os.path.join(cls.tmpdir.name, 'm209.sock')
+
+        cls.service = CipherService(workers=2, key_dir=cls.tmpdir.name)
+        cls.loop = asyncio.new_event_loop()
+        cls.server = cls.loop.run_until_complete(
+                start_server(cls.socket_path, cls.service))
+        cls.tcp_server = cls.loop.run_until_complete(
+                start_server(service=cls.service, host='127.0.0.1', port=0))
+        cls.tcp_address = cls.tcp_server.sockets[0].getsockname()
+        cls.thread = threading.Thread(target=cls.loop.run_forever)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        async def shutdown():
+            for server in (cls.server, cls.tcp_server):
+                server.close()
+                await server.wait_closed()
+            # Let the connection handlers see their clients disconnect:
+            tasks = asyncio.all_tasks() - {asyncio.current_task()}
+            if tasks:
+                await asyncio.wait(tasks, timeout=5)
+
+        asyncio.run_coroutine_threadsafe(shutdown(), cls.loop).result()
+        cls.loop.call_soon_threadsafe(cls.loop.stop)
+        cls.thread.join()
+        cls.loop.close()
+        cls.service.close()
+        cls.tmpdir.cleanup()
+
+
+class ServerTestCase(ServerTestBase):
+
+    def test_encrypt_decrypt(self):
+        ct = encrypt(self.socket_path, self.key_file, PLAINTEXT,
+                     key_list_ind='AA', ext_ind='ABCDEF', sys_ind='G')
+
+        proc = StdProcedure(key_list=KEY_LIST)
+        expected = proc.encrypt(PLAINTEXT, ext_msg_ind='ABCDEF', sys_ind='G')
+        self.assertEqual(expected, ct)
+
+        pt = decrypt(self.socket_path, self.key_file, ct)
+        self.assertEqual(PLAINTEXT, pt.rstrip())
+
+    def test_errors(self):
+        self.assertRaisesRegex(ServiceError, 'key list not found',
+                encrypt, self.socket_path, self.key_file, PLAINTEXT,
+                key_list_ind='ZZ')
+        self.assertRaisesRegex(ServiceError, 'key list file not found',
+                encrypt, self.socket_path, self.key_file + 'x', PLAINTEXT)
+        self.assertRaisesRegex(ServiceError, 'invalid decrypt message format',
+                decrypt, self.socket_path, self.key_file, 'GGABC DEF')
+        self.assertRaisesRegex(ServiceError, 'unknown operation',
+                call, self.socket_path, {'op': 'nope'})
+        self.assertRaisesRegex(ServiceError, 'invalid or missing argument',
+                call, self.socket_path, {'op': 'encrypt', 'text': 'A'})
+
+    def pipeline(self, requests):
+        """Sends all the requests over one TCP connection before reading any
+        responses. Returns the responses in the order received.
+
+        """
+        with socket.create_connection(self.tcp_address) as sock:
+            sock.sendall(b''.join(json.dumps(r).encode() + b'\n'
+                                  for r in requests))
+            with sock.makefile('rb') as fp:
+                return [json.loads(fp.readline()) for _ in requests]
+
+    def test_pipeline(self):
+        proc = StdProcedure(key_list=KEY_LIST)
+        requests = []
+        expected = {}
+        for n in range(100):
+            ext_ind = 'ABCDE' + 'ABCDEFGHIJ'[n % 10]
+            requests.append({'id': n, 'op': 'encrypt', 'key_file': self.key_file,
+                             'text': PLAINTEXT, 'ext_ind': ext_ind,
+                             'sys_ind': 'G'})
+            expected[n] = proc.encrypt(PLAINTEXT, ext_msg_ind=ext_ind,
+                                       sys_ind='G')
+
+        # A long message goes to the worker pool and may finish last:
+        long_text = PLAINTEXT * 2000
+        requests.insert(0, {'id': 'long', 'op': 'encrypt',
+                            'key_file': self.key_file, 'text': long_text,
+                            'ext_ind': 'ABCDEF', 'sys_ind': 'G'})
+        expected['long'] = proc.encrypt(long_text, ext_msg_ind='ABCDEF',
+                                        sys_ind='G')
+
+        responses = self.pipeline(requests)
+        self.assertEqual(expected, {r['id']: r['result'] for r in responses})
+
+    def test_batches(self):
+        texts = [PLAINTEXT, 'SEND MORE AMMO', '']
+        ext_inds = ['ABCDEF', None, 'AAAAAA']
+        sys_inds = ['G', 'G', 'G']
+        response = self.service.handle({'op': 'encrypt_batch',
+                                        'key_file': self.key_file,
+                                        'texts': texts, 'ext_inds': ext_inds})
+        self.assertEqual(3, len(response['result']))
+
+        [response] = self.pipeline([{'op': 'encrypt_batch',
+                                     'key_file': self.key_file, 'texts': texts,
+                                     'ext_inds': ext_inds,
+                                     'sys_inds': sys_inds}])
+        messages = [item['result'] for item in response['result']]
+        proc = StdProcedure(key_list=KEY_LIST)
+        self.assertEqual(proc.encrypt(PLAINTEXT, ext_msg_ind='ABCDEF',
+                                      sys_ind='G'), messages[0])
+
+        [response] = self.pipeline([{'op': 'decrypt_batch',
+                                     'key_file': self.key_file,
+                                     'texts': messages + ['GGABC DEF']}])
+        results = response['result']
+        self.assertEqual(PLAINTEXT, results[0]['result'])
+        self.assertTrue(results[1]['result'].startswith('SEND MORE AMMO'))
+        self.assertIn('invalid decrypt message format', results[3]['error'])
+
+        responses = self.pipeline([
+            {'op': 'encrypt_batch', 'key_file': self.key_file, 'texts': 'A'},
+            {'op': 'encrypt_batch', 'key_file': self.key_file, 'texts': ['A'],
+             'ext_inds': []}])
+        for response in responses:
+            self.assertIn('invalid or missing argument', response['error'])
+
+    def test_keygen(self):
+        [response] = self.pipeline([{'op': 'keygen', 'indicators': ['AB', 'XY'],
+                                     'seed': 'test'}])
+        key_lists = [KeyList(**d) for d in response['result']]
+        self.assertEqual(['AB', 'XY'], [k.indicator for k in key_lists])
+
+        response = self.service.handle({'op': 'keygen', 'number': 2,
+                                        'seed': 'test'})
+        self.assertEqual(2, len(response['result']))
+
+        responses = self.pipeline([{'op': 'keygen', 'number': 0},
+                                   {'op': 'keygen', 'indicators': ['A1']},
+                                   {'op': 'keygen', 'number': 1, 'seed': []}])
+        for response in responses:
+            self.assertIn('invalid or missing argument', response['error'])
+
+    def test_invalid_request(self):
+        with socket.create_connection(self.tcp_address) as sock:
+            sock.sendall(b'not json\n[1, 2]\n')
+            with sock.makefile('rb') as fp:
+                for _ in range(2):
+                    response = json.loads(fp.readline())
+                    self.assertIn('invalid message', response['error'])
+
+    def test_command_line(self):
+        argv = ['encrypt', '-t', 'Hold the bridge!', '-k', 'AA', '-e', 'ABCDEF',
+                '-s', 'G', '-z', self.key_file, '--socket', self.socket_path]
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            main(argv)
+        ct = out.getvalue().strip()
+
+        proc = StdProcedure(key_list=KEY_LIST)
+        expected = proc.encrypt(PLAINTEXT, ext_msg_ind='ABCDEF', sys_ind='G')
+        self.assertEqual(expected, ct)
+
+        argv = ['decrypt', '-t', ct, '-z', self.key_file,
+                '--socket', self.socket_path]
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            main(argv)
+        self.assertEqual(PLAINTEXT, out.getvalue().rstrip())
+
+        argv = ['encrypt', '-t', 'TEST', '-k', 'ZZ', '-z', self.key_file,
+                '--socket', self.socket_path]
+        self.assertRaises(SystemExit, main, argv)
+
+        argv = ['serve', '--socket', self.socket_path + 'x', '--key-dir',
+                os.path.join(self.tmpdir.name, 'nope')]
+        self.assertRaises(SystemExit, main, argv)
+
+
+class CipherServiceTestCase(unittest.TestCase):
+
+    def test_key_cache(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            key_file = os.path.join(tmpdir, 'keys.cfg')
+            write(key_file, [KEY_LIST])
+
+            service = CipherService()
+            key = service.get_key(key_file, 'AA')
+            self.assertIs(key, service.get_key(key_file, 'AA'))
+            self.assertIsNone(service.get_key(key_file, 'ZZ'))
+
+            # A key is compiled again when its file changes:
+            write(key_file, [KEY_LIST._replace(lugs='1-0*27')])
+            os.utime(key_file, ns=(0, 0))
+            key2 = service.get_key(key_file, 'AA')
+            self.assertIsNot(key, key2)
+            self.assertEqual('1-0*27', key2.lugs)
+            self.assertEqual(key2.lugs, read_key_list(key_file, 'AA').lugs)
+
+    def test_key_dir(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            key_dir = os.path.join(tmpdir, 'keys')
+            os.makedirs(os.path.join(key_dir, 'sub'))
+            write(os.path.join(key_dir, 'sub', 'keys.cfg'), [KEY_LIST])
+            outside = os.path.join(tmpdir, 'outside.cfg')
+            write(outside, [KEY_LIST])
+            os.symlink(outside, os.path.join(key_dir, 'link.cfg'))
+
+            service = CipherService(workers=0, key_dir=key_dir)
+
+            def encrypt(key_file):
+                response = service.handle({'op': 'encrypt', 'text': 'A',
+                                           'key_file': key_file})
+                return response.get('error')
+
+            self.assertIsNone(encrypt('sub/keys.cfg'))
+            self.assertIsNone(encrypt('./sub/keys.cfg'))
+
+            for key_file in ['', outside, os.path.join(key_dir, 'sub/keys.cfg'),
+                             '../outside.cfg', 'sub/../sub/keys.cfg',
+                             'sub\\..\\..\\outside.cfg']:
+                self.assertIn('invalid key list file name', encrypt(key_file))
+
+            for key_file in ['link.cfg', 'sub', 'nope.cfg']:
+                self.assertIn('key list file not found', encrypt(key_file))
@@ -0,0 +1,95 @@
+# Copyright (C) 2013 by Brian Neal.
+# This file is part of m209, the M-209 simulation.
+# m209 is released under the MIT License (see LICENSE.txt).
+
+"""test_vector.py - Unit tests for the numpy cipher engine."""
+
+import random
+import string
+import unittest
+
+from .. import M209Error
+from ..converter import M209
+from .. import vector
+from .test_converter import AA_LUGS, AA_PIN_LIST, AA_CHECK
+
+
+@unittest.skipUnless(vector.AVAILABLE, 'NumPy is not installed')
+class VectorEngineTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.m1 = M209(AA_LUGS, AA_PIN_LIST)
+        self.m2 = M209(AA_LUGS, AA_PIN_LIST, engine='numpy')
+
+    def assertSameState(self, m1, m2):
+        self.assertEqual(m1.letter_counter, m2.letter_counter)
+        self.assertEqual([kw.pos for kw in m1.key_wheels],
+                         [kw.pos for kw in m2.key_wheels])
+
+    def test_letter_check(self):
+        self.assertEqual(AA_CHECK, self.m2.encrypt('A' * 26))
+        self.assertEqual(26, self.m2.letter_counter)
+
+    def test_matches_python_engine(self):
+        rng = random.Random(209)
+        for n in [0, 1, 5, 26, 1000, 5000]:
+            pt = ''.join(rng.choice(string.ascii_uppercase + ' ')
+                         for i in range(n))
+            wheels = self.m1.set_random_key_wheels()
+            self.m2.set_key_wheels(wheels)
+
+            ct1 = self.m1.encrypt(pt)
+            ct2 = self.m2.encrypt(pt)
+            self.assertEqual(ct1, ct2)
+            self.assertSameState(self.m1, self.m2)
+
+            self.m1.set_key_wheels(wheels)
+            self.m2.set_key_wheels(wheels)
+            pt1 = self.m1.decrypt(ct1)
+            pt2 = self.m2.decrypt(ct2)
+            self.assertEqual(pt1, pt2)
+            self.assertEqual(pt.replace('Z', ' '), pt2)
+            self.assertSameState(self.m1, self.m2)
+
+    def test_bytes_matches_python_engine(self):
+        rng = random.Random(209)
+        for n in [0, 1, 5, 6, 26, 1000]:
+            pt = ''.join(rng.choice(string.ascii_uppercase + ' ')
+                         for i in range(n)).encode('ascii')
+            wheels = self.m1.set_random_key_wheels()
+            for group in [True, False]:
+                self.m1.set_key_wheels(wheels)
+                self.m2.set_key_wheels(wheels)
+                ct1 = self.m1.encrypt_bytes(pt, group=group)
+                ct2 = self.m2.encrypt_bytes(pt, group=group)
+                self.assertEqual(ct1, ct2)
+                self.assertSameState(self.m1, self.m2)
+
+                self.m1.set_key_wheels(wheels)
+                self.m2.set_key_wheels(wheels)
+                self.assertEqual(self.m1.decrypt_bytes(ct1),
+                                 self.m2.decrypt_bytes(bytearray(ct2)))
+                self.assertSameState(self.m1, self.m2)
+
+    def test_generator_input(self):
+        pt = 'ATTACK AT DAWN'
+        ct1 = self.m1.encrypt(pt)
+        ct2 = self.m2.encrypt(c for c in pt)
+        self.assertEqual(ct1, ct2)
+
+    def test_illegal_chars(self):
+        self.assertRaises(M209Error, self.m2.encrypt, 'ATTACK AT DAWN!')
+        self.assertRaises(M209Error, self.m2.encrypt, 'attack')
+        self.assertRaises(M209Error, self.m2.encrypt, 'ATTACKÉ')
+        self.assertRaises(M209Error, self.m2.encrypt, 'ATTACK AT DAWN',
+                          spaces=False)
+        self.assertEqual(0, self.m2.letter_counter)
+
+
+class EngineSelectTestCase(unittest.TestCase):
+
+    def test_invalid_engine(self):
+        self.assertRaises(M209Error, M209, engine='fortran')
+        m = M209()
+        self.assertRaises(M209Error, m.set_engine, 'fortran')
+        self.assertEqual('python', m.engine)
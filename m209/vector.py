@@ -0,0 +1,83 @@
+# Copyright (C) 2013 by Brian Neal.
+# This file is part of m209, the M-209 simulation.
+# m209 is released under the MIT License (see LICENSE.txt).
+
+"""This module contains an optional vectorized cipher engine for the M209 class
+that is built on NumPy.
+
+Because all six key wheels step once for every letter, the key wheel positions
+for the k-th letter of a message are simply (starting position + k) modulo the
+number of pins on each wheel. This allows the guide arm positions, and thus the
+drum counts, to be computed for an entire message at once with array
+operations instead of simulating the machine one letter at a time.
+
+NumPy is not required by the m209 package. If it is not installed, the
+AVAILABLE flag will be False and cipher() will raise an M209Error.
+
+"""
+from . import M209Error
+
+try:
+    import numpy
+except ImportError:     # pragma: no cover
+    numpy = None
+
+AVAILABLE = numpy is not None
+
+
+def cipher(m_209, text):
+    """Perform a cipher operation on every letter of the string text using the
+    M209 instance m_209, and return the result as a string.
+
+    The key wheels of m_209 are advanced and its letter counter incremented
+    exactly as if each letter had been ciphered one at a time. The text is
+    validated before any letters are ciphered; if it contains a character
+    outside 'A'-'Z' an M209Error is raised and m_209 is left unchanged.
+
+    """
+    if not AVAILABLE:
+        raise M209Error("the numpy engine requires NumPy to be installed")
+
+    try:
+        data = numpy.frombuffer(text.encode('ascii'), dtype=numpy.uint8)
+    except UnicodeEncodeError as ex:
+        raise M209Error("Illegal char: {}".format(text[ex.start]))
+
+    return cipher_array(m_209, data).tobytes().decode('ascii')
+
+
+def cipher_array(m_209, data):
+    """Perform a cipher operation on every letter in data, a NumPy array of
+    ASCII codes, using the M209 instance m_209. The result is returned as a new
+    uint8 array of ASCII codes.
+
+    The same validation and machine state rules as cipher() apply.
+
+    """
+    if not AVAILABLE:
+        raise M209Error("the numpy engine requires NumPy to be installed")
+
+    illegal = (data < ord('A')) | (data > ord('Z'))
+    if illegal.any():
+        raise M209Error("Illegal char: {}".format(chr(data[illegal.argmax()])))
+
+    n = len(data)
+    steps = numpy.arange(n, dtype=numpy.int64)
+
+    # Build the guide arm mask for every letter position:
+    masks = numpy.zeros(n, dtype=numpy.uint8)
+    for i, kw in enumerate(m_209.key_wheels):
+        guide_bits = (kw.guide_pins >> numpy.arange(kw.num_pins)) & 1
+        positions = (steps + kw.pos) % kw.num_pins
+        masks |= (guide_bits[positions] << i).astype(numpy.uint8)
+
+    counts = numpy.array(m_209.drum.count_table, dtype=numpy.int64)[masks]
+
+    # The internal substitution table is the reversed alphabet:
+    result = ord('Z') - (data.astype(numpy.int64) - ord('A') - counts) % 26
+
+    for kw in m_209.key_wheels:
+        kw.rotate(n)
+    m_209.letter_counter += n
+
+    return result.astype(numpy.uint8)
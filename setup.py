@@ -18,6 +18,7 @@ setup(
     description='A historically accurate M-209 simulation library.',
     long_description=open(join(dirname(__file__), 'README.rst'), encoding='utf-8').read(),
     packages=['m209', 'm209.tests', 'm209.keylist', 'm209.keylist.tests'],
+    package_data={'m209.keylist': ['lugs-v*.xz']},
     scripts=['scripts/m209'],
     classifiers = [
         'Development Status :: 3 - Alpha',